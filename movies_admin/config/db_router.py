@@ -0,0 +1,134 @@
+"""
+Маршрутизация чтения на реплики базы данных.
+
+ReplicaMiddleware выбирает для GET-запросов к API одну из реплик, отстающих от мастера
+не больше чем на REPLICA_MAX_LAG секунд, и запоминает ее на время запроса.
+ReplicaRouter отправляет на нее чтение, все записи и миграции идут в default.
+Если подходящей реплики нет, чтение API идет в основную базу через алиас api
+с ограничением statement_timeout.
+После любого изменяющего запроса клиент получает подписанную cookie, и следующие REPLICA_PIN_SECONDS
+секунд его чтение тоже идет в основную базу, чтобы он видел свои изменения.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections, DatabaseError
+
+PRIMARY = 'default'
+API_DATABASE = 'api'
+PIN_COOKIE = 'db_primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_read_alias = ContextVar('read_alias', default=None)
+
+# {алиас реплики: (время проверки, отставание в секундах или None, если реплика недоступна)}
+_replica_lag = {}
+
+REPLICA_LAG_QUERY = '''
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+
+def is_pinned(request):
+    """
+    Закреплен ли клиент за основной базой. Cookie подписана, поддельная или устаревшая не учитывается:
+    по ней запрос идет мимо реплик и кэшей API
+    """
+    return request.get_signed_cookie(PIN_COOKIE, default=None, max_age=settings.REPLICA_PIN_SECONDS) is not None
+
+
+def pin_cookie_value():
+    """
+    Подписанное значение cookie закрепления для запросов самого приложения (обновление кэша nginx)
+    """
+    return signing.get_cookie_signer(salt=PIN_COOKIE).sign('1')
+
+
+def get_replica_lag(alias):
+    """
+    Отставание реплики от мастера, кэшируется на REPLICA_LAG_CHECK_INTERVAL секунд
+    :param alias: алиас реплики в DATABASES
+    :return: отставание в секундах или None, если реплика недоступна
+    """
+    now = time.monotonic()
+    checked_at, lag = _replica_lag.get(alias, (None, None))
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(REPLICA_LAG_QUERY)
+            lag = float(cursor.fetchone()[0])
+    except DatabaseError:
+        connections[alias].close()
+        lag = None
+    _replica_lag[alias] = (now, lag)
+    return lag
+
+
+def choose_read_database():
+    """
+    Случайная реплика из тех, что доступны и отстают не больше REPLICA_MAX_LAG, иначе основная база
+    """
+    healthy = []
+    for alias in settings.REPLICA_DATABASES:
+        lag = get_replica_lag(alias)
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG:
+            healthy.append(alias)
+    return random.choice(healthy) if healthy else API_DATABASE
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Чтение API внутри блока идет в основную базу через алиас api, даже если для запроса выбрана реплика
+    """
+    token = _read_alias.set(API_DATABASE)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        alias = None
+        if request.method in SAFE_METHODS and request.path.startswith(settings.REPLICA_READ_PATHS):
+            if settings.REPLICA_DATABASES and not is_pinned(request):
+                alias = choose_read_database()
+            else:
+                alias = API_DATABASE
+
+        token = _read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+
+        if request.method not in SAFE_METHODS and settings.REPLICA_DATABASES:
+            response.set_signed_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        return response
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
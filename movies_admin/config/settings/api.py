@@ -0,0 +1,20 @@
+"""
+Профиль воркеров, которые обслуживают только API: без админки, сообщений и статики
+и с URLconf только для /api/, поэтому воркер не импортирует админку и ее шаблоны.
+Запуск: gunicorn config.wsgi_api:application
+"""
+from .production import *
+
+API_EXCLUDED_APPS = ('django.contrib.admin', 'django.contrib.messages', 'django.contrib.staticfiles')
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in API_EXCLUDED_APPS]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+              if middleware != 'django.contrib.messages.middleware.MessageMiddleware']
+
+ROOT_URLCONF = 'config.urls_api'
+
+# API не рендерит шаблоны
+TEMPLATES = []
+
+WSGI_APPLICATION = 'config.wsgi_api.application'
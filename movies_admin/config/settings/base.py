@@ -41,11 +41,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'movies'
+    'movies.apps.MoviesConfig'
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'movies.api.middleware.ApiCompressionMiddleware',
+    'movies.api.middleware.ApiThrottleMiddleware',
+    'config.db_router.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -89,6 +92,89 @@ DATABASES = {
     }
 }
 
+# Чтение API из основной базы идет через отдельное соединение с ограничением времени запроса,
+# чтобы тяжелый запрос клиента не занимал базу дольше API_STATEMENT_TIMEOUT миллисекунд
+API_STATEMENT_TIMEOUT = int(os.getenv('API_STATEMENT_TIMEOUT', 5000))
+DATABASES['api'] = {
+    **DATABASES['default'],
+    'OPTIONS': {'options': '-c statement_timeout={}'.format(API_STATEMENT_TIMEOUT)},
+    'TEST': {'MIRROR': 'default'},
+}
+
+# Реплики только для чтения: хосты через пробел, для каждого можно указать порт - "replica1 replica2:5433".
+# Недоступная реплика не держит запрос дольше REPLICA_CONNECT_TIMEOUT секунд при проверке отставания
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2))
+REPLICA_DATABASES = []
+for number, replica in enumerate(os.getenv('REPLICA_HOSTS', '').split(), start=1):
+    replica_host, _, replica_port = replica.partition(':')
+    alias = 'replica_{}'.format(number)
+    DATABASES[alias] = {
+        **DATABASES['api'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'OPTIONS': {**DATABASES['api']['OPTIONS'], 'connect_timeout': REPLICA_CONNECT_TIMEOUT},
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['config.db_router.ReplicaRouter']
+
+# На реплики уходят только GET-запросы с этими префиксами
+REPLICA_READ_PATHS = ('/api/',)
+# Максимальное отставание реплики в секундах, при большем чтение идет в default
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+# Как часто перепроверять отставание реплик
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', 1))
+# Сколько секунд после изменяющего запроса клиент читает из default
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+# HTTP-кэширование ответов API: время жизни в кэше и сколько еще можно отдавать устаревший ответ,
+# пока он обновляется в фоне
+API_CACHE_MAX_AGE = int(os.getenv('API_CACHE_MAX_AGE', 60))
+API_CACHE_STALE_WHILE_REVALIDATE = int(os.getenv('API_CACHE_STALE_WHILE_REVALIDATE', 30))
+# Адрес nginx, через который обновляется кэш страниц фильмов после изменений, пустой - не обновлять
+API_CACHE_REFRESH_URL = os.getenv('API_CACHE_REFRESH_URL', '')
+API_CACHE_REFRESH_TIMEOUT = float(os.getenv('API_CACHE_REFRESH_TIMEOUT', 2))
+# LRU-кэш страниц фильмов в каждом процессе: сколько фильмов хранить (0 - не кэшировать) и сколько секунд.
+# Изменения из других процессов видны не позже чем через API_MOVIE_CACHE_TTL секунд
+API_MOVIE_CACHE_SIZE = int(os.getenv('API_MOVIE_CACHE_SIZE', 5000))
+API_MOVIE_CACHE_TTL = float(os.getenv('API_MOVIE_CACHE_TTL', 5))
+
+# Ответы API короче этого размера в байтах не сжимаются
+API_COMPRESS_MIN_SIZE = int(os.getenv('API_COMPRESS_MIN_SIZE', 1024))
+
+# Уровень сжатия brotli (0-11). По умолчанию модуль сжимает с уровнем 11, это в десятки раз медленнее
+# уровней 4-5 при выигрыше в размере на несколько процентов
+API_COMPRESS_BROTLI_QUALITY = int(os.getenv('API_COMPRESS_BROTLI_QUALITY', 5))
+
+# Ограничение частоты запросов к API на клиента (API-ключ из X-Api-Key или IP): запросов в секунду
+# и допустимый всплеск, 0 - без ограничения. По умолчанию считается в памяти каждого воркера,
+# API_RATE_LIMIT_CACHE - алиас общего кэша из CACHES для подсчета на все воркеры в окне API_RATE_WINDOW секунд
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', 20))
+API_RATE_BURST = int(os.getenv('API_RATE_BURST', 40))
+API_RATE_WINDOW = int(os.getenv('API_RATE_WINDOW', 10))
+API_RATE_LIMIT_CACHE = os.getenv('API_RATE_LIMIT_CACHE', '')
+API_RATE_LIMIT_MAX_CLIENTS = 10000
+# Выданные клиентам API-ключи через пробел. Лимит считается по ключу только для ключей из этого списка,
+# запросы с другими ключами считаются по IP
+API_KEYS = frozenset(os.getenv('API_KEYS', '').split())
+# Заголовок с IP клиента за прокси, например HTTP_X_REAL_IP; пустой - REMOTE_ADDR
+API_CLIENT_IP_HEADER = os.getenv('API_CLIENT_IP_HEADER', '')
+# Сколько тяжелых запросов к фильмам выполняется одновременно в одном воркере (из GUNICORN_THREADS потоков)
+# и сколько секунд запрос ждет очереди, прежде чем получить 503
+API_MAX_CONCURRENT_QUERIES = int(os.getenv('API_MAX_CONCURRENT_QUERIES', 2))
+API_QUEUE_TIMEOUT = float(os.getenv('API_QUEUE_TIMEOUT', 0.5))
+# Одинаковые одновременные запросы к фильмам выполняются один раз в воркере, остальные ждут до
+# API_COALESCE_TIMEOUT секунд. API_COALESCE_CACHE - алиас общего кэша из CACHES, чтобы объединять запросы
+# всех воркеров; ответ хранится в нем API_COALESCE_RESULT_TTL секунд
+API_COALESCE = os.getenv('API_COALESCE', '1') == '1'
+API_COALESCE_CACHE = os.getenv('API_COALESCE_CACHE', '')
+API_COALESCE_TIMEOUT = float(os.getenv('API_COALESCE_TIMEOUT', API_STATEMENT_TIMEOUT / 1000))
+API_COALESCE_RESULT_TTL = int(os.getenv('API_COALESCE_RESULT_TTL', 1))
+
+# Сколько секунд изменение фильма выдерживается перед выдачей в списке по updated_since
+MOVIES_CHANGES_SETTLE_SECONDS = int(os.getenv('MOVIES_CHANGES_SETTLE_SECONDS', 5))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
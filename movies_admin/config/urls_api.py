@@ -0,0 +1,9 @@
+"""
+URLconf воркеров только для API (config.settings.api): без админки
+"""
+from django.urls import path
+from django.urls import include
+
+urlpatterns = [
+    path('api/', include('movies.api.urls'))
+]
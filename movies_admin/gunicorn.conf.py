@@ -0,0 +1,48 @@
+"""
+Настройки gunicorn, подхватываются автоматически при запуске из папки movies_admin:
+    gunicorn config.wsgi:application
+Для ASGI: GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn config.asgi:application
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# По умолчанию 2 воркера на ядро + 1, как рекомендует документация gunicorn
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Воркеры с потоками: пока один запрос ждет базу, остальные потоки воркера обслуживают другие.
+# Ограничение тяжелых запросов (shed_load) и объединение одинаковых запросов (coalesce_requests) действуют
+# на потоки внутри воркера, в sync-воркере с одним потоком им нечего ограничивать и объединять
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Приложение импортируется один раз в мастере, воркеры получают его через fork
+# и делят неизмененные страницы памяти
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+# Сколько секунд воркер дорабатывает текущие запросы при перезапуске (HUP, TERM)
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Периодический перезапуск воркеров ограничивает рост памяти, jitter не дает им перезапуститься одновременно
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Соединения с базой, открытые в мастере при загрузке, нельзя делить между процессами
+    from django.db import connections
+    connections.close_all()
+
+
+def when_ready(server):
+    # Прогрев буферов Postgres и кэша nginx после запуска, отдельным процессом, чтобы не держать соединения в мастере
+    if os.getenv('GUNICORN_WARM_CACHE'):
+        server.log.info('Warming API cache')
+        subprocess.Popen([sys.executable, 'manage.py', 'warm_api_cache'] + os.getenv('GUNICORN_WARM_CACHE_ARGS', '').split())
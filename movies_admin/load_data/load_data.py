@@ -1,6 +1,17 @@
+import argparse
+import cProfile
+import json
+import logging
 import os
+import random
+import resource
 import sqlite3
+import sys
+import time
+import tracemalloc
 import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
 from datetime import date
 from dataclasses import dataclass
 from typing import List
@@ -15,6 +26,19 @@ from dotenv import load_dotenv
 psycopg2.extras.register_uuid()
 load_dotenv()
 
+logger = logging.getLogger('load_data')
+
+
+def time_ordered_uuid():
+    """
+    UUID в формате UUIDv7 (первые 48 бит - время в миллисекундах), как movies.models.time_ordered_uuid.
+    Связи фильмов вставляются в конец индекса первичного ключа, а не в случайные страницы
+    """
+    value = (time.time_ns() // 1000000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return uuid.UUID(int=value)
+
 
 # Класс для формирования объектов фильмов для дальнейшей записи в таблицу film_work
 @dataclass()
@@ -65,6 +89,269 @@ class PersonFilm:
 uploaded_people = {}
 uploaded_genres = {}
 
+# Значение, которым в db.sqlite обозначено отсутствие данных
+NOT_AVAILABLE = 'N/A'
+# Ограничения таблиц content: длина названий и имен, типы кинопроизведений, шкала рейтинга
+MAX_NAME_LENGTH = 255
+FILM_WORK_TYPES = ('movie', 'tv_show')
+RATING_RANGE = (0, 10)
+# Роли персон в person_film_work (movies.models.PersonRole)
+ROLES = ('actor', 'director', 'writer')
+
+
+# Результат одного этапа загрузки: сколько строк обработано
+@dataclass()
+class StageRecord:
+    rows: int = 0
+
+
+class LoadStats:
+    """
+    Класс для сбора времени, количества строк и памяти по этапам загрузки (extract, transform, load)
+    """
+
+    def __init__(self, stats_file=None):
+        """
+        :param stats_file: открытый файл, в который пишется по строке JSON на каждую пачку и итог
+        """
+        self.stats_file = stats_file
+        self.totals = defaultdict(lambda: {'seconds': 0.0, 'rows': 0, 'memory': 0})
+        self.batch = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Замер одного этапа. Память - прирост выделенной python памяти за этап, если включен tracemalloc
+        :param name: название этапа
+        :return: StageRecord, в который вызывающий код записывает количество строк
+        """
+        record = StageRecord()
+        memory_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        started = time.perf_counter()
+        yield record
+        seconds = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0] - memory_before if tracemalloc.is_tracing() else 0
+
+        self.batch[name] = {'seconds': round(seconds, 4), 'rows': record.rows, 'memory': memory}
+        total = self.totals[name]
+        total['seconds'] += seconds
+        total['rows'] += record.rows
+        total['memory'] += memory
+
+    def batch_done(self, number: int):
+        """
+        Вывод замеров пачки в лог и в файл статистики
+        :param number: номер пачки
+        """
+        batch, self.batch = self.batch, {}
+        batch_seconds = sum(stage['seconds'] for stage in batch.values())
+        loaded = batch.get('load', {}).get('rows', 0)
+        logger.info('batch %s: %s, %.0f rows/s, max rss %s KB', number, ', '.join(
+            '{} {:.3f}s {} rows'.format(name, stage['seconds'], stage['rows']) for name, stage in batch.items()
+        ), loaded / batch_seconds if batch_seconds else 0, self.max_rss())
+        self.write({'batch': number, 'stages': batch, 'max_rss': self.max_rss()})
+
+    def summary(self):
+        """
+        Вывод итоговых замеров по этапам
+        """
+        seconds = time.perf_counter() - self.started
+        for name, total in self.totals.items():
+            logger.info('%s: %.3fs (%.0f%%), %s rows, %.0f rows/s, memory %s bytes', name, total['seconds'],
+                        100 * total['seconds'] / seconds if seconds else 0, total['rows'],
+                        total['rows'] / total['seconds'] if total['seconds'] else 0, total['memory'])
+        movies = self.totals['extract']['rows'] if 'extract' in self.totals else 0
+        logger.info('total: %.3fs, %s movies, %.0f movies/s, max rss %s KB', seconds, movies,
+                    movies / seconds if seconds else 0, self.max_rss())
+        self.write({'total': round(seconds, 4), 'movies': movies, 'stages': self.totals, 'max_rss': self.max_rss()})
+
+    def write(self, record: dict):
+        if self.stats_file:
+            self.stats_file.write(json.dumps(record) + '\n')
+
+    @staticmethod
+    def max_rss():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Validator:
+    """
+    Класс для проверки строк при переносе: типы и длина полей, значения N/A, повторяющиеся названия
+    и имена, ссылки связей на перенесенные фильмы, жанры и персоны.
+    Виды из ERRORS - строки, которые Postgres не примет или примет с неверными данными, остальные - статистика
+    """
+    ERRORS = ('wrong_type', 'empty_value', 'too_long', 'not_available', 'invalid_rating', 'rating_out_of_range',
+              'unknown_reference')
+    max_examples = 3
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.examples = defaultdict(list)
+        self.film_ids = set()
+        self.genre_ids = set()
+        self.person_ids = set()
+        self.titles = set()
+        self.credits = set()
+        # Имена без учета регистра и пробелов: {вид: {нормализованное имя: имя}}
+        self.names = defaultdict(dict)
+
+    def add(self, kind: str, example):
+        """
+        Учет одной проблемы
+        :param kind: вид проблемы
+        :param example: значение или объект, сохраняется в отчет, если примеров этого вида еще мало
+        """
+        self.counts[kind] += 1
+        if len(self.examples[kind]) < self.max_examples:
+            self.examples[kind].append(str(example))
+
+    @property
+    def errors(self):
+        return sum(self.counts.get(kind, 0) for kind in self.ERRORS)
+
+    def check_row(self, movie: dict):
+        """
+        Учет пропущенных значений в строке из SQLiteLoader.get_movies_full_info
+        """
+        if movie['description'] is None:
+            self.counts['no_description'] += 1
+        if movie['rating'] in (None, '', NOT_AVAILABLE):
+            self.counts['no_rating'] += 1
+        if movie['director'] == NOT_AVAILABLE:
+            self.counts['no_director'] += 1
+        for field in ('genres', 'actors', 'writers'):
+            self.counts['not_available_' + field] += movie[field].count(NOT_AVAILABLE)
+
+    def check_text(self, obj, field: str, required: bool = True):
+        """
+        Проверка текстового поля объекта: строка, не пустая, не N/A, помещается в колонку
+        :param required: False - поле может быть None
+        """
+        value = getattr(obj, field)
+        if value is None and not required:
+            return
+        if not isinstance(value, str):
+            self.add('wrong_type', '{}.{}={!r}'.format(type(obj).__name__, field, value))
+        elif not value.strip():
+            self.add('empty_value', '{}.{}'.format(type(obj).__name__, field))
+        elif value.strip() == NOT_AVAILABLE:
+            self.add('not_available', '{}.{}'.format(type(obj).__name__, field))
+        elif len(value) > MAX_NAME_LENGTH and field != 'description':
+            self.add('too_long', '{}.{}={!r}'.format(type(obj).__name__, field, value[:50]))
+
+    def check_name(self, kind: str, name):
+        """
+        Учет названий, которые отличаются только регистром или пробелами: при переносе это разные записи
+        """
+        if not isinstance(name, str):
+            return
+        key = ' '.join(name.split()).casefold()
+        seen = self.names[kind].setdefault(key, name)
+        if seen != name:
+            self.add('similar_' + kind, '{!r} / {!r}'.format(seen, name))
+
+    def check_objects(self, values: dict):
+        """
+        Проверка объектов, подготовленных SQLiteLoader.create_objects
+        :param values: словарь с ключами film_works, genres, people, genre_film_works, person_film_works
+        """
+        for film in values['film_works']:
+            if not isinstance(film.id, uuid.UUID):
+                self.add('wrong_type', 'Movie.id={!r}'.format(film.id))
+            self.check_text(film, 'title')
+            self.check_text(film, 'description', required=False)
+            if film.type not in FILM_WORK_TYPES:
+                self.add('wrong_type', 'Movie.type={!r}'.format(film.type))
+            if film.rating is not None:
+                if not isinstance(film.rating, float):
+                    self.add('wrong_type', 'Movie.rating={!r}'.format(film.rating))
+                elif not RATING_RANGE[0] <= film.rating <= RATING_RANGE[1]:
+                    self.add('rating_out_of_range', '{}: {}'.format(film.title, film.rating))
+            if film.title in self.titles:
+                self.add('duplicate_title', film.title)
+            self.titles.add(film.title)
+            self.film_ids.add(film.id)
+
+        for genre in values['genres']:
+            self.check_text(genre, 'name')
+            self.check_name('genre', genre.name)
+            self.genre_ids.add(genre.id)
+
+        for person in values['people']:
+            self.check_person(person)
+
+        for genre_film in values['genre_film_works']:
+            if genre_film.film_id not in self.film_ids or genre_film.genre_id not in self.genre_ids:
+                self.add('unknown_reference', genre_film)
+
+        for person_film in values['person_film_works']:
+            if person_film.film_id not in self.film_ids or person_film.person_id not in self.person_ids:
+                self.add('unknown_reference', person_film)
+            # Повтор связи не попадет в базу (on conflict do nothing)
+            credit = (person_film.film_id, person_film.person_id, person_film.role)
+            if credit in self.credits:
+                self.add('duplicate_credit', '{} {} {}'.format(*credit))
+            self.credits.add(credit)
+
+    def check_person(self, person):
+        """
+        Проверка объекта Person, в том числе добавленного после переноса фильмов (check_left_people)
+        """
+        self.check_text(person, 'full_name')
+        self.check_name('person', person.full_name)
+        self.person_ids.add(person.id)
+
+    def report(self, stats: LoadStats):
+        """
+        Вывод найденных проблем в лог и в файл статистики
+        """
+        for kind, count in sorted(self.counts.items()):
+            if count:
+                logger.log(logging.WARNING if kind in self.ERRORS else logging.INFO, '%s %s: %s%s',
+                           'error' if kind in self.ERRORS else 'check', kind, count,
+                           ' (e.g. {})'.format('; '.join(self.examples[kind])) if self.examples[kind] else '')
+        logger.info('validation: %s errors', self.errors)
+        stats.write({'validation': {'errors': self.errors, 'counts': self.counts, 'examples': self.examples}})
+
+
+class SampledLoggingConnection(LoggingConnection):
+    """
+    Соединение, записывающее в лог только долю запросов sample_rate
+    """
+    sample_rate = 1.0
+
+    def filter(self, msg, curs):
+        if random.random() < self.sample_rate:
+            return super().filter(msg, curs)
+        return None
+
+
+def sampled(write, sample_rate: float):
+    """
+    Обертка над функцией записи в лог, пропускающая только долю запросов sample_rate
+    """
+    def trace(statement):
+        if random.random() < sample_rate:
+            write(statement + '\n')
+    return trace
+
+
+# Денормализованные массивы film_work, как в movies.models.refresh_role_arrays: имена и id упорядочены одинаково,
+# по имени, затем по id
+PERSON_ARRAY = """coalesce((select array_agg({value} order by p.full_name, p.id)
+    from content.person_film_work pfw join content.person p on p.id = pfw.person_id
+    where pfw.film_work_id = f.id and pfw.role = '{role}'), '{{}}')"""
+GENRE_ARRAY = """coalesce((select array_agg({value} order by g.name, g.id)
+    from content.genre_film_work gfw join content.genre g on g.id = gfw.genre_id
+    where gfw.film_work_id = f.id), '{{}}')"""
+FILL_ARRAYS_QUERY = 'update content.film_work f set {} where f.id = any(%s)'.format(', '.join(
+    ['{}_names = {}'.format(role, PERSON_ARRAY.format(value='p.full_name::text', role=role)) for role in ROLES]
+    + ['{}_ids = {}'.format(role, PERSON_ARRAY.format(value='p.id', role=role)) for role in ROLES]
+    + ['genre_names = {}'.format(GENRE_ARRAY.format(value='g.name::text')),
+       'genre_ids = {}'.format(GENRE_ARRAY.format(value='g.id'))]
+))
+
 
 class PostgresSaver:
     """
@@ -74,26 +361,42 @@ class PostgresSaver:
     def __init__(self, pg_cursor, sqlite_cursor):
         self.pg_cursor = pg_cursor
         self.sqlite_cursor = sqlite_cursor
+        # Журнал изменений создается миграциями Django. При первом запуске загрузка идет до миграций,
+        # журнала еще нет и читать его некому
+        self.pg_cursor.execute("select to_regclass('content.film_work_change') is not null")
+        self.log_changes = self.pg_cursor.fetchone()[0]
+        # Массивы участников и жанров тоже добавляются миграциями, при первом запуске их заполнит миграция
+        self.pg_cursor.execute("""
+            select exists(select 1 from information_schema.columns
+                          where table_schema = 'content' and table_name = 'film_work' and column_name = 'actor_ids')
+        """)
+        self.fill_arrays = self.pg_cursor.fetchone()[0]
 
     def load_objects(self, values):
         """
-        Загрузка данных в таблицы film_works, genre, people, genre_film_work, person_film_work
+        Загрузка данных в таблицы film_works, genre, people, genre_film_work, person_film_work,
+        заполнение массивов участников и жанров загруженных фильмов и запись их в журнал изменений
+        film_work_change в той же транзакции
         :param values: словарь с ключами film_works, genres, people, genre_film_works, person_film_works.
         Значения словаря - списки объектов классов Movie, Genre, Person, GenreFilm, PersonFilm
-        :return:
+        :return: количество строк, отправленных в базу
         """
 
+        loaded = 0
+
         if values['film_works']:
             data = [(film.id, film.title, film.type, film.description, film.rating)
                     for film in values['film_works']]
             insert_query = 'insert into content.film_work (id, title, type, description, rating) values %s'
             execute_values(self.pg_cursor, insert_query, data, template=None)
+            loaded += len(data)
 
         if values['genres']:
             data = [(genre.id, genre.name)
                     for genre in values['genres']]
             insert_query = 'insert into content.genre (id, name) values %s'
             execute_values(self.pg_cursor, insert_query, data, template=None)
+            loaded += len(data)
             uploaded_genres.update({genre.name: genre for genre in values['genres']})
 
         if values['people']:
@@ -101,6 +404,7 @@ class PostgresSaver:
                     for person in values['people']]
             insert_query = 'insert into content.person (id, full_name) values %s'
             execute_values(self.pg_cursor, insert_query, data, template=None)
+            loaded += len(data)
             uploaded_people.update({person.full_name: person for person in values['people']})
 
         if values['genre_film_works']:
@@ -112,6 +416,7 @@ class PostgresSaver:
                 on conflict (film_work_id, genre_id) do nothing
                 '''
             execute_values(self.pg_cursor, insert_query, data, template=None)
+            loaded += len(data)
 
         if values['person_film_works']:
             data = [(person_film.id, person_film.film_id, person_film.person_id, person_film.role)
@@ -122,33 +427,88 @@ class PostgresSaver:
                 on conflict (film_work_id, person_id, role) do nothing
                 '''
             execute_values(self.pg_cursor, insert_query, data, template=None)
+            loaded += len(data)
+
+        film_ids = {film.id for film in values['film_works']}
+        film_ids.update(link.film_id for link in values['genre_film_works'])
+        film_ids.update(link.film_id for link in values['person_film_works'])
+
+        if self.fill_arrays and film_ids:
+            self.pg_cursor.execute(FILL_ARRAYS_QUERY, (list(film_ids),))
+
+        if self.log_changes:
+            if film_ids:
+                insert_query = 'insert into content.film_work_change (film_work_id, created_at) values %s'
+                execute_values(self.pg_cursor, insert_query, [(film_id,) for film_id in film_ids],
+                               template='(%s, now())')
+                loaded += len(film_ids)
+
+        return loaded
 
     def check_left_people(self, table: str):
         """
         Проверка, что перенесены все персоны из таблиц actors, writers. Вызывыется после переноса всех фильмов.
         При нахождении неперенесенных персон, добавляет их в таблицу person
         :param table: по какой таблице делать поиск - writers или actors
-        :return:
+        :return: количество добавленных персон
         """
         self.pg_cursor.execute('select p.full_name from content.person p')
         rows = self.pg_cursor.fetchall()
         added = ['"{}"'.format(row[0]) for row in rows]
 
-        self.sqlite_cursor.execute('select a.name from {} a where a.name not in ({})'.format(table, ','.join(added)))
+        self.sqlite_cursor.execute('select a.name from {} a where a.name not in ({}) and a.name != ?'.format(
+            table, ','.join(added)), (NOT_AVAILABLE,))
         not_created_people = self.sqlite_cursor.fetchall()
         if not_created_people:
             people = [(uuid.uuid4(), row[0]) for row in not_created_people]
             insert_query = 'insert into content.person (id, full_name) values %s'
             execute_values(self.pg_cursor, insert_query, people, template=None)
+        return len(not_created_people)
+
+
+class DryRunSaver:
+    """
+    Замена PostgresSaver для пробного прогона: объекты проверяются и запоминаются как перенесенные,
+    в Postgres ничего не пишется
+    """
+
+    def __init__(self, sqlite_cursor, validator: Validator = None):
+        self.sqlite_cursor = sqlite_cursor
+        self.validator = validator
+
+    def load_objects(self, values):
+        """
+        То же, что PostgresSaver.load_objects, без записи в базу
+        :return: количество строк, которые были бы отправлены в базу
+        """
+        uploaded_genres.update({genre.name: genre for genre in values['genres']})
+        uploaded_people.update({person.full_name: person for person in values['people']})
+        return sum(len(objects) for objects in values.values())
+
+    def check_left_people(self, table: str):
+        """
+        То же, что PostgresSaver.check_left_people: персоны из таблицы, которых нет среди перенесенных
+        """
+        self.sqlite_cursor.execute('select a.name from {} a where a.name != ?'.format(table), (NOT_AVAILABLE,))
+        added = 0
+        for name, in self.sqlite_cursor.fetchall():
+            if name not in uploaded_people:
+                person = Person(id=uuid.uuid4(), full_name=name)
+                uploaded_people[name] = person
+                if self.validator:
+                    self.validator.check_person(person)
+                added += 1
+        return added
 
 
 class SQLiteLoader:
     """
     Класс для получения данных из базы db.sqlite
     """
-    def __init__(self, pg_cursor, sqlite_cursor):
+    def __init__(self, pg_cursor, sqlite_cursor, validator: Validator = None):
         self.pg_cursor = pg_cursor
         self.sqlite_cursor = sqlite_cursor
+        self.validator = validator
 
     def get_movies_full_info(self, limit: int, offset: int):
         """
@@ -190,7 +550,7 @@ class SQLiteLoader:
         self.sqlite_cursor.execute(sql.format(limit, offset))
         rows = self.sqlite_cursor.fetchall()
         for row in rows:
-            if row[4] == 'N/A':
+            if row[4] == NOT_AVAILABLE:
                 desc = None
             else:
                 desc = row[4]
@@ -232,17 +592,15 @@ class SQLiteLoader:
         genre_film_works = []
         person_film_works = []
         for movie in movies_list_objects:
-            try:
-                rating = float(movie['rating'])
-            except:
-                rating = None
+            if self.validator:
+                self.validator.check_row(movie)
 
             new_movie = Movie(
                 id=uuid.uuid4(),
                 title=movie['title'],
                 type='movie',
                 description=movie['description'],
-                rating=rating
+                rating=self.parse_rating(movie)
             )
             film_works.append(new_movie)
 
@@ -267,6 +625,22 @@ class SQLiteLoader:
             'person_film_works': person_film_works
         }
 
+    def parse_rating(self, movie: dict):
+        """
+        Рейтинг фильма числом
+        :param movie: словарь фильма из get_movies_full_info
+        :return: float или None, если рейтинга нет (N/A) или он не является числом
+        """
+        value = movie['rating']
+        if value in (None, '', NOT_AVAILABLE):
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            if self.validator:
+                self.validator.add('invalid_rating', '{}: {!r}'.format(movie['title'], value))
+            return None
+
     def create_genres(self, genres, movie_id, pack_genres):
         """
         Создание объектов Genre и GenreFilm
@@ -279,7 +653,7 @@ class SQLiteLoader:
         create_genre_film_work = []
 
         for genre in genres:
-            if genre == 'N/A':
+            if genre == NOT_AVAILABLE:
                 continue
 
             existing_genre = self.check_genre(genre)
@@ -291,7 +665,7 @@ class SQLiteLoader:
                 current_genre = Genre(id=uuid.uuid4(), name=genre)
                 pack_genres[genre] = current_genre
 
-            new_genre_film_work = GenreFilm(id=uuid.uuid4(), film_id=movie_id, genre_id=current_genre.id)
+            new_genre_film_work = GenreFilm(id=time_ordered_uuid(), film_id=movie_id, genre_id=current_genre.id)
             create_genre_film_work.append(new_genre_film_work)
 
         return pack_genres, create_genre_film_work
@@ -310,7 +684,7 @@ class SQLiteLoader:
         create_person_film_work = []
 
         for person in people:
-            if person == 'N/A':
+            if person == NOT_AVAILABLE:
                 continue
             existing_person = self.check_person(person)
             if existing_person:
@@ -322,7 +696,7 @@ class SQLiteLoader:
                 pack_people[person] = current_person
 
             new_person_film_works = PersonFilm(
-                id=uuid.uuid4(),
+                id=time_ordered_uuid(),
                 film_id=movie_id,
                 person_id=current_person.id,
                 role=role
@@ -354,25 +728,67 @@ class SQLiteLoader:
         return False
 
 
-def load_from_sqlite(connection: sqlite3.Connection, pg_conn: _connection):
-    """Основной метод загрузки данных из SQLite в Postgres"""
-    postgres_saver = PostgresSaver(pg_conn.cursor(), connection.cursor())
-    sqlite_loader = SQLiteLoader(pg_conn.cursor(), connection.cursor())
+def load_from_sqlite(connection: sqlite3.Connection, pg_conn: _connection, stats: LoadStats, package_size: int,
+                     validator: Validator = None):
+    """
+    Основной метод загрузки данных из SQLite в Postgres
+    :param pg_conn: соединение с Postgres, None - пробный прогон без записи в базу
+    :param package_size: количество фильмов в пачке
+    :param validator: Validator для проверки строк, None - без проверки
+    """
+    if pg_conn is None:
+        postgres_saver = DryRunSaver(connection.cursor(), validator)
+        sqlite_loader = SQLiteLoader(None, connection.cursor(), validator)
+    else:
+        postgres_saver = PostgresSaver(pg_conn.cursor(), connection.cursor())
+        sqlite_loader = SQLiteLoader(pg_conn.cursor(), connection.cursor(), validator)
 
     count = connection.cursor().execute('select count(*) from movies')
     num_rows = count.fetchall()[0][0]
-    package_size = int(os.getenv('PACKAGE_SIZE'))
 
     for i in range(int(num_rows) // package_size + 1):
-        movies_list_prep = sqlite_loader.get_movies_full_info(10, 10 * i)
-        data = sqlite_loader.create_objects(movies_list_prep)
-        postgres_saver.load_objects(data)
-
-    postgres_saver.check_left_people('actors')
-    postgres_saver.check_left_people('writers')
+        with stats.stage('extract') as stage:
+            movies_list_prep = sqlite_loader.get_movies_full_info(package_size, package_size * i)
+            stage.rows = len(movies_list_prep)
+        with stats.stage('transform') as stage:
+            data = sqlite_loader.create_objects(movies_list_prep)
+            stage.rows = sum(len(objects) for objects in data.values())
+        if validator:
+            with stats.stage('validate') as stage:
+                validator.check_objects(data)
+                stage.rows = sum(len(objects) for objects in data.values())
+        with stats.stage('load') as stage:
+            stage.rows = postgres_saver.load_objects(data)
+        stats.batch_done(i)
+
+    with stats.stage('left_people') as stage:
+        stage.rows = postgres_saver.check_left_people('actors')
+        stage.rows += postgres_saver.check_left_people('writers')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Перенос данных из db.sqlite в Postgres')
+    parser.add_argument('--sql-log', choices=('off', 'full', 'sample'), default='off',
+                        help='Запись SQL запросов в upload.log (Postgres) и load.log (SQLite)')
+    parser.add_argument('--sql-sample-rate', type=float, default=0.01,
+                        help='Доля запросов, записываемых в лог при --sql-log sample')
+    parser.add_argument('--stats-file', help='Файл для замеров по пачкам и итога в формате JSON lines')
+    parser.add_argument('--profile', help='Файл для статистики cProfile (просмотр: python -m pstats <файл>)')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Считать выделенную память по этапам через tracemalloc (замедляет загрузку)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Прочитать, преобразовать и проверить данные без подключения к Postgres. '
+                             'Завершается с кодом 1, если найдены ошибки')
+    parser.add_argument('--validate', action='store_true', help='Проверять строки и при загрузке в Postgres')
+    parser.add_argument('--sqlite', help='Путь к базе SQLite, по умолчанию db.sqlite рядом со скриптом')
+    parser.add_argument('--package-size', type=int, default=int(os.getenv('PACKAGE_SIZE', 100)),
+                        help='Количество фильмов в пачке, по умолчанию из переменной PACKAGE_SIZE')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
     dsl = {
         'dbname': os.getenv('DBNAME'),
         'user': os.getenv('USER'),
@@ -381,10 +797,39 @@ if __name__ == '__main__':
         'port': os.getenv('PORT')
     }
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-    db_path = os.path.join(BASE_DIR, "db.sqlite")
-    with sqlite3.connect(db_path) as sqlite_conn, \
-            psycopg2.connect(**dsl, connection_factory=LoggingConnection) as conn_psql, \
-            open('upload.log', 'w') as upload_log, open('load.log', 'w') as load_log:
-        conn_psql.initialize(upload_log)
-        sqlite_conn.set_trace_callback(load_log.write)
-        load_from_sqlite(sqlite_conn, conn_psql)
+    db_path = args.sqlite or os.path.join(BASE_DIR, "db.sqlite")
+    sample_rate = 1.0 if args.sql_log == 'full' else args.sql_sample_rate
+    validator = Validator() if args.dry_run or args.validate else None
+
+    with ExitStack() as stack:
+        sqlite_conn = stack.enter_context(sqlite3.connect(db_path))
+        if args.dry_run:
+            conn_psql = None
+            if args.sql_log != 'off':
+                sqlite_conn.set_trace_callback(sampled(stack.enter_context(open('load.log', 'w')).write, sample_rate))
+        elif args.sql_log == 'off':
+            conn_psql = stack.enter_context(psycopg2.connect(**dsl))
+        else:
+            conn_psql = stack.enter_context(psycopg2.connect(**dsl, connection_factory=SampledLoggingConnection))
+            conn_psql.sample_rate = sample_rate
+            conn_psql.initialize(stack.enter_context(open('upload.log', 'w')))
+            sqlite_conn.set_trace_callback(sampled(stack.enter_context(open('load.log', 'w')).write, sample_rate))
+        stats = LoadStats(stack.enter_context(open(args.stats_file, 'w')) if args.stats_file else None)
+
+        if args.trace_memory:
+            tracemalloc.start()
+        profiler = cProfile.Profile() if args.profile else None
+        if profiler:
+            profiler.enable()
+        try:
+            load_from_sqlite(sqlite_conn, conn_psql, stats, args.package_size, validator)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+            stats.summary()
+            if validator:
+                validator.report(stats)
+
+    if args.dry_run and validator.errors:
+        sys.exit(1)
@@ -0,0 +1,371 @@
+"""
+Нагрузочный тест API по описанию files/django_openapi.yml. Из спецификации берутся все GET-запросы:
+номер страницы списка выбирается по закону Ципфа (первые страницы запрашиваются чаще, --page-skew),
+вместо {id} подставляется id, выбранный из ответов соответствующего списка (с --id-skew одни id
+популярнее других). С --postman к ним добавляются GET-запросы коллекции files/postman_tests.json.
+Нагрузка увеличивается ступенями по --concurrency потоков, каждая ступень длится --duration секунд;
+для каждой ступени выводятся запросы в секунду, неуспешные ответы (4xx, errors - 5xx и ошибки соединения)
+и задержки p50/p95/p99 успешных (2xx) ответов по каждому запросу.
+
+С --output результаты сохраняются в JSON, с --baseline сравниваются с сохраненными ранее: если p95 какого-либо
+запроса выросла больше чем на --max-regression процентов, скрипт завершается с кодом 1.
+
+Без --url запускает gunicorn на свободном порту. Запуск из папки movies_admin
+(нужна доступная база из config/settings/.env, PyYAML из requirements/dev.txt):
+    python load_test/api.py --concurrency 1 4 16 64 --duration 20 --postman --output api.json
+    python load_test/api.py --url http://127.0.0.1:8000 --baseline api.json
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+
+import yaml
+
+from workers import BASE_DIR, GUNICORN, get_free_port, percentile, wait_for_server
+
+FILES_DIR = os.path.join(os.path.dirname(BASE_DIR), 'files')
+
+# Доля запросов по умолчанию: список и страница фильма - основная нагрузка на API
+DEFAULT_WEIGHTS = {
+    '/v1/movies/': 4,
+    '/v1/movies/{id}': 4,
+}
+
+PATH_PARAM = re.compile(r'{(\w+)}')
+POSTMAN_VARIABLE = re.compile(r'{{(\w+)}}')
+
+
+class Endpoint:
+    """
+    Запрос из спецификации или коллекции Postman
+    :param name: имя в отчете
+    :param template: путь относительно /api с {id} вместо id или готовый путь
+    :param ids_from: путь списка, из ответов которого берутся id для {id}
+    :param paged: выбирать номер страницы по закону Ципфа
+    """
+
+    def __init__(self, name, template, weight, ids_from=None, paged=False):
+        self.name = name
+        self.template = template
+        self.weight = weight
+        self.ids_from = ids_from
+        self.paged = paged
+
+    def build(self, rng, ids, pages):
+        path = self.template
+        if self.ids_from:
+            path = PATH_PARAM.sub(lambda match: ids[self.ids_from].sample(rng), path)
+        # Маршруты API заканчиваются на /, без него Django отвечает перенаправлением
+        path, question, query = path.partition('?')
+        if not path.endswith('/'):
+            path += '/'
+        path += question + query
+        if self.paged and pages.get(self.template):
+            path += '?' + urlencode({'page': pages[self.template].sample(rng)})
+        return path
+
+
+class ZipfPages:
+    """
+    Номера страниц 1..total с вероятностью, обратно пропорциональной номеру в степени skew
+    """
+
+    def __init__(self, total, skew):
+        self.total = total
+        self.cumulative = list(itertools.accumulate(1 / page ** skew for page in range(1, total + 1)))
+
+    def sample(self, rng):
+        point = rng.random() * self.cumulative[-1]
+        return min(self.total, bisect.bisect_left(self.cumulative, point) + 1)
+
+
+class Popular:
+    """
+    Элементы values с вероятностью по закону Ципфа от их номера, skew 0 - равномерно
+    """
+
+    def __init__(self, values, skew):
+        self.values = values
+        self.ranks = ZipfPages(len(values), skew)
+
+    def sample(self, rng):
+        return self.values[self.ranks.sample(rng) - 1]
+
+
+def load_spec(path, weights):
+    """
+    GET-запросы спецификации OpenAPI
+    """
+    with open(path) as spec_file:
+        spec = yaml.safe_load(spec_file)
+
+    endpoints = []
+    for template, operations in spec['paths'].items():
+        if 'get' not in operations:
+            continue
+        params = {param['name']: param for param in operations['get'].get('parameters', [])}
+        ids_from = None
+        if any(param['in'] == 'path' for param in params.values()):
+            # Список для /v1/movies/{id} - /v1/movies/
+            ids_from = PATH_PARAM.split(template)[0]
+            if ids_from not in spec['paths']:
+                print('Skipping {}: no list to take ids from'.format(template), file=sys.stderr)
+                continue
+        endpoints.append(Endpoint(
+            'GET ' + template, template, weights.get(template, DEFAULT_WEIGHTS.get(template, 1)),
+            ids_from=ids_from, paged='page' in params,
+        ))
+    return endpoints
+
+
+def load_postman(path, weight):
+    """
+    GET-запросы коллекции Postman, переменная {{movieUuid}} заменяется id фильма
+    """
+    with open(path) as collection_file:
+        collection = json.load(collection_file)
+
+    def walk(items):
+        for item in items:
+            if 'item' in item:
+                yield from walk(item['item'])
+            elif item['request']['method'] == 'GET':
+                url = item['request']['url']
+                yield item['name'], url if isinstance(url, str) else url['raw']
+
+    endpoints = []
+    for name, url in walk(collection['item']):
+        path = url[url.index('/api/') + len('/api'):]
+        variables = set(POSTMAN_VARIABLE.findall(path))
+        if variables - {'movieUuid'}:
+            print('Skipping {}: unknown variables {}'.format(name, variables), file=sys.stderr)
+            continue
+        endpoints.append(Endpoint(
+            'postman: ' + name, POSTMAN_VARIABLE.sub('{id}', path), weight,
+            ids_from='/v1/movies/' if variables else None,
+        ))
+    return endpoints
+
+
+def fetch_json(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def sample_ids(api_url, list_path, count, rng, random_pages=True):
+    """
+    id из случайных страниц списка (или первых страниц для списков с курсором after)
+    :param random_pages: False - с первых страниц подряд, дальние страницы большого списка запрашиваются долго
+    """
+    url = api_url + list_path
+    first = fetch_json(url)
+    total_pages = first.get('total_pages')
+    ids = [item['id'] for item in first['results']]
+    if total_pages:
+        pages = min(total_pages - 1, count // max(1, len(ids)))
+        pages = rng.sample(range(2, total_pages + 1), pages) if random_pages else range(2, pages + 2)
+        for page in pages:
+            ids += [item['id'] for item in fetch_json('{}?page={}'.format(url, page))['results']]
+    else:
+        page = first
+        while page.get('next_after') and len(ids) < count:
+            page = fetch_json('{}?after={}'.format(url, page['next_after']))
+            ids += [item['id'] for item in page['results']]
+    return ids[:count]
+
+
+def run_stage(api_url, endpoints, ids, pages, concurrency, duration, seed):
+    """
+    Нагрузка из concurrency потоков, каждый выбирает запрос по весам endpoints
+    :return: для каждого запроса: отсортированные задержки успешных ответов, ответы 4xx, ошибки
+    """
+    results = defaultdict(lambda: {'latencies': [], 'requests': 0, 'client_errors': 0, 'errors': 0})
+    lock = threading.Lock()
+    weights = [endpoint.weight for endpoint in endpoints]
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(seed * 1000 + number)
+        local = defaultdict(lambda: {'latencies': [], 'requests': 0, 'client_errors': 0, 'errors': 0})
+        while time.monotonic() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            url = api_url + endpoint.build(rng, ids, pages)
+            stats = local[endpoint.name]
+            stats['requests'] += 1
+            started = time.monotonic()
+            try:
+                urllib.request.urlopen(url, timeout=30).read()
+                stats['latencies'].append(time.monotonic() - started)
+            except HTTPError as e:
+                # Быстрые 429/503 и 404 не должны улучшать задержки, они считаются только как неуспешные ответы
+                stats['client_errors' if e.code < 500 else 'errors'] += 1
+            except (URLError, ConnectionError):
+                stats['errors'] += 1
+        with lock:
+            for name, stats in local.items():
+                results[name]['latencies'].extend(stats['latencies'])
+                for key in ('requests', 'client_errors', 'errors'):
+                    results[name][key] += stats[key]
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for stats in results.values():
+        stats['latencies'].sort()
+    return results
+
+
+def summarize(results, duration):
+    """
+    :return: строка отчета для каждого запроса и итоговая строка total
+    """
+    summary = {}
+    total = {'latencies': [], 'requests': 0, 'client_errors': 0, 'errors': 0}
+    for name, stats in sorted(results.items()):
+        summary[name] = summarize_one(stats, duration)
+        total['latencies'].extend(stats['latencies'])
+        for key in ('requests', 'client_errors', 'errors'):
+            total[key] += stats[key]
+    total['latencies'].sort()
+    summary['total'] = summarize_one(total, duration)
+    return summary
+
+
+def summarize_one(stats, duration):
+    latencies = stats['latencies']
+    return {
+        'requests': stats['requests'],
+        'rps': stats['requests'] / duration,
+        '4xx': stats['client_errors'],
+        'errors': stats['errors'],
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+
+def print_stage(concurrency, summary, width):
+    print('\nconcurrency {}'.format(concurrency))
+    print('{:<{}} {:>9} {:>9} {:>6} {:>7} {:>9} {:>9} {:>9}'.format(
+        'endpoint', width, 'requests', 'req/s', '4xx', 'errors', 'p50, ms', 'p95, ms', 'p99, ms'))
+    for name, row in summary.items():
+        print('{:<{}} {:>9} {:>9.1f} {:>6} {:>7} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, width, row['requests'], row['rps'], row['4xx'], row['errors'], row['p50'], row['p95'], row['p99']))
+
+
+def compare(baseline, report, max_regression):
+    """
+    :return: список ухудшений p95 больше чем на max_regression процентов
+    """
+    regressions = []
+    for concurrency, summary in report.items():
+        for name, row in summary.items():
+            before = baseline.get(concurrency, {}).get(name)
+            if not before or not before['p95']:
+                continue
+            change = (row['p95'] - before['p95']) / before['p95'] * 100
+            if change > max_regression:
+                regressions.append('concurrency {}, {}: p95 {:.1f} ms -> {:.1f} ms (+{:.0f}%)'.format(
+                    concurrency, name, before['p95'], row['p95'], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Адрес запущенного приложения, без него запускается gunicorn')
+    parser.add_argument('--workers', type=int, default=2, help='Количество воркеров gunicorn')
+    parser.add_argument('--app', default='config.wsgi:application')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=10, help='Длительность ступени в секундах')
+    parser.add_argument('--spec', default=os.path.join(FILES_DIR, 'django_openapi.yml'))
+    parser.add_argument('--postman', nargs='?', const=os.path.join(FILES_DIR, 'postman_tests.json'),
+                        help='Добавить GET-запросы коллекции Postman')
+    parser.add_argument('--weight', action='append', default=[], metavar='PATH=N',
+                        help='Вес запроса из спецификации, например /v1/genres/=0')
+    parser.add_argument('--postman-weight', type=float, default=1)
+    parser.add_argument('--page-skew', type=float, default=1.2, help='Показатель закона Ципфа для номера страницы')
+    parser.add_argument('--ids', type=int, default=1000, help='Сколько id выбрать для каждого списка')
+    parser.add_argument('--id-skew', type=float, default=0,
+                        help='Показатель закона Ципфа для популярности id, 0 - все id запрашиваются одинаково часто')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='Сравнить с результатами, сохраненными через --output')
+    parser.add_argument('--max-regression', type=float, default=20, help='Допустимый рост p95 в процентах')
+    args = parser.parse_args()
+
+    weights = {}
+    for item in args.weight:
+        path, _, weight = item.rpartition('=')
+        weights[path] = float(weight)
+    endpoints = [endpoint for endpoint in load_spec(args.spec, weights) if endpoint.weight > 0]
+    if args.postman:
+        endpoints += load_postman(args.postman, args.postman_weight) if args.postman_weight > 0 else []
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        port = get_free_port()
+        base_url = 'http://127.0.0.1:{}'.format(port)
+        server = subprocess.Popen(
+            [GUNICORN, args.app, '--workers', str(args.workers),
+             '--bind', '127.0.0.1:{}'.format(port), '--access-logfile', '/dev/null', '--log-level', 'warning'],
+            cwd=BASE_DIR,
+            # Все запросы идут с одного IP, ограничение частоты запросов клиента не должно влиять на замер
+            env=dict(os.environ, API_RATE_LIMIT='0'),
+        )
+    api_url = base_url.rstrip('/') + '/api'
+
+    report = {}
+    try:
+        wait_for_server(api_url + '/v1/genres/', timeout=60)
+        rng = random.Random(args.seed)
+        ids, pages = {}, {}
+        for list_path in sorted({endpoint.ids_from for endpoint in endpoints if endpoint.ids_from}):
+            sampled = sample_ids(api_url, list_path, args.ids, rng)
+            if not sampled:
+                raise RuntimeError('{} returned no ids'.format(list_path))
+            ids[list_path] = Popular(sampled, args.id_skew)
+        for endpoint in endpoints:
+            if endpoint.paged:
+                total_pages = fetch_json(api_url + endpoint.template).get('total_pages')
+                if total_pages:
+                    pages[endpoint.template] = ZipfPages(total_pages, args.page_skew)
+
+        width = max(len(endpoint.name) for endpoint in endpoints)
+        for concurrency in args.concurrency:
+            results = run_stage(api_url, endpoints, ids, pages, concurrency, args.duration, args.seed + concurrency)
+            report[str(concurrency)] = summarize(results, args.duration)
+            print_stage(concurrency, report[str(concurrency)], width)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(json.load(baseline_file), report, args.max_regression)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Замер страницы фильма /api/v1/movies/<id>/ с LRU-кэшем фильмов в процессе (cache) и без него (no-cache).
+Для каждого варианта из --variants запускает gunicorn с --workers воркерами, выбирает --ids id фильмов
+с первых страниц списка (id случайные, так что фильмы разбросаны по таблице) и в течение --duration секунд
+запрашивает их из --concurrency потоков.
+Популярность фильмов распределена по закону Ципфа (--skew, 0 - все фильмы запрашиваются одинаково часто).
+Выводит запросы в секунду и задержки p50/p95/p99.
+
+Запуск из папки movies_admin (нужна доступная база из config/settings/.env, PyYAML из requirements/dev.txt):
+    python load_test/detail.py --workers 4 --concurrency 4 --ids 20000 --duration 20
+"""
+import argparse
+import os
+import random
+import subprocess
+
+from api import Endpoint, Popular, run_stage, sample_ids, summarize
+from workers import BASE_DIR, GUNICORN, get_free_port, wait_for_server
+
+# Переменные окружения gunicorn для каждого варианта
+VARIANTS = {
+    'no-cache': {'API_MOVIE_CACHE_SIZE': '0'},
+    'cache': {},
+}
+
+DETAIL = Endpoint('GET /v1/movies/{id}', '/v1/movies/{id}', 1, ids_from='/v1/movies/')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--ids', type=int, default=5000, help='Сколько разных фильмов запрашивать')
+    parser.add_argument('--skew', type=float, default=1.0, help='Показатель закона Ципфа для популярности фильмов')
+    parser.add_argument('--app', default='config.wsgi:application')
+    args = parser.parse_args()
+
+    print('{:>9} {:>9} {:>7} {:>9} {:>9} {:>9}'.format('variant', 'req/s', 'errors', 'p50, ms', 'p95, ms', 'p99, ms'))
+    for variant in args.variants:
+        port = get_free_port()
+        api_url = 'http://127.0.0.1:{}/api'.format(port)
+        # Ограничение частоты запросов одного клиента не должно влиять на замер
+        env = dict(os.environ, API_RATE_LIMIT='0', **VARIANTS[variant])
+        server = subprocess.Popen(
+            [GUNICORN, args.app, '--workers', str(args.workers),
+             '--bind', '127.0.0.1:{}'.format(port), '--access-logfile', '/dev/null', '--log-level', 'warning'],
+            cwd=BASE_DIR, env=env,
+        )
+        try:
+            wait_for_server(api_url + '/v1/genres/', timeout=60)
+            ids = {DETAIL.ids_from: Popular(sample_ids(api_url, DETAIL.ids_from, args.ids, random.Random(0),
+                                                       random_pages=False), args.skew)}
+            results = run_stage(api_url, [DETAIL], ids, {}, args.concurrency, args.duration, seed=0)
+        finally:
+            server.terminate()
+            server.wait()
+        total = summarize(results, args.duration)['total']
+        print('{:>9} {:>9.1f} {:>7} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            variant, total['rps'], total['errors'], total['p50'], total['p95'], total['p99']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Замер вставки и типовых выборок по таблице связей person_film_work при разной ее организации:
+plain - как сейчас (uuid4 id), partitioned - секции по hash(film_work_id), ordered-uuid - id в формате UUIDv7,
+natural-key - без id и created_at, первичный ключ (film_work_id, person_id, role).
+Для каждого варианта из --variants создает таблицу в отдельной схеме bench, вставляет --credits строк
+пачками по --batch (как загрузчик, с ON CONFLICT DO NOTHING), затем замеряет выборки и выводит размер таблицы
+и индексов. Схема bench удаляется после замера.
+
+Запуск из папки movies_admin (нужна доступная база из config/settings/.env):
+    python load_test/link_tables.py --credits 50000000 --variants plain partitioned
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.production')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+LINK_COLUMNS = '''
+    film_work_id uuid NOT NULL,
+    person_id uuid NOT NULL,
+    role text NOT NULL
+'''
+
+COLUMNS = '''
+    id uuid NOT NULL,
+    {},
+    created_at timestamp with time zone DEFAULT current_timestamp
+'''.format(LINK_COLUMNS)
+
+# Аналог movies.models.time_ordered_uuid: первые 48 бит - время в миллисекундах
+TIME_ORDERED_UUID = ("(lpad(to_hex((extract(epoch FROM clock_timestamp()) * 1000)::bigint), 12, '0') "
+                     "|| '7' || substr(md5(random()::text), 1, 19))::uuid")
+
+INDEXES = [
+    'CREATE INDEX ON bench.person_film_work (person_id, role, film_work_id)',
+]
+
+
+def create_plain(cursor, args):
+    cursor.execute('CREATE TABLE bench.person_film_work ({}, PRIMARY KEY (id), '
+                   'UNIQUE (film_work_id, person_id, role))'.format(COLUMNS))
+
+
+def create_partitioned(cursor, args):
+    cursor.execute('CREATE TABLE bench.person_film_work ({}, PRIMARY KEY (id, film_work_id), '
+                   'UNIQUE (film_work_id, person_id, role)) PARTITION BY HASH (film_work_id)'.format(COLUMNS))
+    for remainder in range(args.partitions):
+        cursor.execute('CREATE TABLE bench.person_film_work_p{} PARTITION OF bench.person_film_work '
+                       'FOR VALUES WITH (MODULUS {}, REMAINDER {})'.format(remainder, args.partitions, remainder))
+
+
+def create_natural_key(cursor, args):
+    cursor.execute('CREATE TABLE bench.person_film_work ({}, PRIMARY KEY (film_work_id, person_id, role))'
+                   .format(LINK_COLUMNS))
+
+
+# Вариант: функция создания таблицы и выражение для id новой строки, None - таблица без id
+VARIANTS = {
+    'plain': (create_plain, 'gen_random_uuid()'),
+    'partitioned': (create_partitioned, 'gen_random_uuid()'),
+    'ordered-uuid': (create_plain, TIME_ORDERED_UUID),
+    'natural-key': (create_natural_key, None),
+}
+
+QUERIES = {
+    # Массивы участников для страницы API (как refresh_role_arrays)
+    'film_credits': '''
+        SELECT film_work_id, array_agg(person_id ORDER BY person_id)
+        FROM bench.person_film_work
+        WHERE film_work_id = ANY(%(films)s::uuid[]) AND role = 'actor'
+        GROUP BY film_work_id
+    ''',
+    # Фильмы персоны (страница персоны, обновление фильмов при изменении персоны)
+    'person_films': '''
+        SELECT count(*) FROM bench.person_film_work WHERE person_id = ANY(%(persons)s::uuid[])
+    ''',
+    # Агрегат по всей таблице (счетчики по ролям)
+    'full_aggregate': '''
+        SELECT role, count(*) FROM bench.person_film_work GROUP BY role
+    ''',
+}
+
+
+def insert(cursor, args, id_expression):
+    """
+    Вставка credits строк пачками, фильмы идут вперемешку, как в загрузчике
+    :return: время вставки в секундах
+    """
+    films = max(1, args.credits // args.credits_per_film)
+    id_column, id_value = ('id, ', id_expression + ', ') if id_expression else ('', '')
+    started = time.monotonic()
+    for start in range(0, args.credits, args.batch):
+        end = min(args.credits, start + args.batch) - 1
+        cursor.execute('''
+            INSERT INTO bench.person_film_work ({}film_work_id, person_id, role)
+            SELECT {}md5('f' || abs(hashint8(n)) %% %(films)s)::uuid, md5('p' || n * 7919 %% %(persons)s)::uuid,
+                   (ARRAY['actor', 'director', 'writer'])[1 + n %% 3]
+            FROM generate_series(%(start)s::bigint, %(end)s::bigint) n
+            ON CONFLICT (film_work_id, person_id, role) DO NOTHING
+        '''.format(id_column, id_value), {'films': films, 'persons': args.persons, 'start': start, 'end': end})
+    return time.monotonic() - started
+
+
+def run_query(cursor, sql, args):
+    films = max(1, args.credits // args.credits_per_film)
+    params = {
+        'films': [str(film) for film in sample_uuids(cursor, 'f', films, args.sample)],
+        'persons': [str(person) for person in sample_uuids(cursor, 'p', args.persons, args.sample)],
+    }
+    timings = []
+    for _ in range(args.repeat):
+        started = time.monotonic()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append(time.monotonic() - started)
+    return statistics.median(timings)
+
+
+def sample_uuids(cursor, prefix, count, sample):
+    step = max(1, count // sample)
+    cursor.execute("SELECT md5(%s || n)::uuid FROM generate_series(0, %s, %s) n", [prefix, count - 1, step])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def relation_sizes(cursor):
+    """
+    :return: размер данных и индексов таблицы (с секциями) в байтах
+    """
+    cursor.execute('''
+        SELECT coalesce(sum(pg_table_size(c.oid)), 0), coalesce(sum(pg_indexes_size(c.oid)), 0)
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'bench' AND c.relkind = 'r'
+    ''')
+    return cursor.fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--credits', type=int, default=1000000)
+    parser.add_argument('--credits-per-film', type=int, default=15)
+    parser.add_argument('--persons', type=int, default=500000)
+    parser.add_argument('--partitions', type=int, default=16)
+    parser.add_argument('--batch', type=int, default=100000)
+    parser.add_argument('--sample', type=int, default=100, help='Сколько фильмов и персон в одной выборке')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:>13} {:>10} {:>10} {:>10} {:>10} {:>14} {:>14} {:>16}'.format(
+        'variant', 'rows', 'insert, s', 'table, MB', 'index, MB', *('{}, ms'.format(name) for name in QUERIES)))
+    with connection.cursor() as cursor:
+        for variant in args.variants:
+            create, id_expression = VARIANTS[variant]
+            cursor.execute('DROP SCHEMA IF EXISTS bench CASCADE')
+            cursor.execute('CREATE SCHEMA bench')
+            try:
+                create(cursor, args)
+                for index in INDEXES:
+                    cursor.execute(index)
+                insert_seconds = insert(cursor, args, id_expression)
+                cursor.execute('VACUUM ANALYZE bench.person_film_work')
+                cursor.execute('SELECT count(*) FROM bench.person_film_work')
+                rows = cursor.fetchone()[0]
+                table_size, index_size = relation_sizes(cursor)
+                timings = [run_query(cursor, sql, args) for sql in QUERIES.values()]
+            finally:
+                cursor.execute('DROP SCHEMA bench CASCADE')
+            print('{:>13} {:>10} {:>10.1f} {:>10.1f} {:>10.1f} {:>14.2f} {:>14.2f} {:>16.2f}'.format(
+                variant, rows, insert_seconds, table_size / 2 ** 20, index_size / 2 ** 20,
+                *(timing * 1000 for timing in timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Замер запуска приложения для профилей настроек: полного (админка и API) и только API.
+Для каждого профиля --repeat раз импортирует WSGI-приложение в отдельном процессе и выводит время импорта,
+количество загруженных модулей и RSS процесса. С --workers N дополнительно запускает gunicorn с N воркерами,
+выводит время до первого ответа и память воркера: RSS, PSS (с учетом страниц, общих с мастером после fork)
+и собственную память (Linux, /proc/<pid>/smaps_rollup).
+
+Запуск из папки movies_admin (для --workers нужна доступная база из config/settings/.env):
+    python load_test/startup.py --workers 4
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from workers import BASE_DIR, GUNICORN, get_free_port, wait_for_server
+
+# Профиль: модуль настроек и модуль WSGI-приложения
+PROFILES = {
+    'full': ('config.settings.production', 'config.wsgi'),
+    'api': ('config.settings.api', 'config.wsgi_api'),
+}
+
+
+def read_proc(pid, name, fields):
+    """
+    Значения в килобайтах из /proc/<pid>/<name>, 0 если файла нет
+    """
+    values = dict.fromkeys(fields, 0)
+    try:
+        with open('/proc/{}/{}'.format(pid, name)) as proc_file:
+            for line in proc_file:
+                key, _, value = line.partition(':')
+                if key in values:
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def measure_import(wsgi_module):
+    """
+    Выполняется в дочернем процессе: импорт WSGI-приложения
+    """
+    sys.path.insert(0, BASE_DIR)
+    os.chdir(BASE_DIR)
+    started = time.perf_counter()
+    importlib.import_module(wsgi_module)
+    print(json.dumps({
+        'seconds': time.perf_counter() - started,
+        'modules': len(sys.modules),
+        'rss': read_proc('self', 'status', ['VmRSS'])['VmRSS'],
+    }))
+
+
+def run_import(profile, repeat):
+    settings_module, wsgi_module = PROFILES[profile]
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    results = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, __file__, '--child', wsgi_module], env=env, cwd=BASE_DIR)
+        results.append(json.loads(output.decode().splitlines()[-1]))
+    return {
+        'seconds': statistics.median(result['seconds'] for result in results),
+        'modules': results[-1]['modules'],
+        'rss': statistics.median(result['rss'] for result in results),
+    }
+
+
+def run_gunicorn(profile, workers, path):
+    """
+    :return: секунды до первого ответа и средние RSS, PSS и собственная память воркера в килобайтах
+    """
+    settings_module, wsgi_module = PROFILES[profile]
+    port = get_free_port()
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [GUNICORN, '{}:application'.format(wsgi_module), '--workers', str(workers),
+         '--bind', '127.0.0.1:{}'.format(port), '--access-logfile', '/dev/null', '--log-level', 'warning'],
+        cwd=BASE_DIR, env=env,
+    )
+    try:
+        wait_for_server('http://127.0.0.1:{}{}'.format(port, path), timeout=60)
+        boot_seconds = time.monotonic() - started
+        # Даем остальным воркерам загрузиться
+        time.sleep(2)
+        with open('/proc/{0}/task/{0}/children'.format(server.pid)) as children_file:
+            pids = children_file.read().split()
+        fields = ['Rss', 'Pss', 'Private_Clean', 'Private_Dirty']
+        memory = [read_proc(pid, 'smaps_rollup', fields) for pid in pids]
+    finally:
+        server.terminate()
+        server.wait()
+
+    def mean(key):
+        return statistics.mean(sum(item[field] for field in key) for item in memory) if memory else 0
+
+    return boot_seconds, mean(['Rss']), mean(['Pss']), mean(['Private_Clean', 'Private_Dirty'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=0, help='Запустить gunicorn с этим количеством воркеров')
+    parser.add_argument('--path', default='/api/v1/genres/')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure_import(args.child)
+        return
+
+    print('{:>8} {:>10} {:>8} {:>8}'.format('profile', 'import, s', 'modules', 'rss, MB'), end='')
+    if args.workers:
+        print(' {:>8} {:>14} {:>14} {:>18}'.format('boot, s', 'worker rss, MB', 'worker pss, MB',
+                                                   'worker private, MB'), end='')
+    print()
+    for profile in args.profiles:
+        result = run_import(profile, args.repeat)
+        print('{:>8} {:>10.3f} {:>8} {:>8.1f}'.format(profile, result['seconds'], result['modules'],
+                                                      result['rss'] / 1024), end='')
+        if args.workers:
+            boot, rss, pss, private = run_gunicorn(profile, args.workers, args.path)
+            print(' {:>8.1f} {:>14.1f} {:>14.1f} {:>18.1f}'.format(boot, rss / 1024, pss / 1024, private / 1024),
+                  end='')
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Замер пропускной способности API при разном количестве воркеров gunicorn.
+Для каждого значения --workers запускает gunicorn на свободном порту, в течение --duration секунд
+шлет запросы из --concurrency потоков и выводит число запросов в секунду и задержки.
+
+Запуск из папки movies_admin (нужна доступная база из config/settings/.env):
+    python load_test/workers.py --workers 1 2 4 8 --concurrency 32 --duration 10
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from urllib.error import URLError
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GUNICORN = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return
+        except (URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError('Server at {} did not start in {} seconds'.format(url, timeout))
+
+
+def run_load(url: str, concurrency: int, duration: float):
+    """
+    Нагрузка на url из нескольких потоков
+    :return: количество успешных запросов, количество ошибок, отсортированный список задержек в секундах
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        local_latencies = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                urllib.request.urlopen(url, timeout=30).read()
+                local_latencies.append(time.monotonic() - started)
+            except (URLError, ConnectionError):
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], sorted(latencies)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--path', default='/api/v1/movies/')
+    parser.add_argument('--app', default='config.wsgi:application')
+    args = parser.parse_args()
+
+    print('{:>8} {:>10} {:>8} {:>10} {:>10}'.format('workers', 'req/s', 'errors', 'p50, ms', 'p95, ms'))
+    for workers in args.workers:
+        port = get_free_port()
+        url = 'http://127.0.0.1:{}{}'.format(port, args.path)
+        server = subprocess.Popen(
+            [GUNICORN, args.app, '--workers', str(workers),
+             '--bind', '127.0.0.1:{}'.format(port), '--access-logfile', '/dev/null'],
+            # Все запросы идут с одного IP, ограничение частоты запросов клиента не должно влиять на замер.
+            # Одинаковые одновременные запросы иначе выполнялись бы один раз, и замер не зависел бы от числа воркеров
+            cwd=BASE_DIR, env=dict(os.environ, API_RATE_LIMIT='0', API_COALESCE='0'),
+        )
+        try:
+            wait_for_server(url, timeout=30)
+            done, errors, latencies = run_load(url, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        print('{:>8} {:>10.1f} {:>8} {:>10.1f} {:>10.1f}'.format(
+            workers, done / args.duration, errors,
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,31 @@
+from collections import defaultdict
+
 from django.contrib import admin
-from .models import Genre, Actor, Director, Writer, Movie, TvShow
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.forms.models import BaseInlineFormSet
+
+from .models import (Genre, Actor, Director, Writer, Movie, TvShow, GenreFilmWork, Person, PersonFilmWork,
+                     PersonRole)
+from .signals import catalogue_transaction
+
+
+class CatalogueAdmin(admin.ModelAdmin):
+    """
+    Страницы, которые меняют каталог, выполняются в catalogue_transaction: пересчет массивов фильмов и запись
+    в журнал изменений делаются в транзакции самого изменения, по одному разу на фильм
+    """
+
+    def changeform_view(self, *args, **kwargs):
+        with catalogue_transaction():
+            return super().changeform_view(*args, **kwargs)
+
+    def changelist_view(self, *args, **kwargs):
+        with catalogue_transaction():
+            return super().changelist_view(*args, **kwargs)
+
+    def delete_view(self, *args, **kwargs):
+        with catalogue_transaction():
+            return super().delete_view(*args, **kwargs)
 
 
 class ActorInline(admin.TabularInline):
@@ -12,7 +38,7 @@ class ActorInline(admin.TabularInline):
 
 
 @admin.register(Actor)
-class ActorAdmin(admin.ModelAdmin):
+class ActorAdmin(CatalogueAdmin):
     list_display = ('full_name', 'birth_date',)
 
     fields = (
@@ -32,7 +58,7 @@ class DirectorInline(admin.TabularInline):
 
 
 @admin.register(Director)
-class DirectorAdmin(admin.ModelAdmin):
+class DirectorAdmin(CatalogueAdmin):
     list_display = ('full_name', 'birth_date',)
 
     fields = (
@@ -52,7 +78,7 @@ class WriterInline(admin.TabularInline):
 
 
 @admin.register(Writer)
-class WriterAdmin(admin.ModelAdmin):
+class WriterAdmin(CatalogueAdmin):
     list_display = ('full_name', 'birth_date',)
 
     fields = (
@@ -62,50 +88,163 @@ class WriterAdmin(admin.ModelAdmin):
     inlines = [WriterInline]
 
 
+@admin.register(Person)
+class PersonAdmin(CatalogueAdmin):
+    """
+    Поиск персон для выбора в инлайнах фильмов (autocomplete_fields). В меню админки не показывается,
+    персоны редактируются на страницах актеров, режиссеров и сценаристов
+    """
+    search_fields = ('full_name',)
+
+    def get_model_perms(self, request):
+        return {}
+
+
 @admin.register(Genre)
-class GenreAdmin(admin.ModelAdmin):
+class GenreAdmin(CatalogueAdmin):
     list_display = ('name', 'description')
+    search_fields = ('name',)
 
     fields = (
         'name', 'description'
     )
 
 
-class MovieActorsInline(admin.TabularInline):
+def get_film_work_credits(film_work):
+    """
+    Загрузка всех связей фильма с персонами и жанрами: по одному запросу на таблицу связей,
+    персоны и жанры подтягиваются через select_related. Результат кэшируется на объекте фильма,
+    чтобы все инлайны страницы использовали одну и ту же выборку.
+    :param film_work: объект FilmWork
+    :return: словарь вида {'genres': [GenreFilmWork], 'people': {роль: [PersonFilmWork]}}
+    """
+    credits = getattr(film_work, '_credits', None)
+    if credits is None:
+        people = defaultdict(list)
+        genres = []
+        if not film_work._state.adding:
+            for person_film_work in (PersonFilmWork.objects
+                                     .filter(film_work_id=film_work)
+                                     .select_related('person_id')
+                                     .order_by('id')):
+                people[person_film_work.role].append(person_film_work)
+            genres = list(GenreFilmWork.objects
+                          .filter(film_work_id=film_work)
+                          .select_related('genre_id')
+                          .order_by('id'))
+        credits = {'genres': genres, 'people': people}
+        film_work._credits = credits
+    return credits
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """
+    Поле выбора персоны или жанра с поиском, которое берет выбранное значение из уже загруженного объекта,
+    а не делает отдельный запрос на каждую строку инлайна
+    """
+    related_object = None
+
+    def optgroups(self, name, value, attr=None):
+        obj = self.related_object
+        if obj is None or [str(obj.pk)] != [str(v) for v in value]:
+            return super().optgroups(name, value, attr)
+
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(name, obj.pk, self.choices.field.label_from_instance(obj), True,
+                                          len(options)))
+        return [(None, options, 0)]
+
+
+class FilmWorkCreditsFormSet(BaseInlineFormSet):
+    """
+    Формсет, строки которого берутся из get_film_work_credits вместо отдельного запроса
+    """
+    role = None
+    related_field = None
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            if self.queryset.query.is_empty():
+                self._queryset = []
+            elif self.role is None:
+                self._queryset = get_film_work_credits(self.instance)['genres']
+            else:
+                self._queryset = get_film_work_credits(self.instance)['people'][self.role]
+        return self._queryset
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        # Строки, удаленной после открытия формы, уже нет: форма получает новый объект без связи
+        if i < self.initial_form_count() and not form.instance._state.adding:
+            widget = form.fields[self.related_field].widget
+            # Поле выбора с поиском обернуто в RelatedFieldWidgetWrapper (кнопки добавления и изменения)
+            widget = getattr(widget, 'widget', widget)
+            if isinstance(widget, PreloadedAutocompleteSelect):
+                widget.related_object = getattr(form.instance, self.related_field)
+        return form
+
+
+class FilmWorkCreditsInline(admin.TabularInline):
+    formset = FilmWorkCreditsFormSet
+    role = None
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.role = self.role
+        formset.related_field = self.autocomplete_fields[0]
+        return formset
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.autocomplete_fields:
+            kwargs['widget'] = PreloadedAutocompleteSelect(db_field.remote_field, self.admin_site,
+                                                           using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class FilmWorkPeopleInline(FilmWorkCreditsInline):
+    model = PersonFilmWork
+    autocomplete_fields = ('person_id',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(role=self.role)
+
+
+class FilmWorkGenreInline(FilmWorkCreditsInline):
+    model = GenreFilmWork
+    autocomplete_fields = ('genre_id',)
+
+
+class MovieActorsInline(FilmWorkPeopleInline):
     model = Movie.people.through
     verbose_name = "Актер"
     verbose_name_plural = "Актеры"
-
-    def get_queryset(self, request):
-        return self.model.objects.get_queryset().filter(role='actor')
+    role = PersonRole.ACTOR
 
 
-class MovieDirectorInline(admin.TabularInline):
+class MovieDirectorInline(FilmWorkPeopleInline):
     model = Movie.people.through
     verbose_name = "Режиссер"
     verbose_name_plural = "Режиссеры"
-
-    def get_queryset(self, request):
-        return self.model.objects.get_queryset().filter(role='director')
+    role = PersonRole.DIRECTOR
 
 
-class MovieWriterInline(admin.TabularInline):
+class MovieWriterInline(FilmWorkPeopleInline):
     model = Movie.people.through
     verbose_name = "Сценарист"
     verbose_name_plural = "Сценаристы"
+    role = PersonRole.WRITER
 
-    def get_queryset(self, request):
-        return self.model.objects.get_queryset().filter(role='writer')
 
-
-class MovieGenreInline(admin.TabularInline):
+class MovieGenreInline(FilmWorkGenreInline):
     model = Movie.genre.through
     verbose_name = "Жанр"
     verbose_name_plural = "Жанры"
 
 
 @admin.register(Movie)
-class MovieAdmin(admin.ModelAdmin):
+class MovieAdmin(CatalogueAdmin):
     list_display = ('title', 'description', 'creation_date', 'certificate', 'file_path', 'rating')
 
     fields = (
@@ -115,41 +254,35 @@ class MovieAdmin(admin.ModelAdmin):
     inlines = [MovieGenreInline ,MovieActorsInline, MovieDirectorInline, MovieWriterInline]
 
 
-class TvShowActorsInline(admin.TabularInline):
+class TvShowActorsInline(FilmWorkPeopleInline):
     model = TvShow.people.through
     verbose_name = "Актер"
     verbose_name_plural = "Актеры"
-
-    def get_queryset(self, request):
-        return self.model.objects.get_queryset().filter(role='actor')
+    role = PersonRole.ACTOR
 
 
-class TvShowDirectorInline(admin.TabularInline):
+class TvShowDirectorInline(FilmWorkPeopleInline):
     model = TvShow.people.through
     verbose_name = "Режиссер"
     verbose_name_plural = "Режиссеры"
-
-    def get_queryset(self, request):
-        return self.model.objects.get_queryset().filter(role='director')
+    role = PersonRole.DIRECTOR
 
 
-class TvShowWriterInline(admin.TabularInline):
+class TvShowWriterInline(FilmWorkPeopleInline):
     model = TvShow.people.through
     verbose_name = "Сценарист"
     verbose_name_plural = "Сценаристы"
-
-    def get_queryset(self, request):
-        return self.model.objects.get_queryset().filter(role='writer')
+    role = PersonRole.WRITER
 
 
-class TvShowGenreInline(admin.TabularInline):
+class TvShowGenreInline(FilmWorkGenreInline):
     model = TvShow.genre.through
     verbose_name = "Жанр"
     verbose_name_plural = "Жанры"
 
 
 @admin.register(TvShow)
-class MovieAdmin(admin.ModelAdmin):
+class MovieAdmin(CatalogueAdmin):
     list_display = ('title', 'description', 'creation_date', 'certificate', 'file_path', 'rating')
 
     fields = (
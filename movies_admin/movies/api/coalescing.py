@@ -0,0 +1,145 @@
+"""
+Объединение одинаковых одновременных запросов к API (single flight): пока один запрос выполняется,
+такие же запросы ждут его и получают копию ответа, так что нагрузка на базу зависит от количества
+разных запросов, а не от количества клиентов.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from config.db_router import is_pinned
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class SingleFlight:
+    """
+    Объединение запросов внутри процесса, между потоками воркера gthread (GUNICORN_THREADS).
+    Воркер с одним потоком обслуживает один запрос за раз, и объединять в нем нечего,
+    между процессами запросы объединяет wait_shared
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func, timeout):
+        """
+        Выполнить func или дождаться такого же выполняющегося вызова
+        :return: ответ и признак того, что он получен от другого вызова
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            # Если первый запрос не успел или завершился ошибкой, выполняем запрос сами
+            if flight.done.wait(timeout) and flight.response is not None:
+                return flight.response, True
+            return func(), False
+
+        try:
+            response = func()
+            if is_shareable(response):
+                flight.response = freeze_response(response)
+            return response, False
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+_flights = SingleFlight()
+
+
+def is_shareable(response):
+    return response.status_code < 500 and not getattr(response, 'streaming', False)
+
+
+def freeze_response(response):
+    return response.status_code, list(response.items()), response.content
+
+
+def thaw_response(frozen):
+    status, headers, content = frozen
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    return response
+
+
+def get_request_key(request):
+    """
+    Одинаковыми считаются GET-запросы с тем же путем, параметрами и условными заголовками
+    """
+    key = '\n'.join((request.get_full_path(),
+                     request.META.get('HTTP_IF_NONE_MATCH', ''),
+                     request.META.get('HTTP_IF_MODIFIED_SINCE', '')))
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def wait_shared(cache, key, func):
+    """
+    Объединение запросов между воркерами через общий кэш API_COALESCE_CACHE:
+    первый запрос берет блокировку и кладет ответ в кэш на API_COALESCE_RESULT_TTL секунд,
+    остальные ждут ответ, пока блокировка не снята
+    """
+    result_key = 'coalesce:result:{}'.format(key)
+    lock_key = 'coalesce:lock:{}'.format(key)
+
+    frozen = cache.get(result_key)
+    if frozen is not None:
+        return thaw_response(frozen)
+
+    if cache.add(lock_key, 1, timeout=int(settings.API_COALESCE_TIMEOUT + 1)):
+        try:
+            response = func()
+            if is_shareable(response):
+                cache.set(result_key, freeze_response(response), timeout=settings.API_COALESCE_RESULT_TTL)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + settings.API_COALESCE_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.01)
+        frozen = cache.get(result_key)
+        if frozen is not None:
+            return thaw_response(frozen)
+        if cache.get(lock_key) is None:
+            break
+    return func()
+
+
+def coalesce_requests(view):
+    """
+    Одинаковые одновременные GET-запросы выполняются один раз в процессе, а с API_COALESCE_CACHE -
+    один раз на все воркеры. Запросы клиентов, закрепленных за основной базой после изменения,
+    выполняются отдельно, чтобы они видели свои изменения
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.API_COALESCE or request.method != 'GET' or is_pinned(request):
+            return view(request, *args, **kwargs)
+
+        key = get_request_key(request)
+
+        def call():
+            if settings.API_COALESCE_CACHE:
+                return wait_shared(caches[settings.API_COALESCE_CACHE], key, lambda: view(request, *args, **kwargs))
+            return view(request, *args, **kwargs)
+
+        response, shared = _flights.do(key, call, settings.API_COALESCE_TIMEOUT)
+        return thaw_response(response) if shared else response
+    return wrapper
@@ -0,0 +1,99 @@
+from functools import partial
+
+from django.conf import settings
+from django.db import OperationalError
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+from movies.api.throttling import get_client_key, get_rate_limiter, too_many_requests
+from movies.api.v1.caching import is_cache_refresh
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def get_accepted_encodings(request):
+    """
+    Кодировки из Accept-Encoding, кроме явно запрещенных через q=0
+    """
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q=') and quality[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        if encoding:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+class ApiCompressionMiddleware:
+    """
+    Сжатие ответов API: brotli с уровнем API_COMPRESS_BROTLI_QUALITY, если установлен модуль brotli
+    и клиент его принимает, иначе gzip. Ответы короче API_COMPRESS_MIN_SIZE байт не сжимаются
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if not request.path.startswith('/api/') or response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < settings.API_COMPRESS_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accepted = get_accepted_encodings(request)
+        if brotli is not None and 'br' in accepted and not response.streaming:
+            encoding, compress = 'br', partial(brotli.compress, quality=settings.API_COMPRESS_BROTLI_QUALITY)
+        elif 'gzip' in accepted:
+            encoding, compress = 'gzip', compress_string
+        else:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressed_content = compress(response.content)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response['Content-Length'] = str(len(response.content))
+
+        # Сжатый ответ не совпадает побайтно с исходным, поэтому сильный ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class ApiThrottleMiddleware:
+    """
+    Ограничение частоты запросов к API для каждого клиента (429) и ответ 503 вместо 500,
+    если запрос к базе прерван по statement_timeout. Запросы обновления и прогрева кэша от самого приложения
+    приходят через nginx с одного адреса и не ограничиваются
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiter = get_rate_limiter() if settings.API_RATE_LIMIT else None
+
+    def __call__(self, request):
+        if self.limiter is not None and request.path.startswith('/api/') and not is_cache_refresh(request):
+            wait = self.limiter.acquire(get_client_key(request))
+            if wait:
+                return too_many_requests(wait)
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        # 57014 - query_canceled, так PostgreSQL сообщает о превышении statement_timeout
+        if (request.path.startswith('/api/') and isinstance(exception, OperationalError)
+                and getattr(exception.__cause__, 'pgcode', None) == '57014'):
+            return too_many_requests(1, status=503)
+        return None
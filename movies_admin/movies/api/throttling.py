@@ -0,0 +1,112 @@
+"""
+Защита базы от перегрузки запросами к API: ограничение частоты запросов для каждого клиента
+и ограничение количества одновременно выполняемых тяжелых запросов в процессе.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+
+def get_client_key(request):
+    """
+    Клиент определяется по API-ключу из API_KEYS, а без него или с неизвестным ключом по IP-адресу.
+    Иначе клиент обходил бы ограничение, присылая каждый раз новый ключ
+    """
+    api_key = request.META.get('HTTP_X_API_KEY')
+    if api_key and api_key in settings.API_KEYS:
+        return 'key:{}'.format(api_key)
+    ip = request.META.get(settings.API_CLIENT_IP_HEADER) if settings.API_CLIENT_IP_HEADER else None
+    return 'ip:{}'.format(ip or request.META.get('REMOTE_ADDR'))
+
+
+def too_many_requests(retry_after, status=429):
+    response = JsonResponse({'error': 'too many requests'}, status=status)
+    response['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket в памяти процесса: API_RATE_LIMIT запросов в секунду с запасом API_RATE_BURST.
+    Хранит не больше API_RATE_LIMIT_MAX_CLIENTS клиентов, давно не приходившие вытесняются
+    """
+
+    def __init__(self, rate, burst, max_clients):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, client_key):
+        """
+        :return: 0, если запрос разрешен, иначе через сколько секунд появится токен
+        """
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated_at = self.buckets.pop(client_key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            self.buckets[client_key] = (tokens, now)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return wait
+
+
+class SharedWindowLimiter:
+    """
+    Ограничение через общий кэш Django (Redis, Memcached) для всех воркеров: счетчик запросов клиента
+    в окне API_RATE_WINDOW секунд, допускается API_RATE_LIMIT * API_RATE_WINDOW + API_RATE_BURST запросов
+    """
+
+    def __init__(self, cache_alias, rate, burst, window):
+        self.cache = caches[cache_alias]
+        self.limit = rate * window + burst
+        self.window = window
+
+    def acquire(self, client_key):
+        now = time.time()
+        window_start = int(now // self.window) * self.window
+        key = 'api-rate:{}:{}'.format(client_key, window_start)
+        self.cache.add(key, 0, timeout=self.window + 1)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # ключ успел истечь между add и incr
+            self.cache.add(key, 1, timeout=self.window + 1)
+            count = 1
+        return 0 if count <= self.limit else window_start + self.window - now
+
+
+def get_rate_limiter():
+    if settings.API_RATE_LIMIT_CACHE:
+        return SharedWindowLimiter(settings.API_RATE_LIMIT_CACHE, settings.API_RATE_LIMIT,
+                                   settings.API_RATE_BURST, settings.API_RATE_WINDOW)
+    return TokenBucketLimiter(settings.API_RATE_LIMIT, settings.API_RATE_BURST,
+                              settings.API_RATE_LIMIT_MAX_CLIENTS)
+
+
+_expensive_queries = threading.BoundedSemaphore(settings.API_MAX_CONCURRENT_QUERIES)
+
+
+def shed_load(view):
+    """
+    Не больше API_MAX_CONCURRENT_QUERIES одновременных тяжелых запросов на процесс.
+    Если место не освободилось за API_QUEUE_TIMEOUT секунд, сразу отвечает 503
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not _expensive_queries.acquire(timeout=settings.API_QUEUE_TIMEOUT):
+            return too_many_requests(settings.API_QUEUE_TIMEOUT, status=503)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _expensive_queries.release()
+    return wrapper
@@ -0,0 +1,204 @@
+"""
+Заголовки для HTTP-кэширования ответов API и обновление кэша nginx после изменений.
+
+Last-Modified и ETag считаются по updated_at кинопроизведений и журналу изменений, поэтому повторные
+запросы с If-None-Match/If-Modified-Since получают 304 без выполнения тяжелого запроса с агрегатами.
+
+Страницы фильмов дополнительно хранятся в LRU-кэше процесса (movie_cache), изменения фильма
+удаляют его из кэша процесса, в котором они сделаны, в остальных запись живет до API_MOVIE_CACHE_TTL секунд.
+"""
+import hashlib
+import logging
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Max
+
+from config.db_router import PIN_COOKIE, pin_cookie_value
+from movies.models import FilmWork, FilmWorkChange
+
+logger = logging.getLogger(__name__)
+
+# Параметры списка фильмов, для которых не считается версия всей таблицы
+UNVERSIONED_MOVIES_PARAMS = frozenset(('sort', 'updated_since', 'ids'))
+
+# Варианты сжатия, под которыми nginx хранит ответы (map $api_encoding в etc/nginx/conf.d/site.conf)
+CACHE_ENCODINGS = ('br', 'gzip', 'identity')
+
+# Значение X-Cache-Refresh подписывается SECRET_KEY и действительно CACHE_REFRESH_MAX_AGE секунд.
+# По подписи приложение отличает свои запросы обновления кэша от клиентских и не ограничивает их частоту
+CACHE_REFRESH_SALT = 'movies.api.cache_refresh'
+CACHE_REFRESH_MAX_AGE = 60
+
+_pending = threading.local()
+
+
+class LRUCache:
+    """
+    Кэш в памяти процесса на max_size записей, каждая живет ttl секунд, при переполнении
+    вытесняются давно не запрошенные
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if not self.max_size:
+            return
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.items.pop(key, None)
+
+
+movie_cache = LRUCache(settings.API_MOVIE_CACHE_SIZE, settings.API_MOVIE_CACHE_TTL)
+
+
+def get_movies_version(request):
+    """
+    Версия списка фильмов, несколько чтений по индексам на HTTP-запрос: время последнего изменения фильмов,
+    курсор последней записи журнала из завершенных транзакций и количество видимых записей после него.
+    Удаление фильма не меняет max(updated_at), но добавляет запись в журнал. Пока открыта длинная транзакция,
+    курсор не двигается, но каждая закоммиченная после ее начала транзакция увеличивает количество записей.
+    Для сортированного списка (sort), выборки по updated_since и по списку ids не считается, такие ответы
+    кэшируются только по Cache-Control
+    """
+    if not UNVERSIONED_MOVIES_PARAMS.isdisjoint(request.GET):
+        return {'last_modified': None, 'changes': None}
+    if not hasattr(request, '_movies_version'):
+        head = FilmWorkChange.objects.settled().head()
+        request._movies_version = {
+            'last_modified': FilmWork.objects.aggregate(Max('updated_at'))['updated_at__max'],
+            'changes': (head, FilmWorkChange.objects.after(head).count()),
+        }
+    return request._movies_version
+
+
+def movies_last_modified(request, *args, **kwargs):
+    return get_movies_version(request)['last_modified']
+
+
+def movies_etag(request, *args, **kwargs):
+    version = get_movies_version(request)
+    if version['last_modified'] is None:
+        return None
+    key = '{}:{}'.format(version['last_modified'].isoformat(), version['changes'])
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def movie_last_modified(request, pk, *args, **kwargs):
+    # MoviesDetailApi загружает фильм вместе с временем изменения до проверки условных заголовков
+    if hasattr(request, 'movie'):
+        return request.movie['last_modified'] if request.movie else None
+    return (FilmWork.objects
+            .filter(pk=pk)
+            .values_list('updated_at', flat=True)
+            .first())
+
+
+def movie_etag(request, pk, *args, **kwargs):
+    last_modified = movie_last_modified(request, pk)
+    if last_modified is None:
+        return None
+    return hashlib.md5('{}:{}'.format(pk, last_modified.isoformat()).encode()).hexdigest()
+
+
+def refresh_movies_cache(film_work_ids):
+    """
+    Запланировать удаление фильмов из кэша процесса и обновление закэшированных в nginx страниц фильмов
+    после коммита транзакции. Идентификаторы копятся до коммита, так что несколько сигналов в одной транзакции
+    дают один запрос на каждый фильм.
+    :param film_work_ids: id измененных кинопроизведений
+    """
+    pending = getattr(_pending, 'ids', None)
+    if pending is None:
+        pending = _pending.ids = set()
+    pending.update(film_work_ids)
+    transaction.on_commit(_flush_refresh)
+
+
+def _flush_refresh():
+    film_work_ids = getattr(_pending, 'ids', None)
+    _pending.ids = None
+    if not film_work_ids:
+        return
+    movie_cache.delete_many(str(film_work_id) for film_work_id in film_work_ids)
+    if settings.API_CACHE_REFRESH_URL:
+        urls = ['{}/api/v1/movies/{}/'.format(settings.API_CACHE_REFRESH_URL.rstrip('/'), film_work_id)
+                for film_work_id in film_work_ids]
+        threading.Thread(target=_send_refresh, args=(urls,), daemon=True).start()
+
+
+def cache_refresh_token():
+    return signing.TimestampSigner(salt=CACHE_REFRESH_SALT).sign('1')
+
+
+def is_cache_refresh(request):
+    """
+    Запрос обновления кэша от самого приложения: nginx передает X-Cache-Refresh только от внутренних адресов,
+    а подпись проверяется здесь, так как до приложения можно достучаться и в обход nginx
+    """
+    token = request.META.get('HTTP_X_CACHE_REFRESH')
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=CACHE_REFRESH_SALT).unsign(token, max_age=CACHE_REFRESH_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def cache_refresh_request(url, encoding='identity', pin=True):
+    """
+    Запрос, который nginx выполняет мимо кэша и сохраняет ответ в кэш
+    :param encoding: вариант сжатия из CACHE_ENCODINGS, nginx хранит каждый вариант отдельно
+    :param pin: читать с основной базы, чтобы не взять с реплики данные до только что сделанного изменения.
+    Такой запрос идет мимо movie_cache, без закрепления ответ сохраняется и в movie_cache воркера
+    """
+    # X-Cache-Refresh заставляет nginx сходить в приложение и перезаписать кэш,
+    # cookie закрепляет чтение за основной базой
+    headers = {'X-Cache-Refresh': cache_refresh_token(), 'Accept-Encoding': encoding}
+    if pin:
+        headers['Cookie'] = '{}={}'.format(PIN_COOKIE, pin_cookie_value())
+    return urllib.request.Request(url, headers=headers)
+
+
+def _send_refresh(urls):
+    for url in urls:
+        for encoding in CACHE_ENCODINGS:
+            try:
+                urllib.request.urlopen(cache_refresh_request(url, encoding),
+                                       timeout=settings.API_CACHE_REFRESH_TIMEOUT).close()
+            except urllib.error.HTTPError as e:
+                if e.code != 404:
+                    logger.warning('Cache refresh for %s failed: %s', url, e)
+                break
+            except OSError as e:
+                logger.warning('Cache refresh for %s failed: %s', url, e)
+                break
@@ -4,5 +4,10 @@ from movies.api.v1 import views
 
 urlpatterns = [
     path('movies/', views.Movies.as_view()),
-    path('movies/<uuid:pk>/', views.MoviesDetailApi.as_view())
+    path('movies/changes/', views.MoviesChangesApi.as_view()),
+    path('movies/<uuid:pk>/', views.MoviesDetailApi.as_view()),
+    path('movies/<uuid:pk>/credits/', views.MovieCreditsApi.as_view()),
+    path('persons/', views.PersonsApi.as_view()),
+    path('persons/<uuid:pk>/', views.PersonDetailApi.as_view()),
+    path('genres/', views.GenresApi.as_view())
 ]
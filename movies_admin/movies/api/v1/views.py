@@ -1,44 +1,244 @@
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Q
-from django.http import JsonResponse, Http404
+import json
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import BooleanField, Count, Exists, F, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from django.http import HttpResponse, JsonResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic.detail import BaseDetailView
 from django.views.generic.list import BaseListView
 from django.core.paginator import Paginator, InvalidPage
 
-from movies.models import FilmWork
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from config.db_router import is_pinned, read_from_primary
+from movies.api.coalescing import coalesce_requests
+from movies.api.throttling import shed_load
+from movies.api.v1.caching import (is_cache_refresh, movie_cache, movies_etag, movies_last_modified, movie_etag,
+                                   movie_last_modified)
+from movies.models import FilmWork, FilmWorkChange, Genre, GenreFilmWork, Person, PersonFilmWork, PersonRole
+from movies.signals import bulk_change, credits_changed
 
 PAGINATE_BY = 50
+CHANGES_BATCH_SIZE = 500
+BATCH_MAX_IDS = 100
+
+SETTLED_TIME_QUERY = '''
+    SELECT least(clock_timestamp() - make_interval(secs => %s), min(xact_start))
+    FROM pg_stat_activity
+    WHERE datname = current_database() AND backend_type = 'client backend'
+        AND backend_xid IS NOT NULL AND pid <> pg_backend_pid()
+'''
+
+MOVIE_FIELDS = ('id', 'title', 'description', 'creation_date', 'rating', 'type',
+                'actors', 'directors', 'writers', 'genres')
+
+# Сортировки списка фильмов: поле и признак обратного порядка. Для каждого поля есть индекс (поле, id)
+MOVIE_SORTS = {
+    'rating': ('rating', False),
+    '-rating': ('rating', True),
+    'creation_date': ('creation_date', False),
+    '-creation_date': ('creation_date', True),
+}
+
+# Поля ответа, которые берутся из денормализованных массивов film_work
+MOVIE_ANNOTATIONS = {
+    'actors': lambda: F('actor_names'),
+    'writers': lambda: F('writer_names'),
+    'directors': lambda: F('director_names'),
+    'genres': lambda: F('genre_names'),
+}
+
+
+class ResponseFormatMixin:
+    """
+    Формат ответа из параметра format:
+    json - обычный JSON;
+    columnar - JSON, в котором results заменен на columns (имена полей) и rows (списки значений);
+    msgpack - то же, что columnar, в MessagePack (нужен установленный модуль msgpack)
+    """
+    response_format = 'json'
+
+    def dispatch(self, request, *args, **kwargs):
+        response_format = request.GET.get('format', 'json')
+        if response_format not in ('json', 'columnar', 'msgpack'):
+            return JsonResponse({'error': 'unknown format: {}'.format(response_format)}, status=400)
+        if response_format == 'msgpack' and msgpack is None:
+            return JsonResponse({'error': 'msgpack format is not available'}, status=400)
+        self.response_format = response_format
+        return super().dispatch(request, *args, **kwargs)
+
+    def render_payload(self, payload):
+        if self.response_format == 'json':
+            return JsonResponse(payload)
+
+        if isinstance(payload.get('results'), list):
+            results = payload.pop('results')
+            columns = list(results[0]) if results else []
+            payload['columns'] = columns
+            payload['rows'] = [[row[column] for column in columns] for row in results]
 
+        if self.response_format == 'msgpack':
+            return HttpResponse(msgpack.packb(payload, default=DjangoJSONEncoder().default),
+                                content_type='application/msgpack')
+        return JsonResponse(payload)
 
-class MoviesApiMixin:
+
+class MoviesApiMixin(ResponseFormatMixin):
     model = FilmWork
     http_method_names = ['get']
+    fields = MOVIE_FIELDS
+
+    def dispatch(self, request, *args, **kwargs):
+        if 'fields' in request.GET:
+            requested = {field for field in request.GET['fields'].split(',') if field}
+            unknown = requested - set(MOVIE_FIELDS)
+            if unknown:
+                return JsonResponse({'error': 'unknown fields: {}'.format(', '.join(sorted(unknown)))}, status=400)
+            # id нужен всегда: по нему работают пагинация, курсоры и поиск по ids
+            self.fields = tuple(field for field in MOVIE_FIELDS if field in requested or field == 'id')
+        return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        return (
-            self.model
-                .objects
-                .annotate(actors=ArrayAgg('people__full_name',
-                                          filter=Q(personfilmwork__role='actor'), distinct=True))
-                .annotate(writers=ArrayAgg('people__full_name',
-                                           filter=Q(personfilmwork__role='writer'), distinct=True))
-                .annotate(directors=ArrayAgg('people__full_name',
-                                             filter=Q(personfilmwork__role='director'), distinct=True))
-                .annotate(genres=ArrayAgg('genre__name', distinct=True))
-                .order_by('id')
-
-        )
+        """
+        Запрос к одной таблице film_work: участники и жанры читаются из денормализованных массивов,
+        незапрошенные массивы не выбираются
+        """
+        queryset = self.model.objects.order_by('id')
+        for field in self.fields:
+            if field in MOVIE_ANNOTATIONS:
+                queryset = queryset.annotate(**{field: MOVIE_ANNOTATIONS[field]()})
+        return queryset
 
     def render_to_response(self, context, **response_kwargs):
-        return JsonResponse(context)
+        return self.render_payload(context)
+
 
+api_cache_control = cache_control(public=True, max_age=settings.API_CACHE_MAX_AGE,
+                                  stale_while_revalidate=settings.API_CACHE_STALE_WHILE_REVALIDATE)
 
+
+@method_decorator(api_cache_control, name='get')
+@method_decorator(condition(etag_func=movies_etag, last_modified_func=movies_last_modified), name='get')
+@method_decorator(coalesce_requests, name='dispatch')
+@method_decorator(shed_load, name='dispatch')
 class Movies(MoviesApiMixin, BaseListView):
 
+    def get(self, request, *args, **kwargs):
+        if 'ids' in request.GET:
+            return self.get_batch(request)
+        if 'updated_since' in request.GET:
+            return self.get_updated_since(request)
+        if 'sort' in request.GET:
+            return self.get_sorted(request)
+        return super().get(request, *args, **kwargs)
+
+    def get_batch(self, request):
+        """
+        Фильмы по списку id (ids=id1,id2,... не больше BATCH_MAX_IDS) одним запросом.
+        Результаты идут в порядке запроса, ненайденные id перечисляются в missing
+        """
+        try:
+            ids = [uuid.UUID(film_work_id)
+                   for value in request.GET.getlist('ids')
+                   for film_work_id in value.split(',') if film_work_id]
+        except ValueError:
+            return JsonResponse({'error': 'ids must be comma separated UUIDs'}, status=400)
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > BATCH_MAX_IDS:
+            return JsonResponse({'error': 'at most {} ids per request'.format(BATCH_MAX_IDS)}, status=400)
+
+        found = {movie['id']: movie for movie in self.get_queryset().filter(id__in=ids).values(*self.fields)}
+        return self.render_payload({
+            'results': [found[film_work_id] for film_work_id in ids if film_work_id in found],
+            'missing': [film_work_id for film_work_id in ids if film_work_id not in found],
+        })
+
+    def get_updated_since(self, request):
+        """
+        Фильмы, измененные начиная с updated_since, в порядке (updated_at, id).
+        Следующая страница запрашивается с параметрами из next_updated_since и next_after_id,
+        выборка идет по индексу film_work_updated_at_idx без подсчета общего количества.
+        Фильмы, измененные позже чем MOVIES_CHANGES_SETTLE_SECONDS назад или после начала самой старой
+        незавершенной транзакции, не отдаются (get_settled_time): updated_at берется на начало транзакции,
+        и незакоммиченное изменение с меньшим updated_at оказалось бы позади курсора клиента.
+        Открытые транзакции видны только на основной базе, поэтому выборка читается из нее, а не из реплик
+        """
+        updated_since = parse_datetime(request.GET['updated_since'])
+        if updated_since is None:
+            return JsonResponse({'error': 'updated_since must be an ISO 8601 datetime'}, status=400)
+        if timezone.is_naive(updated_since):
+            updated_since = timezone.make_aware(updated_since, timezone.utc)
+
+        keyset = Q(updated_at__gte=updated_since)
+        if 'after_id' in request.GET:
+            try:
+                after_id = uuid.UUID(request.GET['after_id'])
+            except ValueError:
+                return JsonResponse({'error': 'after_id must be a UUID'}, status=400)
+            keyset &= Q(updated_at__gt=updated_since) | Q(id__gt=after_id)
+
+        with read_from_primary():
+            keyset &= Q(updated_at__lt=get_settled_time(router.db_for_read(self.model)))
+            page_ids = (self.model.objects
+                        .filter(keyset)
+                        .order_by('updated_at', 'id')
+                        .values('id')[:PAGINATE_BY])
+            results = list(self.get_queryset()
+                           .filter(id__in=page_ids)
+                           .order_by('updated_at', 'id')
+                           .values(*self.fields, 'updated_at'))
+
+        last = results[-1] if len(results) == PAGINATE_BY else None
+        return self.render_payload({
+            'next_updated_since': last['updated_at'].isoformat().replace('+00:00', 'Z') if last else None,
+            'next_after_id': last['id'] if last else None,
+            'results': results,
+        })
+
+    def get_sorted(self, request):
+        """
+        Фильмы в порядке sort (rating, -rating, creation_date, -creation_date, при равенстве - по id).
+        Следующая страница запрашивается с курсором after из next_after, каждая страница читается по индексу
+        (поле, id) без OFFSET и подсчета общего количества. Фильмы без значения поля идут после остальных
+        """
+        if request.GET['sort'] not in MOVIE_SORTS:
+            return JsonResponse({'error': 'sort must be one of: {}'.format(', '.join(MOVIE_SORTS))}, status=400)
+        if 'page' in request.GET:
+            return JsonResponse({'error': 'sort is paginated with after, not page'}, status=400)
+        field, descending = MOVIE_SORTS[request.GET['sort']]
+        try:
+            after = parse_sort_cursor(request.GET.get('after'), self.model._meta.get_field(field))
+        except (ValueError, ValidationError):
+            return JsonResponse({'error': 'after must be a cursor returned as next_after'}, status=400)
+
+        results = sorted_page(self.get_queryset(), field, descending, after, (*self.fields, field))
+        last = results[-1] if len(results) == PAGINATE_BY else None
+        next_after = format_sort_cursor(last[field], last['id']) if last else None
+        # Поле сортировки выбирается для курсора, в ответ оно попадает, только если запрошено в fields
+        if field not in self.fields:
+            for movie in results:
+                del movie[field]
+        return self.render_payload({
+            'next_after': next_after,
+            'results': results,
+        })
+
     def get_context_data(self, *, object_list=None, **kwargs):
-        queryset = self.get_queryset().values('id', 'title', 'description', 'creation_date',
-                                              'rating', 'type', 'actors',
-                                              'directors', 'writers', 'genres')
+        queryset = self.get_queryset().values(*self.fields)
 
         paginator, page, object_list, has_other_pages = self.paginate_queryset(queryset, PAGINATE_BY)
 
@@ -53,13 +253,353 @@ class Movies(MoviesApiMixin, BaseListView):
 
     def render_to_response(self, context, **response_kwargs):
         context['results'] = list(context['results'])
-        return JsonResponse(context)
+        return self.render_payload(context)
 
 
+@method_decorator(api_cache_control, name='get')
+@method_decorator(condition(etag_func=movie_etag, last_modified_func=movie_last_modified), name='get')
+@method_decorator(coalesce_requests, name='dispatch')
+@method_decorator(shed_load, name='dispatch')
 class MoviesDetailApi(MoviesApiMixin, BaseDetailView):
+    """
+    Страница фильма. Фильм читается один раз за запрос, до проверки ETag и Last-Modified,
+    и берется из кэша процесса, если его там нет - одним запросом по первичному ключу
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        request.movie = get_movie(request, kwargs['pk'])
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_object(self, queryset=None):
+        if self.request.movie is None:
+            raise Http404('No film work found matching the query')
+        return self.request.movie
 
     def get_context_data(self, **kwargs):
-        return self.get_object(self.get_queryset()
-                               .values('id', 'title', 'description', 'creation_date',
-                                       'rating', 'type', 'actors',
-                                       'directors', 'writers', 'genres'))
+        return {field: self.object[field] for field in self.fields}
+
+
+def get_movie(request, pk):
+    """
+    Все поля MOVIE_FIELDS и время изменения фильма (last_modified). Фильм хранится в movie_cache,
+    клиенты, закрепленные за основной базой после изменения, и обновление кэша nginx читают мимо него.
+    Обновление и прогрев кэша nginx сохраняют прочитанный фильм в movie_cache
+    :return: словарь или None, если фильма нет
+    """
+    pinned = is_pinned(request)
+    movie = None if pinned or is_cache_refresh(request) else movie_cache.get(str(pk))
+    if movie is None:
+        movie = (FilmWork.objects
+                 .filter(pk=pk)
+                 .annotate(**{field: annotation() for field, annotation in MOVIE_ANNOTATIONS.items()},
+                           last_modified=F('updated_at'))
+                 .values(*MOVIE_FIELDS, 'last_modified')
+                 .first())
+        if movie is not None and not pinned:
+            movie_cache.set(str(pk), movie)
+    return movie
+
+
+@method_decorator(shed_load, name='dispatch')
+class MoviesChangesApi(MoviesApiMixin, View):
+    """
+    Фильмы, измененные после курсора since, пачками по CHANGES_BATCH_SIZE записей журнала.
+    Курсор следующей пачки возвращается в next_since, удаленные фильмы перечисляются в deleted.
+    Записи незавершенных транзакций не отдаются (FilmWorkChangeQuerySet.settled): курсор не должен уйти
+    за id, которые уже выданы транзакции, но еще не закоммичены
+    """
+
+    def get(self, request):
+        try:
+            since = parse_changes_cursor(request.GET.get('since'))
+        except ValueError:
+            return JsonResponse({'error': 'since must be a token returned as next_since'}, status=400)
+
+        changes = list(FilmWorkChange.objects
+                       .settled()
+                       .after(since)
+                       .values_list('transaction_id', 'id', 'film_work_id')[:CHANGES_BATCH_SIZE])
+
+        film_work_ids = list(dict.fromkeys(film_work_id for transaction_id, change_id, film_work_id in changes))
+        results = list(self.get_queryset().filter(id__in=film_work_ids).values(*self.fields))
+        found = {movie['id'] for movie in results}
+
+        return self.render_payload({
+            'next_since': format_changes_cursor(changes[-1][:2]) if changes else request.GET.get('since', ''),
+            'has_more': len(changes) == CHANGES_BATCH_SIZE,
+            'results': results,
+            'deleted': [film_work_id for film_work_id in film_work_ids if film_work_id not in found],
+        })
+
+
+def get_settled_time(using):
+    """
+    Время, раньше которого изменения фильмов уже закоммичены: MOVIES_CHANGES_SETTLE_SECONDS назад,
+    но не позже начала самой старой транзакции с записью в других сеансах (загрузка load_data.py,
+    пачка refresh_film_work_roles). Сеансы других ролей видны в pg_stat_activity только с правом
+    pg_read_all_stats, поэтому приложение и загрузка работают под одной ролью
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(SETTLED_TIME_QUERY, [settings.MOVIES_CHANGES_SETTLE_SECONDS])
+        return cursor.fetchone()[0]
+
+
+def format_changes_cursor(cursor):
+    """
+    Курсор журнала изменений: номер транзакции и id записи через запятую
+    """
+    return '{},{}'.format(*cursor)
+
+
+def parse_changes_cursor(since):
+    """
+    :return: пара (transaction_id, id) или None с начала журнала
+    """
+    if not since:
+        return None
+    transaction_id, separator, change_id = since.partition(',')
+    if not separator:
+        raise ValueError(since)
+    return int(transaction_id), int(change_id)
+
+
+def get_after_id(request):
+    """
+    Курсор страницы: id последнего объекта предыдущей страницы из параметра after
+    :return: UUID или None для первой страницы
+    """
+    after = request.GET.get('after')
+    return uuid.UUID(after) if after else None
+
+
+def format_sort_cursor(value, film_work_id):
+    """
+    Курсор сортированного списка: значение поля сортировки (пустое, если его нет) и id через запятую
+    """
+    return '{},{}'.format('' if value is None else value, film_work_id)
+
+
+def parse_sort_cursor(after, field):
+    """
+    :return: значение поля и UUID последнего фильма предыдущей страницы или None для первой страницы
+    """
+    if not after:
+        return None
+    value, separator, film_work_id = after.rpartition(',')
+    if not separator:
+        raise ValueError(after)
+    return (field.to_python(value) if value else None), uuid.UUID(film_work_id)
+
+
+def sorted_page(queryset, field, descending, after, fields):
+    """
+    Страница PAGINATE_BY фильмов после курсора after в порядке (field, id). Сначала идут фильмы со значением поля,
+    затем фильмы без значения в порядке id
+    """
+    sign = '-' if descending else ''
+    value, after_id = after or (None, None)
+
+    results = []
+    if after is None or value is not None:
+        page = queryset.filter(**{field + '__isnull': False})
+        if after is not None:
+            # Сравнение строк (поле, id) > (значение, id) Postgres ищет по индексу (поле, id) сразу с нужного места,
+            # даже если у многих фильмов одинаковое значение поля. В ORM такого сравнения нет
+            column = FilmWork._meta.get_field(field).column
+            page = page.filter(RawSQL('({}, id) {} (%s, %s)'.format(column, '<' if descending else '>'),
+                                      (value, after_id), output_field=BooleanField()))
+        results = list(page.order_by(sign + field, sign + 'id').values(*fields)[:PAGINATE_BY])
+        after_id = None
+
+    if len(results) < PAGINATE_BY:
+        empty = queryset.filter(**{field + '__isnull': True})
+        if after_id is not None:
+            empty = empty.filter(**{'id__lt' if descending else 'id__gt': after_id})
+        results += list(empty.order_by(sign + 'id').values(*fields)[:PAGINATE_BY - len(results)])
+    return results
+
+
+def keyset_page(queryset, after_id, *fields):
+    """
+    Страница PAGINATE_BY объектов с id больше after_id и курсор следующей страницы
+    """
+    if after_id is not None:
+        queryset = queryset.filter(id__gt=after_id)
+    results = list(queryset.order_by('id').values(*fields)[:PAGINATE_BY])
+    next_after = results[-1]['id'] if len(results) == PAGINATE_BY else None
+    return results, next_after
+
+
+@method_decorator(api_cache_control, name='get')
+class PersonsApi(ResponseFormatMixin, View):
+    """
+    Персоны с количеством фильмов по ролям, постранично по id (after - id последней персоны
+    предыдущей страницы). Параметр role оставляет только персон с этой ролью
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        role = request.GET.get('role')
+        if role and role not in PersonRole.values:
+            return JsonResponse({'error': 'unknown role: {}'.format(role)}, status=400)
+        try:
+            after_id = get_after_id(request)
+        except ValueError:
+            return JsonResponse({'error': 'after must be a UUID'}, status=400)
+
+        people = Person.objects.all()
+        if role:
+            # Полусоединение по индексу (person_id, role, film_work_id) вместо соединения с distinct
+            people = people.filter(Exists(PersonFilmWork.objects.filter(person_id=OuterRef('pk'), role=role)))
+        people, next_after = keyset_page(people, after_id, 'id', 'full_name', 'birth_date')
+
+        film_counts = {person['id']: {role: 0 for role in PersonRole.values} for person in people}
+        for person_id, person_role, count in (PersonFilmWork.objects
+                                              .filter(person_id__in=film_counts)
+                                              .values('person_id', 'role')
+                                              .annotate(count=Count('film_work_id'))
+                                              .values_list('person_id', 'role', 'count')
+                                              .order_by()):
+            film_counts[person_id][person_role] = count
+        for person in people:
+            person['film_counts'] = film_counts[person['id']]
+
+        return self.render_payload({'results': people, 'next_after': next_after})
+
+
+@method_decorator(api_cache_control, name='get')
+class PersonDetailApi(ResponseFormatMixin, View):
+    """
+    Персона и id ее фильмов по ролям
+    """
+    http_method_names = ['get']
+
+    def get(self, request, pk):
+        person = (Person.objects
+                  .filter(pk=pk)
+                  .values('id', 'full_name', 'birth_date')
+                  .first())
+        if person is None:
+            raise Http404
+
+        film_ids = {role: [] for role in PersonRole.values}
+        for role, film_work_id in (PersonFilmWork.objects
+                                   .filter(person_id=pk)
+                                   .order_by('role', 'film_work_id')
+                                   .values_list('role', 'film_work_id')):
+            film_ids.setdefault(role, []).append(film_work_id)
+
+        person['film_ids'] = film_ids
+        person['film_counts'] = {role: len(ids) for role, ids in film_ids.items()}
+        return self.render_payload(person)
+
+
+@method_decorator(api_cache_control, name='get')
+class GenresApi(ResponseFormatMixin, View):
+    """
+    Жанры с количеством фильмов, постранично по id (after - id последнего жанра предыдущей страницы)
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        try:
+            after_id = get_after_id(request)
+        except ValueError:
+            return JsonResponse({'error': 'after must be a UUID'}, status=400)
+
+        genres, next_after = keyset_page(Genre.objects.all(), after_id, 'id', 'name', 'description')
+
+        film_counts = dict(GenreFilmWork.objects
+                           .filter(genre_id__in=[genre['id'] for genre in genres])
+                           .values('genre_id')
+                           .annotate(count=Count('film_work_id'))
+                           .values_list('genre_id', 'count')
+                           .order_by())
+        for genre in genres:
+            genre['film_count'] = film_counts.get(genre['id'], 0)
+
+        return self.render_payload({'results': genres, 'next_after': next_after})
+
+
+class MovieCreditsApi(View):
+    """
+    Массовая замена состава участников фильма.
+    Тело запроса: {"credits": [{"person_id": uuid, "role": actor|director|writer}, ...]}.
+    Текущие связи сравниваются с присланными: недостающие создаются одним bulk_create,
+    лишние удаляются одним delete, все в одной транзакции.
+    """
+    http_method_names = ['put']
+
+    def put(self, request, pk):
+        if not request.user.has_perm('movies.change_personfilmwork'):
+            return JsonResponse({'error': 'permission denied'}, status=403)
+
+        try:
+            requested = self.parse_credits(request.body)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        film_work = get_object_or_404(FilmWork, pk=pk)
+
+        person_ids = {person_id for person_id, role in requested}
+        existing_people = set(Person.objects.filter(id__in=person_ids).values_list('id', flat=True))
+        missing_people = person_ids - existing_people
+        if missing_people:
+            return JsonResponse({'error': 'unknown persons', 'person_ids': sorted(map(str, missing_people))},
+                                status=400)
+
+        with transaction.atomic():
+            current = {
+                (person_id, role): credit_id
+                for credit_id, person_id, role in (PersonFilmWork.objects
+                                                   .select_for_update()
+                                                   .filter(film_work_id=film_work)
+                                                   .values_list('id', 'person_id', 'role'))
+            }
+            deleted = [credit_id for key, credit_id in current.items() if key not in requested]
+            created = [
+                PersonFilmWork(film_work_id=film_work, person_id_id=person_id, role=role)
+                for person_id, role in requested if (person_id, role) not in current
+            ]
+
+            with bulk_change():
+                if deleted:
+                    PersonFilmWork.objects.filter(id__in=deleted).delete()
+                if created:
+                    PersonFilmWork.objects.bulk_create(created, ignore_conflicts=True)
+            if deleted or created:
+                credits_changed.send(sender=PersonFilmWork, film_work_id=film_work.id,
+                                     created=created, deleted=deleted)
+
+        return JsonResponse({
+            'id': film_work.id,
+            'created': len(created),
+            'deleted': len(deleted),
+            'unchanged': len(current) - len(deleted),
+        })
+
+    @staticmethod
+    def parse_credits(body):
+        """
+        Разбор и проверка тела запроса
+        :param body: тело запроса в JSON
+        :return: упорядоченный словарь {(person_id, role): None} без дублей
+        """
+        try:
+            credits = json.loads(body)['credits']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('body must be a JSON object with a "credits" list')
+        if not isinstance(credits, list):
+            raise ValueError('"credits" must be a list')
+
+        requested = {}
+        for credit in credits:
+            try:
+                person_id = uuid.UUID(str(credit['person_id']))
+                role = credit['role']
+            except (ValueError, KeyError, TypeError):
+                raise ValueError('each credit needs a valid "person_id" and "role"')
+            if role not in PersonRole.values:
+                raise ValueError('unknown role: {}'.format(role))
+            requested[(person_id, role)] = None
+        return requested
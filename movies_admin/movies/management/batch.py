@@ -0,0 +1,184 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+
+from movies.models import FilmWork
+
+
+def process_chunk(command_class, options, index, after, upto):
+    """
+    Обработка одного диапазона в процессе пула. Функция уровня модуля, чтобы ее можно было передать в пул
+    :return: номер диапазона, количество обработанных фильмов и время обработки в секундах
+    """
+    command = command_class()
+    command.options = options
+    command.chunk = (index, after, upto)
+    started = time.monotonic()
+    command.wait_for_db_load()
+    with transaction.atomic():
+        count = command.process_chunk(command.get_chunk_queryset(after, upto))
+    return index, count or 0, time.monotonic() - started
+
+
+def process_chunk_star(arguments):
+    return process_chunk(*arguments)
+
+
+class FilmWorkBatchCommand(BaseCommand):
+    """
+    Основа команд, обрабатывающих все кинопроизведения по диапазонам id.
+    Диапазоны (after, upto] строятся по индексу первичного ключа и обрабатываются пулом процессов,
+    каждый со своим соединением с БД и своей транзакцией на диапазон.
+    Готовые диапазоны сохраняются в файл состояния, прерванный запуск продолжается с места остановки.
+    Подклассы реализуют process_chunk и при необходимости finish
+    """
+    chunk_size = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=self.chunk_size,
+                            help='Сколько фильмов обрабатывается в одной транзакции')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Количество процессов, по умолчанию по числу ядер')
+        parser.add_argument('--max-active-queries', type=int, default=None,
+                            help='Не начинать новый диапазон, пока в БД выполняется столько запросов или больше')
+        parser.add_argument('--state-file', default=None,
+                            help='Файл с прогрессом для продолжения после прерывания')
+        parser.add_argument('--restart', action='store_true',
+                            help='Игнорировать сохраненный прогресс и начать заново')
+
+    def process_chunk(self, queryset):
+        """
+        Обработка диапазона фильмов, выполняется в транзакции
+        :param queryset: фильмы диапазона
+        :return: количество обработанных фильмов
+        """
+        raise NotImplementedError('subclasses of FilmWorkBatchCommand must provide a process_chunk() method')
+
+    def finish(self, state):
+        """
+        Вызывается после обработки всех диапазонов
+        :param state: состояние с диапазонами chunks и количеством фильмов в каждом counts
+        """
+
+    def get_chunk_queryset(self, after, upto):
+        queryset = FilmWork.objects.all()
+        if after is not None:
+            queryset = queryset.filter(id__gt=after)
+        if upto is not None:
+            queryset = queryset.filter(id__lte=upto)
+        return queryset
+
+    def get_chunks(self, chunk_size):
+        """
+        Границы диапазонов: каждый chunk_size-й id по индексу первичного ключа.
+        Последний диапазон открыт сверху и захватывает фильмы, добавленные во время обработки
+        :return: список пар [after, upto] строками, None - без ограничения
+        """
+        chunks = []
+        after = None
+        while True:
+            queryset = FilmWork.objects.order_by('id').values_list('id', flat=True)
+            if after is not None:
+                queryset = queryset.filter(id__gt=after)
+            upto = queryset[chunk_size - 1:chunk_size].first()
+            if upto is None:
+                chunks.append([after, None])
+                return chunks
+            upto = str(upto)
+            chunks.append([after, upto])
+            after = upto
+
+    def wait_for_db_load(self):
+        """
+        Ожидание, пока число активных запросов в БД не опустится ниже --max-active-queries
+        """
+        max_active = self.options.get('max_active_queries')
+        if not max_active or connection.vendor != 'postgresql':
+            return
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_stat_activity "
+                               "WHERE state = 'active' AND pid <> pg_backend_pid()")
+                if cursor.fetchone()[0] < max_active:
+                    return
+            time.sleep(1)
+
+    def get_state_file(self, options):
+        if options['state_file']:
+            return options['state_file']
+        name = self.__module__.rsplit('.', 1)[-1]
+        return os.path.join(tempfile.gettempdir(), 'movies_{}.progress.json'.format(name))
+
+    def load_state(self, path, options):
+        if not options['restart'] and os.path.exists(path):
+            with open(path) as state_file:
+                state = json.load(state_file)
+            if state['chunk_size'] == options['chunk_size']:
+                self.stdout.write('Resuming from {}'.format(path))
+                return state
+        return {
+            'chunk_size': options['chunk_size'],
+            'chunks': self.get_chunks(options['chunk_size']),
+            'done': [],
+        }
+
+    def save_state(self, path, state):
+        with open(path + '.tmp', 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        self.options = options
+        path = self.get_state_file(options)
+        state = self.load_state(path, options)
+        self.save_state(path, state)
+
+        done = set(state['done'])
+        pending = [(index, after, upto) for index, (after, upto) in enumerate(state['chunks']) if index not in done]
+        total = len(state['chunks'])
+        processed = 0
+        started = time.monotonic()
+
+        # Потоки вывода не передаются в дочерние процессы
+        chunk_options = {key: value for key, value in options.items() if key not in ('stdout', 'stderr')}
+        workers = max(1, min(options['workers'], len(pending)))
+        pool = None
+        if workers > 1:
+            # Дочерние процессы не должны наследовать открытые соединения родителя
+            connections.close_all()
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(process_chunk_star,
+                                          [(type(self), chunk_options, *chunk) for chunk in pending])
+        else:
+            results = (process_chunk(type(self), chunk_options, *chunk) for chunk in pending)
+
+        try:
+            for index, count, elapsed in results:
+                done.add(index)
+                state['done'].append(index)
+                state.setdefault('counts', {})[str(index)] = count
+                self.save_state(path, state)
+                processed += count
+
+                finished = len(done) - (total - len(pending))
+                rate = finished / (time.monotonic() - started)
+                eta = (total - len(done)) / rate if rate else 0
+                self.stdout.write('{}/{} chunks, {} film works, chunk {:.1f}s, ETA {:.0f}s'.format(
+                    len(done), total, processed, elapsed, eta))
+        except BaseException:
+            self.stderr.write('Stopped, run the command again to resume from {}'.format(path))
+            raise
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        self.finish(state)
+        os.remove(path)
+        self.stdout.write(self.style.SUCCESS('Processed {} film works in {:.0f}s'.format(
+            processed, time.monotonic() - started)))
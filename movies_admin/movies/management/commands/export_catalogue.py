@@ -0,0 +1,254 @@
+import gzip
+import itertools
+import json
+import os
+
+from django.contrib.postgres.fields import ArrayField
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from movies.management.batch import FilmWorkBatchCommand
+from movies.models import FilmWork, FilmWorkChange
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MANIFEST = 'manifest.json'
+DELETED = 'deleted.txt.gz'
+
+# Формат: расширение файлов частей
+FORMATS = {
+    'ndjson': '.ndjson.gz',
+    'parquet': '.parquet',
+}
+
+# Все колонки film_work, включая массивы участников и жанров
+FIELDS = FilmWork._meta.concrete_fields
+COLUMNS = [field.attname for field in FIELDS]
+
+
+def part_name(index, file_format):
+    return 'part-{:05d}{}'.format(index, FORMATS[file_format])
+
+
+def latest_manifest(output):
+    """
+    Манифест последнего завершенного снимка в папке output, None если снимков нет
+    """
+    if not os.path.isdir(output):
+        return None
+    for name in sorted(os.listdir(output), reverse=True):
+        path = os.path.join(output, name, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as manifest_file:
+                return json.load(manifest_file)
+    return None
+
+
+def write_ndjson(path, rows, batch_size):
+    """
+    Запись частями по batch_size строк: строки части сериализуются и пишутся в файл одним вызовом
+    """
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as part:
+        while True:
+            lines = [json.dumps(dict(zip(COLUMNS, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+                     for row in itertools.islice(rows, batch_size)]
+            if not lines:
+                return count
+            part.writelines(lines)
+            count += len(lines)
+
+
+def arrow_type(field):
+    if isinstance(field, ArrayField):
+        return pyarrow.list_(arrow_type(field.base_field))
+    if isinstance(field, models.DateTimeField):
+        return pyarrow.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pyarrow.date32()
+    if isinstance(field, models.FloatField):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def arrow_converter(field):
+    """
+    Преобразование значения Django в значение, которое принимает pyarrow: UUID хранятся строками
+    """
+    if isinstance(field, ArrayField):
+        convert = arrow_converter(field.base_field)
+        return lambda value: None if value is None else [convert(item) for item in value]
+    if isinstance(field, models.UUIDField):
+        return lambda value: None if value is None else str(value)
+    return lambda value: value
+
+
+def write_parquet(path, rows, batch_size):
+    """
+    Запись частями по batch_size строк (одна группа строк Parquet на часть), в памяти только одна часть
+    """
+    schema = pyarrow.schema([(field.attname, arrow_type(field)) for field in FIELDS])
+    converters = [arrow_converter(field) for field in FIELDS]
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return count
+            columns = [pyarrow.array([convert(value) for value in values], type=schema.field(number).type)
+                       for number, (convert, values) in enumerate(zip(converters, zip(*batch)))]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            count += len(batch)
+
+
+WRITERS = {
+    'ndjson': write_ndjson,
+    'parquet': write_parquet,
+}
+
+
+class Command(FilmWorkBatchCommand):
+    help = ('Выгрузка снимка каталога (film_work с массивами участников и жанров) в файлы NDJSON.gz или Parquet '
+            'для аналитики. Каждый диапазон id записывается в свой файл, в конце пишется manifest.json. '
+            'С --incremental выгружаются только фильмы, измененные после предыдущего снимка по журналу изменений')
+    chunk_size = 50000
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--output', required=True, help='Папка снимков, каждый снимок - подпапка с manifest.json')
+        parser.add_argument('--format', choices=FORMATS, default='ndjson',
+                            help='ndjson - NDJSON со сжатием gzip, parquet - Parquet со сжатием zstd (нужен pyarrow)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Выгрузить только фильмы, измененные после последнего снимка в --output')
+        parser.add_argument('--fetch-size', type=int, default=2000,
+                            help='Сколько строк читать из курсора базы за раз')
+
+    def get_state_file(self, options):
+        return options['state_file'] or os.path.join(options['output'], '.progress.json')
+
+    def load_state(self, path, options):
+        state = super().load_state(path, options)
+        if 'snapshot' not in state:
+            state['snapshot'] = self.start_snapshot(options)
+        # Параметры снимка нужны процессам пула, при продолжении берутся из сохраненного состояния
+        options['snapshot'] = state['snapshot']
+        return state
+
+    def start_snapshot(self, options):
+        if options['format'] == 'parquet' and pyarrow is None:
+            raise CommandError('parquet format requires pyarrow')
+
+        output = os.path.abspath(options['output'])
+        base = None
+        if options['incremental']:
+            base = latest_manifest(output)
+            if base is None:
+                raise CommandError('No complete snapshot in {}, run without --incremental first'.format(output))
+
+        # Курсор журнала, как в /api/v1/movies/changes/: записи незавершенных транзакций войдут в следующий снимок
+        since = base['change_cursor'] if base else None
+        head = FilmWorkChange.objects.settled().after(since).head()
+        change_cursor = list(head) if head else since
+
+        started_at = timezone.now()
+        # Микросекунды в имени: два запуска в одну секунду не попадут в одну папку, имена по-прежнему
+        # сортируются по времени. При совпадении имени makedirs завершится ошибкой, а не допишет чужой снимок
+        name = started_at.strftime('%Y%m%dT%H%M%S%f')
+        os.makedirs(os.path.join(output, name))
+        return {
+            'snapshot': name,
+            'dir': os.path.join(output, name),
+            'type': 'incremental' if base else 'full',
+            'base': base['snapshot'] if base else None,
+            'format': options['format'],
+            'since_change_cursor': since,
+            'change_cursor': change_cursor,
+            'started_at': started_at.isoformat(),
+        }
+
+    def get_changes(self, snapshot):
+        changes = FilmWorkChange.objects.after(snapshot['since_change_cursor'])
+        if snapshot['change_cursor'] is None:
+            return changes.none()
+        return changes.filter(RawSQL('(transaction_id, id) <= (%s, %s)', tuple(snapshot['change_cursor']),
+                                     output_field=models.BooleanField()))
+
+    def get_chunk_queryset(self, after, upto):
+        queryset = super().get_chunk_queryset(after, upto)
+        snapshot = self.options['snapshot']
+        if snapshot['type'] == 'incremental':
+            queryset = queryset.filter(id__in=self.get_changes(snapshot).values('film_work_id'))
+        return queryset
+
+    def process_chunk(self, queryset):
+        """
+        Запись диапазона в файл части. Строки читаются курсором на стороне сервера, в памяти не больше
+        --fetch-size строк. Файл появляется под своим именем только целиком, пустые диапазоны файлов не создают
+        """
+        index, after, upto = self.chunk
+        snapshot = self.options['snapshot']
+        path = os.path.join(snapshot['dir'], part_name(index, snapshot['format']))
+        rows = queryset.order_by('id').values_list(*COLUMNS).iterator(chunk_size=self.options['fetch_size'])
+        count = WRITERS[snapshot['format']](path + '.tmp', rows, self.options['fetch_size'])
+        if count:
+            os.replace(path + '.tmp', path)
+        else:
+            os.remove(path + '.tmp')
+        return count
+
+    def finish(self, state):
+        snapshot = state['snapshot']
+        counts = state.get('counts', {})
+        files = []
+        for index, (after, upto) in enumerate(state['chunks']):
+            count = counts.get(str(index), 0)
+            if count:
+                name = part_name(index, snapshot['format'])
+                files.append({
+                    'name': name,
+                    'rows': count,
+                    'bytes': os.path.getsize(os.path.join(snapshot['dir'], name)),
+                    'after': after,
+                    'upto': upto,
+                })
+
+        manifest = {key: value for key, value in snapshot.items() if key != 'dir'}
+        manifest.update({
+            'finished_at': timezone.now().isoformat(),
+            'columns': COLUMNS,
+            'rows': sum(part['rows'] for part in files),
+            'files': files,
+        })
+        if snapshot['type'] == 'incremental':
+            manifest['deleted'] = {'name': DELETED, 'rows': self.write_deleted(snapshot)}
+
+        # Снимок считается готовым, когда появился манифест
+        path = os.path.join(snapshot['dir'], MANIFEST)
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(path + '.tmp', path)
+        self.stdout.write('Snapshot {}: {} rows in {} files, manifest {}'.format(
+            snapshot['snapshot'], manifest['rows'], len(files), path))
+
+    def write_deleted(self, snapshot):
+        """
+        id фильмов, удаленных после предыдущего снимка, по одному в строке
+        """
+        deleted = (self.get_changes(snapshot)
+                   .exclude(film_work_id__in=FilmWork.objects.values('id'))
+                   .order_by('film_work_id')
+                   .values_list('film_work_id', flat=True)
+                   .distinct())
+        count = 0
+        with gzip.open(os.path.join(snapshot['dir'], DELETED), 'wt') as deleted_file:
+            for film_work_id in deleted.iterator(chunk_size=self.options['fetch_size']):
+                deleted_file.write('{}\n'.format(film_work_id))
+                count += 1
+        return count
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+LINK_TABLES = ('person_film_work', 'genre_film_work')
+
+
+class Command(BaseCommand):
+    help = ('Перестроение таблиц связей с фильмами в секционированные по hash(film_work_id) или обратно в обычные. '
+            'Таблица блокируется на время копирования')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, default=16,
+                            help='Количество секций, 0 - вернуть обычную таблицу')
+        parser.add_argument('--tables', nargs='+', choices=LINK_TABLES, default=LINK_TABLES,
+                            help='Какие таблицы перестроить')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL')
+        partitions = options['partitions']
+        if partitions < 0:
+            raise CommandError('--partitions must not be negative')
+
+        for table in options['tables']:
+            with transaction.atomic(), connection.cursor() as cursor:
+                if self.get_partitions(cursor, table) == partitions:
+                    self.stdout.write('{} already has {} partitions'.format(table, partitions))
+                    continue
+                self.rebuild(cursor, table, partitions)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE content.{}'.format(table))
+            self.stdout.write(self.style.SUCCESS('{} rebuilt with {} partitions'.format(table, partitions)))
+
+    def get_partitions(self, cursor, table):
+        """
+        :return: количество секций таблицы, 0 для обычной таблицы
+        """
+        cursor.execute("SELECT c.relkind, (SELECT count(*) FROM pg_inherits i WHERE i.inhparent = c.oid) "
+                       "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                       "WHERE n.nspname = 'content' AND c.relname = %s", [table])
+        row = cursor.fetchone()
+        if row is None:
+            raise CommandError('Table content.{} does not exist'.format(table))
+        return row[1] if row[0] == 'p' else 0
+
+    def rebuild(self, cursor, table, partitions):
+        """
+        Копирование таблицы в новую с тем же набором колонок, ограничений и индексов.
+        Первичный ключ секционированной таблицы обязан включать ключ секционирования, поэтому он (id, film_work_id),
+        уникальность (film_work_id, ...) для unique_together и ON CONFLICT загрузчика сохраняется
+        """
+        qualified = 'content.{}'.format(table)
+        old = '{}_old'.format(table)
+
+        cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                       "WHERE conrelid = %s::regclass AND contype IN ('u', 'f')", [qualified])
+        constraints = cursor.fetchall()
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE schemaname = 'content' AND tablename = %s "
+                       "AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+                       [table, qualified])
+        indexes = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute('ALTER TABLE {} RENAME TO {}'.format(qualified, old))
+        if partitions:
+            cursor.execute('CREATE TABLE {} (LIKE content.{} INCLUDING DEFAULTS) '
+                           'PARTITION BY HASH (film_work_id)'.format(qualified, old))
+            for remainder in range(partitions):
+                cursor.execute('CREATE TABLE {}_p{} PARTITION OF {} FOR VALUES WITH (MODULUS {}, REMAINDER {})'
+                               .format(qualified, remainder, qualified, partitions, remainder))
+        else:
+            cursor.execute('CREATE TABLE {} (LIKE content.{} INCLUDING DEFAULTS)'.format(qualified, old))
+
+        cursor.execute('INSERT INTO {} SELECT * FROM content.{}'.format(qualified, old))
+        cursor.execute('DROP TABLE content.{}'.format(old))
+
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {}_pkey PRIMARY KEY ({})'.format(
+            qualified, table, 'id, film_work_id' if partitions else 'id'))
+        for name, definition in constraints:
+            cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(
+                qualified, connection.ops.quote_name(name), definition))
+        for definition in indexes:
+            cursor.execute(definition)
@@ -0,0 +1,9 @@
+from movies.management.batch import FilmWorkBatchCommand
+
+
+class Command(FilmWorkBatchCommand):
+    help = ('Пересчет денормализованных массивов участников и жанров во всех кинопроизведениях. '
+            'Фильмы с изменившимися массивами получают новый updated_at и запись в журнале изменений')
+
+    def process_chunk(self, queryset):
+        return len(queryset.refresh_role_arrays())
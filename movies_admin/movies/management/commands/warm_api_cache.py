@@ -0,0 +1,113 @@
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+from django.db.models.functions import Coalesce
+
+from config.db_router import PRIMARY
+from movies.api.v1.caching import CACHE_ENCODINGS, cache_refresh_request
+from movies.models import FilmWork, Genre, GenreFilmWork, Person, PersonFilmWork
+
+# Таблицы, которые читает API, в порядке важности: если shared_buffers не хватит, вытеснены будут последние
+HOT_MODELS = (FilmWork, Person, Genre, PersonFilmWork, GenreFilmWork)
+
+# Таблица, ее секции (partition_link_tables создает один уровень секций) и индексы всех этих таблиц.
+# Секции берутся из pg_inherits, а не pg_partition_tree, которой нет до PostgreSQL 12
+PREWARM_SQL = '''
+    WITH tables AS (
+        SELECT %(table)s::regclass::oid AS relid
+        UNION ALL
+        SELECT inhrelid FROM pg_inherits WHERE inhparent = %(table)s::regclass
+    )
+    SELECT sum(pg_prewarm(c.oid))
+    FROM pg_class c
+    WHERE c.relkind IN ('r', 'i', 'm') AND (
+        c.oid IN (SELECT relid FROM tables)
+        OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid IN (SELECT relid FROM tables))
+    )
+'''
+
+
+class Command(BaseCommand):
+    help = ('Прогрев после запуска: загрузка таблиц API в буферы Postgres (pg_prewarm) '
+            'и запись первых страниц списка и страниц фильмов в кэш nginx')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10, help='Сколько первых страниц списка фильмов прогреть')
+        parser.add_argument('--movies', type=int, default=1000,
+                            help='Сколько страниц фильмов прогреть (из --ids-file или с наибольшим рейтингом)')
+        parser.add_argument('--ids-file', help='Файл с id популярных фильмов по одному в строке, например из логов nginx')
+        parser.add_argument('--url', default=settings.API_CACHE_REFRESH_URL,
+                            help='Адрес nginx, по умолчанию API_CACHE_REFRESH_URL')
+        parser.add_argument('--concurrency', type=int, default=4, help='Сколько запросов к API выполнять одновременно')
+        parser.add_argument('--skip-prewarm', action='store_true', help='Не загружать таблицы в буферы Postgres')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if not options['skip_prewarm']:
+            self.prewarm()
+        if options['url']:
+            self.warm_responses(options)
+        else:
+            self.stdout.write('API_CACHE_REFRESH_URL is not set, skipping response cache')
+        self.stdout.write(self.style.SUCCESS('Warmed in {:.1f}s'.format(time.monotonic() - started)))
+
+    def prewarm(self):
+        """
+        Загрузка таблиц и их индексов в shared_buffers основной базы и каждой реплики
+        """
+        aliases = [PRIMARY] + list(settings.REPLICA_DATABASES)
+        try:
+            with connections[PRIMARY].cursor() as cursor:
+                # Расширение создается на основной базе и приходит на реплики с репликацией
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_prewarm')
+        except DatabaseError as e:
+            self.stderr.write('pg_prewarm is not available, skipping: {}'.format(e))
+            return
+
+        for alias in aliases:
+            started = time.monotonic()
+            blocks = 0
+            with connections[alias].cursor() as cursor:
+                for model in HOT_MODELS:
+                    cursor.execute(PREWARM_SQL, {'table': model._meta.db_table})
+                    blocks += cursor.fetchone()[0] or 0
+            self.stdout.write('{}: prewarmed {} blocks in {:.1f}s'.format(alias, blocks, time.monotonic() - started))
+
+    def warm_responses(self, options):
+        """
+        Запросы первых страниц списка и страниц популярных фильмов через nginx мимо кэша,
+        nginx сохраняет ответы в кэш. Каждая страница запрашивается во всех вариантах сжатия,
+        которые nginx хранит отдельно. Запросы не закрепляются за основной базой, поэтому страницы фильмов
+        попадают и в movie_cache воркеров
+        """
+        base_url = '{}/api/v1/movies/'.format(options['url'].rstrip('/'))
+        urls = [base_url] + ['{}?page={}'.format(base_url, page) for page in range(1, options['pages'] + 1)]
+        urls += ['{}{}/'.format(base_url, film_work_id) for film_work_id in self.get_popular_ids(options)]
+
+        requests = [(url, encoding) for url in urls for encoding in CACHE_ENCODINGS]
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            failed = sum(not ok for ok in executor.map(self.fetch, *zip(*requests)))
+        self.stdout.write('Warmed {} API responses ({} failed) in {:.1f}s'.format(
+            len(requests) - failed, failed, time.monotonic() - started))
+
+    def get_popular_ids(self, options):
+        if options['ids_file']:
+            with open(options['ids_file']) as ids_file:
+                return [line.strip() for line in ids_file if line.strip()][:options['movies']]
+        return (FilmWork.objects
+                .order_by(Coalesce('rating', 0).desc(), 'id')
+                .values_list('id', flat=True)[:options['movies']])
+
+    def fetch(self, url, encoding):
+        try:
+            urllib.request.urlopen(cache_refresh_request(url, encoding, pin=False),
+                                   timeout=settings.API_CACHE_REFRESH_TIMEOUT * 5).close()
+            return True
+        except OSError as e:
+            self.stderr.write('{} ({}): {}'.format(url, encoding, e))
+            return False
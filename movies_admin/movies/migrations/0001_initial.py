@@ -14,6 +14,9 @@ class Migration(migrations.Migration):
     ]
 
     operations = [
+        # В рабочей базе схему создает load_data/movies.sql, а эта миграция применяется с --fake.
+        # Схема нужна тестовой базе, которую Django создает по миграциям
+        migrations.RunSQL('CREATE SCHEMA IF NOT EXISTS content', migrations.RunSQL.noop),
         migrations.CreateModel(
             name='FilmWork',
             fields=[
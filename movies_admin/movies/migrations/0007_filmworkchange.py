@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_person_movies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmWorkChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('film_work_id', models.UUIDField(verbose_name='кинопроизведение')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'изменение кинопроизведения',
+                'verbose_name_plural': 'изменения кинопроизведений',
+                'db_table': '"content"."film_work_change"',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='genrefilmwork',
+            index=models.Index(fields=['genre_id', 'film_work_id'], name='genre_film_work_genre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personfilmwork',
+            index=models.Index(fields=['person_id', 'role', 'film_work_id'], name='person_film_work_person_idx'),
+        ),
+    ]
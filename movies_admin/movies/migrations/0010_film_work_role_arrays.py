@@ -0,0 +1,63 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+ARRAY_FIELDS = ('actor_names', 'director_names', 'writer_names', 'genre_names',
+                'actor_ids', 'director_ids', 'writer_ids', 'genre_ids')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0009_link_reverse_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filmwork',
+            name='actor_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), default=list, editable=False, size=None, verbose_name='актеры'),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='director_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), default=list, editable=False, size=None, verbose_name='режиссеры'),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='writer_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), default=list, editable=False, size=None, verbose_name='сценаристы'),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='genre_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), default=list, editable=False, size=None, verbose_name='жанры'),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='actor_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.UUIDField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='director_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.UUIDField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='writer_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.UUIDField(), default=list, editable=False, size=None),
+        ),
+        migrations.AddField(
+            model_name='filmwork',
+            name='genre_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.UUIDField(), default=list, editable=False, size=None),
+        ),
+        # Значения по умолчанию на уровне базы нужны для вставок в обход Django (load_data.py),
+        # после них массивы заполняются командой refresh_film_work_roles
+        migrations.RunSQL(
+            sql=['ALTER TABLE content.film_work ALTER COLUMN {} SET DEFAULT \'{{}}\''.format(field)
+                 for field in ARRAY_FIELDS],
+            reverse_sql=['ALTER TABLE content.film_work ALTER COLUMN {} DROP DEFAULT'.format(field)
+                         for field in ARRAY_FIELDS],
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+import movies.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0010_film_work_role_arrays'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='genrefilmwork',
+            name='id',
+            field=models.UUIDField(default=movies.models.time_ordered_uuid, editable=False, primary_key=True,
+                                   serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='personfilmwork',
+            name='id',
+            field=models.UUIDField(default=movies.models.time_ordered_uuid, editable=False, primary_key=True,
+                                   serialize=False),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# Однократное заполнение массивов участников и жанров после загрузки данных (load_data.py пишет в таблицы
+# напрямую). Раньше команда refresh_film_work_roles выполнялась при каждом запуске контейнера.
+# Запрос зафиксирован здесь, а не вызывается из movies.models: миграция не должна меняться вместе с моделями.
+# Как в refresh_role_arrays, обновляются только фильмы с изменившимися массивами, они получают новый
+# updated_at и запись в журнале изменений
+
+ROLES = ('actor', 'director', 'writer')
+
+PERSON_ARRAY = '''coalesce((SELECT array_agg({value} ORDER BY p.full_name, p.id)
+    FROM content.person_film_work pfw JOIN content.person p ON p.id = pfw.person_id
+    WHERE pfw.film_work_id = f.id AND pfw.role = '{role}'), '{{}}')'''
+
+GENRE_ARRAY = '''coalesce((SELECT array_agg({value} ORDER BY g.name, g.id)
+    FROM content.genre_film_work gfw JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE gfw.film_work_id = f.id), '{{}}')'''
+
+ARRAYS = {
+    **{'{}_names'.format(role): PERSON_ARRAY.format(value='p.full_name::text', role=role) for role in ROLES},
+    **{'{}_ids'.format(role): PERSON_ARRAY.format(value='p.id', role=role) for role in ROLES},
+    'genre_names': GENRE_ARRAY.format(value='g.name::text'),
+    'genre_ids': GENRE_ARRAY.format(value='g.id'),
+}
+
+REFRESH_SQL = '''
+    WITH fresh AS (
+        SELECT f.id, {fresh} FROM content.film_work f
+    ), changed AS (
+        UPDATE content.film_work f SET {assignments}, updated_at = now()
+        FROM fresh
+        WHERE f.id = fresh.id AND ({differs})
+        RETURNING f.id
+    )
+    INSERT INTO content.film_work_change (film_work_id, created_at) SELECT id, now() FROM changed
+'''.format(
+    fresh=', '.join('{} AS {}'.format(value, name) for name, value in ARRAYS.items()),
+    assignments=', '.join('{0} = fresh.{0}'.format(name) for name in ARRAYS),
+    differs=' OR '.join('f.{0} IS DISTINCT FROM fresh.{0}'.format(name) for name in ARRAYS),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0012_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(REFRESH_SQL, migrations.RunSQL.noop),
+    ]
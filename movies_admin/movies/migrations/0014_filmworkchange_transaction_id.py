@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+import movies.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0013_refresh_film_work_role_arrays'),
+    ]
+
+    operations = [
+        # Существующие записи относятся к завершенным транзакциям и получают номер 0. Новые записи получают
+        # номер своей транзакции и от Django (current_transaction_id), и при вставке SQL в обход модели
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'ALTER TABLE content.film_work_change ADD COLUMN transaction_id bigint NOT NULL DEFAULT 0; '
+                    'ALTER TABLE content.film_work_change ALTER COLUMN transaction_id SET DEFAULT txid_current()',
+                    'ALTER TABLE content.film_work_change DROP COLUMN transaction_id',
+                ),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='filmworkchange',
+                    name='transaction_id',
+                    field=models.BigIntegerField(default=movies.models.current_transaction_id, editable=False),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='filmworkchange',
+            index=models.Index(fields=['transaction_id', 'id'], name='film_work_change_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0014_filmworkchange_transaction_id'),
+    ]
+
+    operations = [
+        # В схеме movies.sql updated_at фильма заполняет только триггер на UPDATE, у фильмов из load_data.py
+        # он пустой, и они не попадают в выборку по updated_since. Пустые значения заполняются временем создания
+        # (триггер отключается, иначе он записал бы время миграции), новые строки получают now() по умолчанию
+        migrations.RunSQL(
+            [
+                'ALTER TABLE content.film_work DISABLE TRIGGER USER',
+                'UPDATE content.film_work SET created_at = coalesce(created_at, now()), '
+                'updated_at = coalesce(updated_at, created_at, now()) '
+                'WHERE created_at IS NULL OR updated_at IS NULL',
+                'ALTER TABLE content.film_work ENABLE TRIGGER USER',
+                'ALTER TABLE content.film_work ALTER COLUMN created_at SET DEFAULT now(), '
+                'ALTER COLUMN created_at SET NOT NULL, '
+                'ALTER COLUMN updated_at SET DEFAULT now(), '
+                'ALTER COLUMN updated_at SET NOT NULL',
+            ],
+            [
+                'ALTER TABLE content.film_work ALTER COLUMN updated_at DROP DEFAULT',
+            ],
+        ),
+    ]
@@ -1,12 +1,30 @@
+import os
+import time
 import uuid
 
-from django.db import models
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.db import connections, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 
 
+def time_ordered_uuid():
+    """
+    UUID в формате UUIDv7: первые 48 бит - время создания в миллисекундах, остальное случайно.
+    Новые строки попадают в конец индекса первичного ключа, а не в случайную страницу, как с uuid4
+    """
+    value = (time.time_ns() // 1000000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76
+    value = value & ~(0x3 << 62) | 0x2 << 62
+    return uuid.UUID(int=value)
+
+
 class GenreFilmWork(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
     film_work_id = models.ForeignKey('FilmWork', on_delete=models.CASCADE, db_column='film_work_id')
     genre_id = models.ForeignKey('Genre', on_delete=models.CASCADE, db_column='genre_id')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -15,6 +33,9 @@ class GenreFilmWork(models.Model):
         index_together = [
             ("film_work_id", "genre_id"),
         ]
+        indexes = [
+            models.Index(fields=['genre_id', 'film_work_id'], name='genre_film_work_genre_idx'),
+        ]
         unique_together = ('film_work_id', 'genre_id',)
         verbose_name = _('жанр-фильм')
         verbose_name_plural = _('жанры-фильмы')
@@ -22,7 +43,7 @@ class GenreFilmWork(models.Model):
 
 
 class PersonFilmWork(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=time_ordered_uuid, editable=False)
     film_work_id = models.ForeignKey('FilmWork', on_delete=models.CASCADE, db_column='film_work_id')
     person_id = models.ForeignKey('Person', on_delete=models.CASCADE, db_column='person_id')
     role = models.CharField(_('профессия'), max_length=255)
@@ -32,6 +53,9 @@ class PersonFilmWork(models.Model):
         index_together = [
             ("film_work_id", "person_id", 'role'),
         ]
+        indexes = [
+            models.Index(fields=['person_id', 'role', 'film_work_id'], name='person_film_work_person_idx'),
+        ]
         unique_together = ('film_work_id', 'person_id', 'role')
         verbose_name = _('персона-фильм')
         verbose_name_plural = _('персоны-фильмы')
@@ -78,6 +102,91 @@ class Person(models.Model):
         return self.full_name
 
 
+def linked_array(queryset, field, ordering, base_field):
+    """
+    Подзапрос, собирающий значения field связей фильма OuterRef('pk') в массив, пустой массив при отсутствии связей
+    """
+    return Coalesce(
+        Subquery(queryset
+                 .filter(film_work_id=OuterRef('pk'))
+                 .order_by()
+                 .values('film_work_id')
+                 .annotate(values=ArrayAgg(field, ordering=ordering))
+                 .values('values')),
+        Value([]),
+        output_field=ArrayField(base_field),
+    )
+
+
+def refresh_role_arrays(film_works, credits, genres, changes):
+    """
+    Пересчет денормализованных массивов участников и жанров одним запросом. Обновляются только фильмы,
+    у которых массивы изменились: у них же обновляется updated_at и добавляется запись в журнал изменений.
+    Имена и id в массивах упорядочены одинаково (по имени, затем по id), так что
+    actor_names[i] - имя персоны actor_ids[i].
+    Модели передаются параметрами, чтобы функцию можно было вызвать из миграции с историческими моделями
+    :param film_works: queryset кинопроизведений
+    :param credits: queryset связей PersonFilmWork
+    :param genres: queryset связей GenreFilmWork
+    :param changes: модель журнала FilmWorkChange
+    :return: список id фильмов, у которых изменились массивы
+    """
+    arrays = {}
+    for role in PersonRole.values:
+        role_credits = credits.filter(role=role)
+        ordering = ('person_id__full_name', 'person_id')
+        arrays['{}_names'.format(role)] = linked_array(role_credits, 'person_id__full_name', ordering,
+                                                       models.TextField())
+        arrays['{}_ids'.format(role)] = linked_array(role_credits, 'person_id', ordering, models.UUIDField())
+    ordering = ('genre_id__name', 'genre_id')
+    arrays['genre_names'] = linked_array(genres, 'genre_id__name', ordering, models.TextField())
+    arrays['genre_ids'] = linked_array(genres, 'genre_id', ordering, models.UUIDField())
+
+    fresh = (film_works
+             .order_by()
+             .annotate(**{'new_{}'.format(name): value for name, value in arrays.items()})
+             .values('pk', *('new_{}'.format(name) for name in arrays)))
+    connection = connections[fresh.db]
+    select_sql, params = fresh.query.get_compiler(connection=connection).as_sql()
+    quote = connection.ops.quote_name
+    # Тип массива приводится к типу колонки: в схеме из миграций имена - varchar, и array_agg дает varchar[],
+    # а сравнить text[] с varchar[] Postgres не может
+    fresh_values = {
+        name: 'CAST(fresh.new_{} AS {})'.format(name, film_works.model._meta.get_field(name).db_type(connection))
+        for name in arrays
+    }
+    # Сравнение IS DISTINCT FROM оставляет без изменений фильмы, у которых массивы совпадают:
+    # UPDATE всех строк переписал бы всю таблицу и сдвинул updated_at у каждого фильма
+    sql = """
+        WITH changed AS (
+            UPDATE {table} AS f SET {assignments}, updated_at = now()
+            FROM ({select}) AS fresh (id, {fresh_columns})
+            WHERE f.id = fresh.id AND ({differs})
+            RETURNING f.id
+        )
+        INSERT INTO {changes} (film_work_id, created_at) SELECT id, now() FROM changed RETURNING film_work_id
+    """.format(
+        table=quote(film_works.model._meta.db_table),
+        assignments=', '.join('{} = {}'.format(name, value) for name, value in fresh_values.items()),
+        select=select_sql,
+        fresh_columns=', '.join('new_{}'.format(name) for name in arrays),
+        differs=' OR '.join('f.{} IS DISTINCT FROM {}'.format(name, value) for name, value in fresh_values.items()),
+        changes=quote(changes._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class FilmWorkQuerySet(models.QuerySet):
+    def refresh_role_arrays(self):
+        """
+        Пересчет массивов участников и жанров фильмов выборки, см. refresh_role_arrays
+        :return: список id фильмов, у которых изменились массивы
+        """
+        return refresh_role_arrays(self, PersonFilmWork.objects.all(), GenreFilmWork.objects.all(), FilmWorkChange)
+
+
 class FilmWork(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(_('название'), max_length=255)
@@ -95,7 +204,25 @@ class FilmWork(models.Model):
     people = models.ManyToManyField(Person, related_name='people', through='PersonFilmWork',
                                     through_fields=('film_work_id', 'person_id'))
 
+    # Денормализованные участники и жанры для API, пересчитываются refresh_role_arrays
+    # при изменении связей, имен персон и названий жанров
+    actor_names = ArrayField(models.TextField(), verbose_name=_('актеры'), default=list, editable=False)
+    director_names = ArrayField(models.TextField(), verbose_name=_('режиссеры'), default=list, editable=False)
+    writer_names = ArrayField(models.TextField(), verbose_name=_('сценаристы'), default=list, editable=False)
+    genre_names = ArrayField(models.TextField(), verbose_name=_('жанры'), default=list, editable=False)
+    actor_ids = ArrayField(models.UUIDField(), default=list, editable=False)
+    director_ids = ArrayField(models.UUIDField(), default=list, editable=False)
+    writer_ids = ArrayField(models.UUIDField(), default=list, editable=False)
+    genre_ids = ArrayField(models.UUIDField(), default=list, editable=False)
+
+    objects = FilmWorkQuerySet.as_manager()
+
     class Meta:
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='film_work_updated_at_idx'),
+            models.Index(fields=['rating', 'id'], name='film_work_rating_idx'),
+            models.Index(fields=['creation_date', 'id'], name='film_work_creation_date_idx'),
+        ]
         verbose_name = _('кинопроизведение')
         verbose_name_plural = _('кинопроизведения')
         db_table = u'"content\".\"film_work"'
@@ -104,6 +231,69 @@ class FilmWork(models.Model):
         return self.title
 
 
+class TransactionId(models.Func):
+    """
+    Номер текущей транзакции Postgres. txid_current() включает эпоху и не переполняется, как xid
+    """
+    function = 'txid_current'
+    output_field = models.BigIntegerField()
+
+
+def current_transaction_id():
+    return TransactionId()
+
+
+class FilmWorkChangeQuerySet(models.QuerySet):
+    def settled(self):
+        """
+        Записи завершенных транзакций. Номер транзакции выдается до коммита, поэтому записи транзакций
+        с номером меньше самой старой открытой (txid_snapshot_xmin) уже видны, а записи, которые появятся позже,
+        получат номер не меньше нее. Курсор (transaction_id, id) по таким записям не проскакивает изменения
+        длинных транзакций, например загрузки load_data.py
+        """
+        return self.filter(transaction_id__lt=RawSQL('txid_snapshot_xmin(txid_current_snapshot())', (),
+                                                     output_field=models.BigIntegerField()))
+
+    def after(self, cursor):
+        """
+        Записи после курсора (transaction_id, id) в порядке журнала
+        :param cursor: пара (transaction_id, id) или None с начала журнала
+        """
+        queryset = self
+        if cursor is not None:
+            queryset = queryset.filter(RawSQL('(transaction_id, id) > (%s, %s)', tuple(cursor),
+                                              output_field=models.BooleanField()))
+        return queryset.order_by('transaction_id', 'id')
+
+    def head(self):
+        """
+        Курсор последней записи или None, если записей нет
+        """
+        return self.order_by('-transaction_id', '-id').values_list('transaction_id', 'id').first()
+
+
+class FilmWorkChange(models.Model):
+    """
+    Журнал изменений кинопроизведений для внешних индексаторов.
+    Записи о фильмах, их участниках и жанрах, измененных в одной транзакции, добавляются в ней же
+    (movies.signals), по одной на фильм. Курсор /api/v1/movies/changes/ - номер транзакции и id записи
+    """
+    id = models.BigAutoField(primary_key=True)
+    film_work_id = models.UUIDField(_('кинопроизведение'))
+    created_at = models.DateTimeField(auto_now_add=True)
+    transaction_id = models.BigIntegerField(default=current_transaction_id, editable=False)
+
+    objects = FilmWorkChangeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['transaction_id', 'id'], name='film_work_change_cursor_idx'),
+        ]
+        verbose_name = _('изменение кинопроизведения')
+        verbose_name_plural = _('изменения кинопроизведений')
+        db_table = u'"content\".\"film_work_change"'
+
+
 class PersonRole(models.TextChoices):
     ACTOR = 'actor', _('актер')
     DIRECTOR = 'director', _('режиссер')
@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from movies.api.v1.caching import refresh_movies_cache
+from movies.models import (Actor, Director, FilmWork, FilmWorkChange, Genre, GenreFilmWork, Movie, Person,
+                           PersonFilmWork, TvShow, Writer)
+
+# Отправляется один раз внутри транзакции массового изменения состава участников фильма.
+# Аргументы: film_work_id, created - список созданных PersonFilmWork, deleted - список id удаленных связей
+credits_changed = Signal()
+
+# Модели, изменение которых меняет выдачу API по фильмам. Прокси-модели перечислены отдельно:
+# админка сохраняет Movie, Actor и т.д., и сигналы отправляются с ними в качестве sender
+CATALOGUE_MODELS = (FilmWork, Movie, TvShow, Person, Actor, Director, Writer, Genre, PersonFilmWork, GenreFilmWork)
+
+_bulk_change = ContextVar('bulk_change', default=False)
+
+# Фильмы, измененные внутри catalogue_transaction: saved - сохранены сами фильмы,
+# linked - изменились их участники или жанры, нужно пересчитать массивы и updated_at
+_pending = ContextVar('catalogue_changes', default=None)
+
+
+@contextmanager
+def bulk_change():
+    """
+    Отключает обработку post_save/post_delete по отдельным строкам на время массовой операции.
+    Код внутри блока сам отвечает за один итоговый вызов film_works_changed или credits_changed
+    """
+    token = _bulk_change.set(True)
+    try:
+        yield
+    finally:
+        _bulk_change.reset(token)
+
+
+def get_changed_film_work_ids(instance, created=False):
+    """
+    Кинопроизведения, выдача API по которым меняется вместе с объектом.
+    Модель определяется по concrete_model, так как админка сохраняет прокси-модели (Movie, Actor и т.д.)
+    :return: список id или queryset с id кинопроизведений
+    """
+    model = instance._meta.concrete_model
+    if model is FilmWork:
+        return [instance.pk]
+    if model in (PersonFilmWork, GenreFilmWork):
+        return [instance.film_work_id_id]
+    if created:
+        return []
+    if model is Person:
+        return PersonFilmWork.objects.filter(person_id=instance.pk).values_list('film_work_id', flat=True)
+    if model is Genre:
+        return GenreFilmWork.objects.filter(genre_id=instance.pk).values_list('film_work_id', flat=True)
+    return []
+
+
+@contextmanager
+def catalogue_transaction():
+    """
+    Транзакция изменения каталога. Изменения фильмов копятся до конца блока и обрабатываются в той же
+    транзакции перед коммитом, так что сохранение фильма со связями в админке или каскадное удаление
+    дают один пересчет и одну запись в журнал на фильм. Вложенный блок работает как savepoint
+    и обрабатывает изменения вместе с внешним
+    """
+    if _pending.get() is not None:
+        with transaction.atomic():
+            yield
+        return
+    token = _pending.set({'saved': set(), 'linked': set()})
+    try:
+        with transaction.atomic():
+            yield
+            pending = _pending.get()
+            _apply_changes(pending['saved'], pending['linked'])
+    finally:
+        _pending.reset(token)
+
+
+def film_works_changed(film_work_ids, touch=True):
+    """
+    Обработка изменений фильмов в текущей транзакции. Внутри catalogue_transaction id копятся до конца блока,
+    без него обрабатываются сразу
+    :param film_work_ids: id измененных кинопроизведений
+    :param touch: пересчитать массивы участников и жанров фильмов и, если они изменились, обновить updated_at,
+    чтобы изменения были видны в выборке по updated_since
+    """
+    film_work_ids = set(film_work_ids)
+    if not film_work_ids:
+        return
+    pending = _pending.get()
+    if pending is None:
+        _apply_changes(set() if touch else film_work_ids, film_work_ids if touch else set())
+    else:
+        pending['linked' if touch else 'saved'].update(film_work_ids)
+
+
+def _apply_changes(saved, linked):
+    """
+    Пересчет массивов и запись изменений в журнал FilmWorkChange, кэш API обновляется после коммита.
+    Фильмы, у которых изменились только связи, а выдача API осталась прежней (например, дата рождения персоны),
+    в журнал не попадают
+    """
+    with transaction.atomic():
+        changed = set(FilmWork.objects.filter(id__in=linked).refresh_role_arrays()) if linked else set()
+        FilmWorkChange.objects.bulk_create([FilmWorkChange(film_work_id=film_work_id)
+                                            for film_work_id in saved - changed])
+        refresh_movies_cache(changed | saved)
+
+
+def catalogue_changed(sender, instance, created=False, **kwargs):
+    if not _bulk_change.get():
+        film_works_changed(get_changed_film_work_ids(instance, created),
+                           touch=sender._meta.concrete_model is not FilmWork)
+
+
+for model in CATALOGUE_MODELS:
+    post_save.connect(catalogue_changed, sender=model)
+    post_delete.connect(catalogue_changed, sender=model)
+
+
+@receiver(credits_changed)
+def film_work_credits_changed(sender, film_work_id, **kwargs):
+    film_works_changed([film_work_id])
@@ -1,3 +1,1204 @@
-from django.test import TestCase
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from config.db_router import (API_DATABASE, PIN_COOKIE, ReplicaMiddleware, ReplicaRouter, is_pinned, pin_cookie_value,
+                              read_from_primary)
+from movies.api.coalescing import (Flight, SingleFlight, coalesce_requests, get_request_key, thaw_response,
+                                    wait_shared)
+from movies.api.middleware import ApiCompressionMiddleware, ApiThrottleMiddleware, brotli
+from movies.api.throttling import TokenBucketLimiter, get_client_key
+from movies.api.v1.caching import LRUCache, cache_refresh_token, movie_cache
+from movies.api.v1.views import msgpack
+from movies.management.commands.export_catalogue import latest_manifest
+from movies.models import (FilmWork, FilmWorkChange, Genre, GenreFilmWork, Person, PersonFilmWork,
+                           time_ordered_uuid)
+from movies.signals import catalogue_transaction
+
+
+def run_on_commit_callbacks(using=DEFAULT_DB_ALIAS):
+    """
+    Выполнить функции, отложенные до коммита транзакции. TestCase не коммитит транзакцию теста,
+    а captureOnCommitCallbacks появился только в Django 3.2
+    :return: выполненные функции
+    """
+    connection = connections[using]
+    executed = []
+    # Отложенные функции сами могут отложить следующие (обновление кэша после записи изменений)
+    while connection.run_on_commit:
+        callbacks = [func for sids, func in connection.run_on_commit]
+        connection.run_on_commit = []
+        for callback in callbacks:
+            callback()
+        executed += callbacks
+    return executed
+
+
+def create_film_work(title='film', **fields):
+    return FilmWork.objects.create(**{
+        'title': title,
+        'description': '',
+        'creation_date': datetime.date(2020, 1, 1),
+        'certificate': '',
+        'file_path': '',
+        'rating': 5,
+        'type': 'movie',
+        **fields,
+    })
+
+
+def create_person(full_name):
+    return Person.objects.create(full_name=full_name, birth_date=datetime.date(1970, 1, 1))
+
+
+class CatalogueSignalsTest(TestCase):
+    def get_changes(self):
+        return list(FilmWorkChange.objects.order_by('id').values_list('film_work_id', flat=True))
+
+    def test_change_is_written_in_the_same_transaction(self):
+        film_work = create_film_work()
+
+        # Запись в журнал не откладывается до коммита
+        self.assertEqual(self.get_changes(), [film_work.id])
+
+    def test_one_change_per_film_in_catalogue_transaction(self):
+        with catalogue_transaction():
+            film_work = create_film_work()
+            for name, role in (('Alice', 'actor'), ('Bob', 'actor'), ('Carol', 'director')):
+                PersonFilmWork.objects.create(film_work_id=film_work, person_id=create_person(name), role=role)
+            film_work.title = 'renamed'
+            film_work.save()
+
+        self.assertEqual(self.get_changes(), [film_work.id])
+        film_work.refresh_from_db()
+        self.assertEqual(film_work.actor_names, ['Alice', 'Bob'])
+        self.assertEqual(film_work.director_names, ['Carol'])
+
+    def test_rolled_back_changes_are_not_written(self):
+        with self.assertRaises(ZeroDivisionError):
+            with catalogue_transaction():
+                create_film_work()
+                1 / 0
+
+        self.assertEqual(self.get_changes(), [])
+        self.assertFalse(FilmWork.objects.exists())
+
+    def test_person_change_outside_api_fields(self):
+        film_work = create_film_work()
+        person = create_person('Alice')
+        PersonFilmWork.objects.create(film_work_id=film_work, person_id=person, role='actor')
+        FilmWorkChange.objects.all().delete()
+
+        person.birth_date = datetime.date(1980, 1, 1)
+        person.save()
+
+        self.assertEqual(self.get_changes(), [])
+
+    def test_person_rename_refreshes_arrays(self):
+        first, second = create_film_work('first'), create_film_work('second')
+        create_film_work('other')
+        alice, bob = create_person('Alice'), create_person('Bob')
+        for film_work in (first, second):
+            PersonFilmWork.objects.create(film_work_id=film_work, person_id=alice, role='actor')
+        PersonFilmWork.objects.create(film_work_id=first, person_id=bob, role='actor')
+        PersonFilmWork.objects.create(film_work_id=second, person_id=alice, role='writer')
+        drama = Genre.objects.create(name='drama', description='')
+        GenreFilmWork.objects.create(film_work_id=first, genre_id=drama)
+        FilmWorkChange.objects.all().delete()
+
+        alice.full_name = 'Zoe'
+        alice.save()
+        drama.name = 'tragedy'
+        drama.save()
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.actor_names, ['Bob', 'Zoe'])
+        self.assertEqual(first.actor_ids, [bob.id, alice.id])
+        self.assertEqual(first.genre_names, ['tragedy'])
+        self.assertEqual((second.actor_names, second.writer_names), (['Zoe'], ['Zoe']))
+        # Фильм без этих персоны и жанра в журнал не попадает
+        self.assertCountEqual(self.get_changes(), [first.id, second.id, first.id])
+        self.assertEqual(FilmWork.objects.all().refresh_role_arrays(), [])
+
+
+
+class AdminChangePageTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.genre = Genre.objects.create(name='drama', description='')
+
+    def create_credited_film_work(self, people_per_role):
+        film_work = create_film_work()
+        GenreFilmWork.objects.create(film_work_id=film_work, genre_id=self.genre)
+        for role in ('actor', 'director', 'writer'):
+            for number in range(people_per_role):
+                person = create_person('{} {}'.format(role, number))
+                PersonFilmWork.objects.create(film_work_id=film_work, person_id=person, role=role)
+        return film_work
+
+    def get_change_page(self, film_work):
+        response = self.client.get('/admin/movies/movie/{}/change/'.format(film_work.id))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_queries_do_not_grow_with_credits(self):
+        few, many = self.create_credited_film_work(1), self.create_credited_film_work(20)
+        # Первый запрос дополнительно загружает ContentType прокси-модели в кэш процесса
+        self.get_change_page(few)
+        with CaptureQueriesContext(connection) as queries:
+            self.get_change_page(few)
+
+        with self.assertNumQueries(len(queries)):
+            self.get_change_page(many)
+
+    def test_save_with_concurrently_deleted_credit(self):
+        film_work = self.create_credited_film_work(2)
+        response = self.get_change_page(film_work)
+        data = {name: value for name, value in response.context['adminform'].form.initial.items()
+                if value is not None and name != 'file_path'}
+        for inline in response.context['inline_admin_formsets']:
+            formset = inline.formset
+            data.update({formset.add_prefix(name): value
+                         for name, value in formset.management_form.initial.items()})
+            for form in formset.initial_forms:
+                data.update({form.add_prefix(name): form[name].value() for name in form.fields
+                             if form[name].value() is not None})
+
+        PersonFilmWork.objects.filter(film_work_id=film_work, role='actor').first().delete()
+        response = self.client.post('/admin/movies/movie/{}/change/'.format(film_work.id), data)
+
+        # Строка, удаленная после открытия формы, дает ошибку формы, а не 500
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any(inline.formset.errors for inline in response.context['inline_admin_formsets']))
+
+
+class MovieCreditsApiTest(TestCase):
+    def setUp(self):
+        self.film_work = create_film_work()
+        self.alice, self.bob, self.carol, self.dave = (create_person(name) for name in ('Alice', 'Bob', 'Carol', 'Dave'))
+        for person, role in ((self.alice, 'actor'), (self.bob, 'director'), (self.carol, 'writer')):
+            PersonFilmWork.objects.create(film_work_id=self.film_work, person_id=person, role=role)
+        run_on_commit_callbacks()
+        FilmWorkChange.objects.all().delete()
+
+        self.user = User.objects.create_user('editor')
+        self.user.user_permissions.add(Permission.objects.get(codename='change_personfilmwork'))
+        self.client.force_login(self.user)
+        self.url = '/api/v1/movies/{}/credits/'.format(self.film_work.id)
+
+    def put_credits(self, *credits):
+        body = {'credits': [{'person_id': str(person.id), 'role': role} for person, role in credits]}
+        return self.client.put(self.url, json.dumps(body), content_type='application/json')
+
+    def get_credits(self):
+        return set(PersonFilmWork.objects.filter(film_work_id=self.film_work).values_list('person_id', 'role'))
+
+    def test_put_applies_diff(self):
+        response = self.put_credits((self.alice, 'actor'), (self.bob, 'director'), (self.dave, 'actor'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id': str(self.film_work.id), 'created': 1, 'deleted': 1, 'unchanged': 2})
+        self.assertEqual(self.get_credits(),
+                         {(self.alice.id, 'actor'), (self.bob.id, 'director'), (self.dave.id, 'actor')})
+
+    def test_put_writes_one_change_per_film(self):
+        self.put_credits((self.alice, 'actor'), (self.dave, 'actor'))
+        run_on_commit_callbacks()
+
+        self.assertEqual(list(FilmWorkChange.objects.values_list('film_work_id', flat=True)), [self.film_work.id])
+        film_work = FilmWork.objects.get(id=self.film_work.id)
+        self.assertEqual(film_work.actor_names, ['Alice', 'Dave'])
+        self.assertEqual(film_work.director_names, [])
+
+    def test_put_without_changes_writes_nothing(self):
+        response = self.put_credits((self.alice, 'actor'), (self.bob, 'director'), (self.carol, 'writer'))
+
+        self.assertEqual(response.json()['unchanged'], 3)
+        self.assertEqual(run_on_commit_callbacks(), [])
+        self.assertFalse(FilmWorkChange.objects.exists())
+
+    def test_put_requires_permission(self):
+        self.client.force_login(User.objects.create_user('viewer'))
+
+        response = self.put_credits((self.dave, 'actor'))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.get_credits()), 3)
+
+    def test_put_rejects_unknown_person(self):
+        body = {'credits': [{'person_id': str(uuid.uuid4()), 'role': 'actor'}]}
+
+        response = self.client.put(self.url, json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.get_credits()), 3)
+
+
+# Чтения API идут через отдельное соединение api, которое не видит данные незакоммиченной транзакции теста,
+# поэтому тесты API читают через default
+API_TEST_SETTINGS = {'DATABASE_ROUTERS': [], 'API_RATE_LIMIT': 0}
+
+
+@override_settings(MOVIES_CHANGES_SETTLE_SECONDS=0, **API_TEST_SETTINGS)
+@mock.patch('movies.api.v1.views.PAGINATE_BY', 2)
+class UpdatedSinceTest(TestCase):
+    def setUp(self):
+        self.since = timezone.now() - datetime.timedelta(hours=1)
+        self.tie = self.since + datetime.timedelta(minutes=10)
+        updated = [self.since - datetime.timedelta(minutes=1), self.since, self.tie, self.tie, self.tie,
+                   self.since + datetime.timedelta(minutes=20)]
+        self.film_works = []
+        for number, updated_at in enumerate(updated):
+            film_work = create_film_work('film {}'.format(number))
+            FilmWork.objects.filter(id=film_work.id).update(updated_at=updated_at)
+            self.film_works.append((updated_at, film_work.id))
+
+    def get_all(self, **params):
+        """
+        Все страницы выборки по курсорам next_updated_since и next_after_id
+        """
+        params = {'updated_since': self.since.isoformat(), 'fields': 'id', **params}
+        ids = []
+        while True:
+            response = self.client.get('/api/v1/movies/', params)
+            self.assertEqual(response.status_code, 200)
+            payload = response.json()
+            ids += [uuid.UUID(movie['id']) for movie in payload['results']]
+            if not payload['next_updated_since']:
+                return ids
+            params.update(updated_since=payload['next_updated_since'], after_id=payload['next_after_id'])
+
+    def test_pages_follow_updated_at_and_id(self):
+        expected = [film_work_id for updated_at, film_work_id in sorted(self.film_works) if updated_at >= self.since]
+
+        self.assertEqual(self.get_all(), expected)
+
+    def test_cursor_inside_tie(self):
+        ties = sorted(film_work_id for updated_at, film_work_id in self.film_works if updated_at == self.tie)
+
+        response = self.client.get('/api/v1/movies/', {'updated_since': self.tie.isoformat(), 'after_id': ties[0],
+                                                       'fields': 'id'})
+
+        self.assertEqual([uuid.UUID(movie['id']) for movie in response.json()['results']], ties[1:])
+
+    @override_settings(MOVIES_CHANGES_SETTLE_SECONDS=45 * 60)
+    def test_recent_changes_are_held_back(self):
+        # Фильмы изменены за 60, 50 и 40 минут до теста, отдаются только изменения старше 45 минут
+        settled = [film_work_id for updated_at, film_work_id in sorted(self.film_works)
+                   if self.since <= updated_at <= self.tie]
+
+        self.assertEqual(self.get_all(), settled)
+
+    def test_catalogue_version_is_not_computed(self):
+        response = self.client.get('/api/v1/movies/', {'updated_since': self.since.isoformat()})
+
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_open_transaction_holds_back_later_changes(self):
+        other = connection.copy()
+        other.set_autocommit(False)
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('SELECT txid_current()')
+        latest = create_film_work('latest')
+        expected = [film_work_id for updated_at, film_work_id in sorted(self.film_works) if updated_at >= self.since]
+
+        # Фильм изменен после начала чужой транзакции, которая еще может закоммитить изменение с меньшим updated_at
+        self.clear_activity_snapshot()
+        self.assertEqual(self.get_all(), expected)
+
+        other.rollback()
+        self.clear_activity_snapshot()
+        self.assertEqual(self.get_all(), expected + [latest.id])
+
+    @staticmethod
+    def clear_activity_snapshot():
+        """
+        Состояние сеансов в pg_stat_activity кэшируется до конца транзакции, а TestCase выполняет тесты класса
+        в одной транзакции
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_stat_clear_snapshot()')
+
+    def test_film_inserted_without_updated_at(self):
+        film_work_id = uuid.uuid4()
+        # Так пишет load_data.py: без updated_at
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO content.film_work (id, title, description, creation_date, certificate, "
+                           "file_path, rating, type) VALUES (%s, 'loaded', '', '2020-01-01', '', '', 5, 'movie')",
+                           [film_work_id])
+
+        self.assertEqual(self.get_all()[-1], film_work_id)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/movies/', {'updated_since': self.since.isoformat(), 'after_id': 'x'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(**API_TEST_SETTINGS)
+class MoviesChangesTest(TransactionTestCase):
+    """
+    Журнал читается во время чужой транзакции, поэтому тест коммитит данные.
+    TransactionTestCase очищает только таблицы схемы public, таблицы content очищаются в tearDown
+    """
+
+    def setUp(self):
+        self.other = connection.copy()
+        self.other.set_autocommit(False)
+
+    def tearDown(self):
+        self.other.rollback()
+        self.other.close()
+        FilmWork.objects.all().delete()
+        FilmWorkChange.objects.all().delete()
+
+    def get_changes(self, since=None):
+        response = self.client.get('/api/v1/movies/changes/', {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        payload = response.json()
+        return [uuid.UUID(movie['id']) for movie in payload['results']], payload['next_since']
+
+    def test_open_transaction_holds_back_later_changes(self):
+        first = create_film_work('first')
+        # Запись длинной транзакции (как у load_data.py) получает меньший id, чем изменение, закоммиченное после нее
+        with self.other.cursor() as cursor:
+            cursor.execute('INSERT INTO content.film_work_change (film_work_id, created_at) VALUES (%s, now())',
+                           [first.id])
+        second = create_film_work('second')
+
+        results, since = self.get_changes()
+        self.assertEqual(results, [first.id])
+        self.assertEqual(self.get_changes(since), ([], since))
+
+        self.other.commit()
+
+        results, since = self.get_changes(since)
+        self.assertCountEqual(results, [first.id, second.id])
+        self.assertEqual(self.get_changes(since), ([], since))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/movies/changes/', {'since': '1042'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportCatalogueTest(TransactionTestCase):
+    """
+    Снимок берет только записи журнала завершенных транзакций, поэтому тест коммитит данные.
+    Таблицы content очищаются в tearDown
+    """
+
+    def setUp(self):
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        self.output = output.name
+        self.film_works = [create_film_work('film {}'.format(number)) for number in range(3)]
+
+    def tearDown(self):
+        FilmWork.objects.all().delete()
+        FilmWorkChange.objects.all().delete()
+
+    def export(self, *args):
+        call_command('export_catalogue', *args, output=self.output, workers=1, chunk_size=2, stdout=io.StringIO())
+        return latest_manifest(self.output)
+
+    def read_rows(self, manifest):
+        rows = []
+        for part in manifest['files']:
+            with gzip.open(os.path.join(self.output, manifest['snapshot'], part['name']), 'rt') as part_file:
+                rows += [json.loads(line) for line in part_file]
+        return rows
+
+    def test_full_snapshot(self):
+        manifest = self.export()
+
+        self.assertEqual((manifest['type'], manifest['rows'], len(manifest['files'])), ('full', 3, 2))
+        rows = self.read_rows(manifest)
+        self.assertEqual([row['id'] for row in rows], sorted(str(film_work.id) for film_work in self.film_works))
+        self.assertEqual(set(rows[0]), set(manifest['columns']))
+
+    def test_incremental_snapshot(self):
+        base = self.export()
+        renamed, deleted, _ = self.film_works
+        deleted_id = deleted.id
+        renamed.title = 'renamed'
+        renamed.save()
+        deleted.delete()
+
+        manifest = self.export('--incremental')
+
+        self.assertEqual((manifest['type'], manifest['base']), ('incremental', base['snapshot']))
+        self.assertEqual(manifest['since_change_cursor'], base['change_cursor'])
+        self.assertEqual([row['title'] for row in self.read_rows(manifest)], ['renamed'])
+        with gzip.open(os.path.join(self.output, manifest['snapshot'], manifest['deleted']['name']), 'rt') as file:
+            self.assertEqual(file.read().split(), [str(deleted_id)])
+
+        self.assertEqual(self.export('--incremental')['rows'], 0)
+
+    def test_incremental_requires_base_snapshot(self):
+        with self.assertRaises(CommandError):
+            self.export('--incremental')
+
+
+@override_settings(**API_TEST_SETTINGS)
+@mock.patch('movies.api.v1.views.PAGINATE_BY', 2)
+class SortedMoviesTest(TestCase):
+    def setUp(self):
+        # В рабочей схеме (load_data/movies.sql) rating и creation_date допускают NULL, загрузчик пишет фильмы без них
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE content.film_work ALTER COLUMN rating DROP NOT NULL, '
+                           'ALTER COLUMN creation_date DROP NOT NULL')
+        values = [(7.5, datetime.date(2001, 1, 1)), (7.5, datetime.date(2001, 1, 1)), (7.5, None),
+                  (9, datetime.date(1999, 1, 1)), (None, datetime.date(2010, 1, 1)), (None, datetime.date(2001, 1, 1)),
+                  (None, None), (None, None)]
+        self.film_works = []
+        for number, (rating, creation_date) in enumerate(values):
+            film_work = create_film_work('film {}'.format(number))
+            FilmWork.objects.filter(id=film_work.id).update(rating=rating, creation_date=creation_date)
+            self.film_works.append({'id': film_work.id, 'rating': rating, 'creation_date': creation_date})
+
+    def get_all(self, sort, fields='id'):
+        params = {'sort': sort, 'fields': fields}
+        movies = []
+        while True:
+            response = self.client.get('/api/v1/movies/', params)
+            self.assertEqual(response.status_code, 200)
+            payload = response.json()
+            movies += payload['results']
+            if not payload['next_after']:
+                return movies
+            params['after'] = payload['next_after']
+
+    def expected(self, field, descending):
+        """
+        Фильмы со значением поля в порядке (поле, id), затем фильмы без значения в порядке id
+        """
+        present = sorted((film_work for film_work in self.film_works if film_work[field] is not None),
+                         key=lambda film_work: (film_work[field], film_work['id']), reverse=descending)
+        empty = sorted((film_work for film_work in self.film_works if film_work[field] is None),
+                       key=lambda film_work: film_work['id'], reverse=descending)
+        return [film_work['id'] for film_work in present + empty]
+
+    def test_pages_cover_ties_and_nulls(self):
+        for sort in ('rating', '-rating', 'creation_date', '-creation_date'):
+            with self.subTest(sort=sort):
+                movies = self.get_all(sort)
+
+                self.assertEqual([uuid.UUID(movie['id']) for movie in movies],
+                                 self.expected(sort.lstrip('-'), sort.startswith('-')))
+
+    def test_sort_field_only_when_requested(self):
+        self.assertEqual({key for movie in self.get_all('-rating') for key in movie}, {'id'})
+        self.assertEqual({key for movie in self.get_all('-rating', 'id,rating') for key in movie}, {'id', 'rating'})
+
+    def test_invalid_requests(self):
+        for params in ({'sort': 'title'}, {'sort': 'rating', 'page': 2}, {'sort': 'rating', 'after': 'x'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/v1/movies/', params).status_code, 400)
+
+
+@override_settings(**API_TEST_SETTINGS)
+class BatchMoviesTest(TestCase):
+    def setUp(self):
+        self.first, self.second = create_film_work('first'), create_film_work('second')
+
+    def test_results_in_requested_order(self):
+        missing = uuid.uuid4()
+        ids = [self.second.id, missing, self.first.id, self.second.id]
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/v1/movies/', {'ids': ','.join(map(str, ids))})
+
+        self.assertEqual([movie['title'] for movie in response.json()['results']], ['second', 'first'])
+        self.assertEqual(response.json()['missing'], [str(missing)])
+
+    def test_repeated_parameter(self):
+        response = self.client.get('/api/v1/movies/', {'ids': [self.first.id, self.second.id]})
+
+        self.assertEqual([movie['title'] for movie in response.json()['results']], ['first', 'second'])
+
+    @mock.patch('movies.api.v1.views.BATCH_MAX_IDS', 1)
+    def test_invalid_requests(self):
+        for ids in ('not-a-uuid', '{},{}'.format(self.first.id, self.second.id)):
+            with self.subTest(ids=ids):
+                self.assertEqual(self.client.get('/api/v1/movies/', {'ids': ids}).status_code, 400)
+
+
+@override_settings(**API_TEST_SETTINGS)
+class MovieFieldsTest(TestCase):
+    def setUp(self):
+        self.film_work = create_film_work('first')
+        self.addCleanup(movie_cache.delete_many, [str(self.film_work.id)])
+
+    def test_list_selects_only_requested_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/movies/', {'fields': 'title,actors'})
+
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title', 'actors'})
+        page_sql = queries.captured_queries[-1]['sql']
+        self.assertIn('actor_names', page_sql)
+        self.assertNotIn('genre_names', page_sql)
+        self.assertNotIn('description', page_sql)
+
+    def test_sorted_list_omits_unrequested_sort_field(self):
+        response = self.client.get('/api/v1/movies/', {'fields': 'title', 'sort': '-rating'})
+
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+
+    def test_detail(self):
+        response = self.client.get('/api/v1/movies/{}/'.format(self.film_work.id), {'fields': 'genres'})
+
+        self.assertEqual(response.json(), {'id': str(self.film_work.id), 'genres': []})
+
+    def test_unknown_field(self):
+        response = self.client.get('/api/v1/movies/', {'fields': 'title,budget'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'unknown fields: budget')
+
+
+@override_settings(**API_TEST_SETTINGS)
+class ConditionalRequestsTest(TestCase):
+    def setUp(self):
+        self.film_work = create_film_work('first')
+        self.other = create_film_work('second')
+        run_on_commit_callbacks()
+
+    def get_etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        return response['ETag']
+
+    def test_list_not_modified(self):
+        etag = self.get_etag('/api/v1/movies/')
+
+        # Проверка версии читает три строки по индексам и не выполняет запрос страницы
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/movies/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_changes_after_update(self):
+        etag = self.get_etag('/api/v1/movies/')
+
+        self.other.title = 'renamed'
+        self.other.save()
+
+        self.assertEqual(self.client.get('/api/v1/movies/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_changes_after_delete(self):
+        etag = self.get_etag('/api/v1/movies/')
+
+        # Удаление не меняет max(updated_at) оставшихся фильмов
+        self.other.delete()
+
+        self.assertEqual(self.client.get('/api/v1/movies/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unversioned_list(self):
+        response = self.client.get('/api/v1/movies/', {'sort': 'rating'})
+
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_detail_not_modified_until_changed(self):
+        url = '/api/v1/movies/{}/'.format(self.film_work.id)
+        etag = self.get_etag(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.film_work.title = 'renamed'
+        self.film_work.save()
+        run_on_commit_callbacks()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'renamed')
+
+
+
+@override_settings(**API_TEST_SETTINGS)
+class MovieCacheTest(TestCase):
+    def setUp(self):
+        self.film_work = create_film_work('first')
+        self.url = '/api/v1/movies/{}/'.format(self.film_work.id)
+        self.addCleanup(movie_cache.delete_many, [str(self.film_work.id)])
+
+    def get_title(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['title']
+
+    def rename_without_signals(self):
+        # Изменение в другом процессе: кэш этого процесса не очищается
+        FilmWork.objects.filter(pk=self.film_work.pk).update(title='renamed')
+
+    def test_cache_refresh_stores_fresh_movie(self):
+        self.get_title()
+        self.rename_without_signals()
+        self.assertEqual(self.get_title(), 'first')
+
+        self.assertEqual(self.get_title(HTTP_X_CACHE_REFRESH=cache_refresh_token()), 'renamed')
+        self.assertEqual(self.get_title(), 'renamed')
+
+    def test_pinned_request_bypasses_cache(self):
+        self.get_title()
+        self.rename_without_signals()
+
+        self.client.cookies[PIN_COOKIE] = pin_cookie_value()
+        self.assertEqual(self.get_title(), 'renamed')
+
+    def test_cached_movie_needs_no_queries(self):
+        self.get_title()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_title(), 'first')
+
+    def test_local_change_evicts_movie(self):
+        self.get_title()
+
+        self.film_work.title = 'renamed'
+        self.film_work.save()
+        run_on_commit_callbacks()
+
+        self.assertEqual(self.get_title(), 'renamed')
+
+    def test_missing_movie_is_not_cached(self):
+        missing = uuid.uuid4()
+
+        self.assertEqual(self.client.get('/api/v1/movies/{}/'.format(missing)).status_code, 404)
+        self.assertIsNone(movie_cache.get(str(missing)))
+
+
+@mock.patch('movies.api.v1.caching.time.monotonic', return_value=100)
+class LRUCacheTest(SimpleTestCase):
+    def test_expired_items(self, monotonic):
+        cache = LRUCache(max_size=10, ttl=5)
+        cache.set('a', 1)
+
+        monotonic.return_value = 104
+        self.assertEqual(cache.get('a'), 1)
+        monotonic.return_value = 106
+        self.assertIsNone(cache.get('a'))
+
+    def test_evicts_least_recently_used(self, monotonic):
+        cache = LRUCache(max_size=2, ttl=5)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual([cache.get(key) for key in ('a', 'b', 'c')], [1, None, 3])
+
+    def test_disabled(self, monotonic):
+        cache = LRUCache(max_size=0, ttl=5)
+        cache.set('a', 1)
+
+        self.assertIsNone(cache.get('a'))
+
+
+@override_settings(**API_TEST_SETTINGS)
+class PersonsGenresApiTest(TestCase):
+    def setUp(self):
+        self.first, self.second = create_film_work('first'), create_film_work('second')
+        self.actor, self.director, self.idle = (create_person('Actor'), create_person('Director'),
+                                                create_person('Idle'))
+        for film_work in (self.first, self.second):
+            PersonFilmWork.objects.create(film_work_id=film_work, person_id=self.actor, role='actor')
+        PersonFilmWork.objects.create(film_work_id=self.first, person_id=self.director, role='director')
+        PersonFilmWork.objects.create(film_work_id=self.first, person_id=self.director, role='writer')
+        self.drama = Genre.objects.create(name='drama', description='')
+        self.comedy = Genre.objects.create(name='comedy', description='')
+        GenreFilmWork.objects.create(film_work_id=self.first, genre_id=self.drama)
+        GenreFilmWork.objects.create(film_work_id=self.second, genre_id=self.drama)
+
+    def get_results(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_persons_with_film_counts(self):
+        results = self.get_results('/api/v1/persons/')
+
+        counts = {person['full_name']: person['film_counts'] for person in results}
+        self.assertEqual(counts, {
+            'Actor': {'actor': 2, 'director': 0, 'writer': 0},
+            'Director': {'actor': 0, 'director': 1, 'writer': 1},
+            'Idle': {'actor': 0, 'director': 0, 'writer': 0},
+        })
+        self.assertEqual([person['id'] for person in results], sorted(person['id'] for person in results))
+
+    def test_role_filter(self):
+        # Персона с двумя фильмами в роли попадает в выдачу один раз
+        for role, names in (('actor', ['Actor']), ('director', ['Director']), ('writer', ['Director'])):
+            with self.subTest(role=role):
+                results = self.get_results('/api/v1/persons/', {'role': role})
+                self.assertEqual([person['full_name'] for person in results], names)
+
+    def test_unknown_role(self):
+        self.assertEqual(self.client.get('/api/v1/persons/', {'role': 'producer'}).status_code, 400)
+
+    def test_persons_pages(self):
+        with mock.patch('movies.api.v1.views.PAGINATE_BY', 2):
+            first_page = self.client.get('/api/v1/persons/').json()
+            second_page = self.client.get('/api/v1/persons/', {'after': first_page['next_after']}).json()
+
+        ids = [person['id'] for person in first_page['results'] + second_page['results']]
+        self.assertEqual(ids, sorted(str(person.id) for person in (self.actor, self.director, self.idle)))
+        self.assertIsNone(second_page['next_after'])
+
+    def test_person_detail(self):
+        response = self.client.get('/api/v1/persons/{}/'.format(self.director.id))
+
+        self.assertEqual(response.json()['film_ids'], {
+            'actor': [], 'director': [str(self.first.id)], 'writer': [str(self.first.id)],
+        })
+        self.assertEqual(self.client.get('/api/v1/persons/{}/'.format(uuid.uuid4())).status_code, 404)
+
+    def test_genres_with_film_counts(self):
+        results = self.get_results('/api/v1/genres/')
+
+        self.assertEqual({genre['name']: genre['film_count'] for genre in results}, {'drama': 2, 'comedy': 0})
+
+
+@override_settings(REPLICA_DATABASES=['replica1', 'replica2'], REPLICA_MAX_LAG=5)
+@mock.patch('config.db_router.get_replica_lag')
+class ReplicaRoutingTest(SimpleTestCase):
+    def route(self, request):
+        """
+        :return: алиас, в который ReplicaRouter отправляет чтение во время запроса, и ответ
+        """
+        aliases = []
+
+        def get_response(request):
+            aliases.append(ReplicaRouter().db_for_read(FilmWork))
+            return HttpResponse()
+
+        response = ReplicaMiddleware(get_response)(request)
+        return aliases[0], response
+
+    def test_reads_from_replica_within_lag(self, get_replica_lag):
+        get_replica_lag.side_effect = {'replica1': 10, 'replica2': 1}.get
+
+        alias, _ = self.route(RequestFactory().get('/api/v1/movies/'))
+
+        self.assertEqual(alias, 'replica2')
+
+    def test_falls_back_to_primary(self, get_replica_lag):
+        get_replica_lag.side_effect = {'replica1': 10, 'replica2': None}.get
+
+        alias, _ = self.route(RequestFactory().get('/api/v1/movies/'))
+
+        self.assertEqual(alias, API_DATABASE)
+
+    def test_other_paths_use_default_routing(self, get_replica_lag):
+        alias, _ = self.route(RequestFactory().get('/admin/'))
+
+        self.assertIsNone(alias)
+        get_replica_lag.assert_not_called()
+
+    def test_write_pins_client_to_primary(self, get_replica_lag):
+        get_replica_lag.return_value = 0
+        _, response = self.route(RequestFactory().post('/admin/movies/movie/add/'))
+
+        request = RequestFactory().get('/api/v1/movies/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        alias, _ = self.route(request)
+
+        self.assertEqual(alias, API_DATABASE)
+        get_replica_lag.assert_not_called()
+
+    def test_forged_pin_is_ignored(self, get_replica_lag):
+        get_replica_lag.return_value = 0
+        request = RequestFactory().get('/api/v1/movies/')
+        request.COOKIES[PIN_COOKIE] = '1'
+
+        self.assertFalse(is_pinned(request))
+        self.assertIn(self.route(request)[0], ('replica1', 'replica2'))
+
+    def test_read_from_primary(self, get_replica_lag):
+        get_replica_lag.return_value = 0
+        aliases = []
+
+        def get_response(request):
+            with read_from_primary():
+                aliases.append(ReplicaRouter().db_for_read(FilmWork))
+            aliases.append(ReplicaRouter().db_for_read(FilmWork))
+            return HttpResponse()
+
+        ReplicaMiddleware(get_response)(RequestFactory().get('/api/v1/movies/'))
+
+        self.assertEqual(aliases[0], API_DATABASE)
+        self.assertIn(aliases[1], ('replica1', 'replica2'))
+
+
+@override_settings(API_COMPRESS_MIN_SIZE=100)
+class ApiCompressionTest(SimpleTestCase):
+    content = json.dumps({'results': [{'title': 'film {}'.format(number)} for number in range(100)]}).encode()
+
+    def compress(self, path='/api/v1/movies/', content=content, **headers):
+        def get_response(request):
+            response = HttpResponse(content, content_type='application/json')
+            response['ETag'] = '"version"'
+            return response
+
+        return ApiCompressionMiddleware(get_response)(RequestFactory().get(path, **headers))
+
+    def test_gzip(self):
+        response = self.compress(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(response['ETag'], 'W/"version"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_preferred(self):
+        response = self.compress(HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), self.content)
+
+    def test_refused_encodings(self):
+        response = self.compress(HTTP_ACCEPT_ENCODING='br;q=0, gzip;q=0')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.content)
+
+    def test_not_compressed(self):
+        for path, content in (('/api/v1/movies/', b'{}'), ('/admin/', self.content)):
+            with self.subTest(path=path):
+                response = self.compress(path, content, HTTP_ACCEPT_ENCODING='gzip')
+                self.assertFalse(response.has_header('Content-Encoding'))
+
+
+@override_settings(**API_TEST_SETTINGS)
+class ResponseFormatTest(TestCase):
+    def setUp(self):
+        self.film_work = create_film_work('first')
+
+    def test_columnar(self):
+        response = self.client.get('/api/v1/movies/', {'format': 'columnar', 'fields': 'title'})
+
+        self.assertEqual(response.json()['columns'], ['id', 'title'])
+        self.assertEqual(response.json()['rows'], [[str(self.film_work.id), 'first']])
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.client.get('/api/v1/movies/', {'format': 'msgpack', 'fields': 'title,creation_date'})
+
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        payload = msgpack.unpackb(response.content)
+        self.assertEqual(payload['columns'], ['id', 'title', 'creation_date'])
+        self.assertEqual(payload['rows'], [[str(self.film_work.id), 'first', '2020-01-01']])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/api/v1/movies/', {'format': 'xml'}).status_code, 400)
+
+
+class CountingEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.waiters = 0
+
+    def wait(self, timeout=None):
+        self.waiters += 1
+        return super().wait(timeout)
+
+
+class CountingFlight(Flight):
+    def __init__(self):
+        super().__init__()
+        self.done = CountingEvent()
+
+
+@mock.patch('movies.api.coalescing.Flight', CountingFlight)
+class SingleFlightTest(SimpleTestCase):
+    def run_concurrently(self, response, followers=3):
+        """
+        Первый вызов ждет, пока остальные встанут в очередь за ним
+        :return: количество выполнений функции и результаты всех вызовов
+        """
+        single_flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+            return response
+
+        results = []
+
+        def call():
+            results.append(single_flight.do('key', func, timeout=5))
+
+        threads = [threading.Thread(target=call)]
+        threads[0].start()
+        while not calls:
+            time.sleep(0.001)
+        flight = single_flight._flights['key']
+        threads += [threading.Thread(target=call) for _ in range(followers)]
+        for thread in threads[1:]:
+            thread.start()
+        while flight.done.waiters < followers:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return len(calls), results
+
+    def test_followers_share_response(self):
+        calls, results = self.run_concurrently(HttpResponse('payload'))
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(sorted(shared for response, shared in results), [False, True, True, True])
+        shared_response = next(response for response, shared in results if shared)
+        self.assertEqual(thaw_response(shared_response).content, b'payload')
+
+    def test_server_error_is_not_shared(self):
+        calls, results = self.run_concurrently(HttpResponse(status=500))
+
+        self.assertEqual(calls, 4)
+        self.assertFalse(any(shared for response, shared in results))
+
+
+class CoalesceRequestsTest(SimpleTestCase):
+    def test_request_key(self):
+        factory = RequestFactory()
+
+        self.assertEqual(get_request_key(factory.get('/api/v1/movies/', {'page': 2})),
+                         get_request_key(factory.get('/api/v1/movies/?page=2')))
+        self.assertNotEqual(get_request_key(factory.get('/api/v1/movies/')),
+                            get_request_key(factory.get('/api/v1/movies/', HTTP_IF_NONE_MATCH='"a"')))
+
+    @override_settings(API_COALESCE=True, API_COALESCE_CACHE='')
+    @mock.patch('movies.api.coalescing._flights')
+    def test_pinned_requests_are_not_coalesced(self, flights):
+        view = coalesce_requests(lambda request: HttpResponse())
+        request = RequestFactory().get('/api/v1/movies/')
+        request.COOKIES[PIN_COOKIE] = pin_cookie_value()
+
+        view(request)
+
+        flights.do.assert_not_called()
+
+    @override_settings(API_COALESCE_TIMEOUT=1, API_COALESCE_RESULT_TTL=10)
+    def test_shared_result_between_workers(self):
+        cache = caches['default']
+        self.addCleanup(cache.clear)
+        view = mock.Mock(return_value=HttpResponse('payload', content_type='application/json'))
+
+        first = wait_shared(cache, 'key', view)
+        second = wait_shared(cache, 'key', view)
+
+        self.assertEqual(view.call_count, 1)
+        self.assertEqual((second.content, second['Content-Type']), (first.content, 'application/json'))
+
+
+@mock.patch('movies.api.throttling.time.monotonic')
+class TokenBucketLimiterTest(SimpleTestCase):
+    def test_burst_then_limit(self, monotonic):
+        monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=2, burst=3, max_clients=10)
+
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+        self.assertEqual(limiter.acquire('b'), 0)
+
+    def test_refill(self, monotonic):
+        monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=2, burst=3, max_clients=10)
+        for _ in range(3):
+            limiter.acquire('a')
+
+        monotonic.return_value = 100.25
+        self.assertAlmostEqual(limiter.acquire('a'), 0.25)
+        monotonic.return_value = 100.5
+        self.assertEqual(limiter.acquire('a'), 0)
+        self.assertGreater(limiter.acquire('a'), 0)
+
+    def test_refill_is_capped_by_burst(self, monotonic):
+        monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=2, burst=3, max_clients=10)
+        limiter.acquire('a')
+
+        monotonic.return_value = 1000
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0, 0, 0])
+        self.assertGreater(limiter.acquire('a'), 0)
+
+    def test_least_recent_clients_are_evicted(self, monotonic):
+        monotonic.return_value = 100
+        limiter = TokenBucketLimiter(rate=1, burst=1, max_clients=2)
+        for client_key in ('a', 'b', 'a', 'c'):
+            limiter.acquire(client_key)
+
+        self.assertEqual(list(limiter.buckets), ['a', 'c'])
+
+
+@override_settings(API_KEYS=frozenset(['issued']), API_CLIENT_IP_HEADER='')
+class ClientKeyTest(SimpleTestCase):
+    def test_issued_key(self):
+        request = RequestFactory().get('/api/v1/movies/', HTTP_X_API_KEY='issued')
+
+        self.assertEqual(get_client_key(request), 'key:issued')
+
+    def test_unknown_key_falls_back_to_ip(self):
+        request = RequestFactory().get('/api/v1/movies/', HTTP_X_API_KEY='made-up', REMOTE_ADDR='10.0.0.7')
+
+        self.assertEqual(get_client_key(request), 'ip:10.0.0.7')
+
+
+@override_settings(API_RATE_LIMIT=1, API_RATE_BURST=1, API_RATE_LIMIT_CACHE='')
+class ThrottleMiddlewareTest(SimpleTestCase):
+    def setUp(self):
+        self.middleware = ApiThrottleMiddleware(lambda request: HttpResponse())
+
+    def get(self, **headers):
+        return self.middleware(RequestFactory().get('/api/v1/movies/', REMOTE_ADDR='10.0.0.7', **headers))
+
+    def test_client_is_limited(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.get().status_code, 429)
+
+    def test_signed_cache_refresh_is_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.get(HTTP_X_CACHE_REFRESH=cache_refresh_token()).status_code, 200)
+
+    def test_forged_cache_refresh_is_limited(self):
+        self.assertEqual(self.get(HTTP_X_CACHE_REFRESH='1').status_code, 200)
+        self.assertEqual(self.get(HTTP_X_CACHE_REFRESH='1:forged').status_code, 429)
+
+
+def import_load_data():
+    """
+    load_data.py - отдельный скрипт, а не модуль проекта, поэтому загружается по пути к файлу.
+    Переменные из load_data/.env, которые он читает при импорте, в окружение тестов не попадают
+    """
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'load_data', 'load_data.py')
+    spec = importlib.util.spec_from_file_location('load_data', path)
+    module = importlib.util.module_from_spec(spec)
+    with mock.patch.dict(os.environ):
+        spec.loader.exec_module(module)
+    return module
+
+
+class LoadDataValidatorTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.load_data = import_load_data()
+
+    def setUp(self):
+        self.validator = self.load_data.Validator()
+        self.film = self.load_data.Movie(id=uuid.uuid4(), title='Star Wars', type='movie', rating=8.5)
+        self.genre = self.load_data.Genre(id=uuid.uuid4(), name='Sci-Fi')
+        self.person = self.load_data.Person(id=uuid.uuid4(), full_name='Mark Hamill')
+
+    def check(self, film_works=(), genres=(), people=(), genre_film_works=(), person_film_works=()):
+        self.validator.check_objects({
+            'film_works': [self.film, *film_works],
+            'genres': [self.genre, *genres],
+            'people': [self.person, *people],
+            'genre_film_works': list(genre_film_works),
+            'person_film_works': list(person_film_works),
+        })
+        return dict(self.validator.counts)
+
+    def test_valid_objects(self):
+        load_data = self.load_data
+        counts = self.check(
+            genre_film_works=[load_data.GenreFilm(uuid.uuid4(), self.film.id, self.genre.id)],
+            person_film_works=[load_data.PersonFilm(uuid.uuid4(), self.film.id, self.person.id, 'actor')],
+        )
+
+        self.assertEqual(counts, {})
+        self.assertEqual(self.validator.errors, 0)
+
+    def test_errors(self):
+        load_data = self.load_data
+        counts = self.check(
+            film_works=[load_data.Movie(id=uuid.uuid4(), title='N/A', type='movie', rating=11.0),
+                        load_data.Movie(id=uuid.uuid4(), title='Cartoon', type='cartoon', rating='8')],
+            genres=[load_data.Genre(id=uuid.uuid4(), name='x' * 256)],
+            people=[load_data.Person(id=uuid.uuid4(), full_name=' ')],
+            person_film_works=[load_data.PersonFilm(uuid.uuid4(), self.film.id, uuid.uuid4(), 'actor')],
+        )
+
+        self.assertEqual(counts, {'not_available': 1, 'rating_out_of_range': 1, 'wrong_type': 2, 'too_long': 1,
+                                  'empty_value': 1, 'unknown_reference': 1})
+        self.assertEqual(self.validator.errors, 7)
+
+    def test_checks_are_not_errors(self):
+        load_data = self.load_data
+        credit = load_data.PersonFilm(uuid.uuid4(), self.film.id, self.person.id, 'actor')
+        counts = self.check(
+            film_works=[load_data.Movie(id=uuid.uuid4(), title='Star Wars', type='movie')],
+            genres=[load_data.Genre(id=uuid.uuid4(), name='sci-fi')],
+            people=[load_data.Person(id=uuid.uuid4(), full_name='Mark  Hamill')],
+            person_film_works=[credit, load_data.PersonFilm(uuid.uuid4(), self.film.id, self.person.id, 'actor')],
+        )
+
+        self.assertEqual(counts, {'duplicate_title': 1, 'similar_genre': 1, 'similar_person': 1,
+                                  'duplicate_credit': 1})
+        self.assertEqual(self.validator.errors, 0)
+
+    def test_missing_values_in_row(self):
+        self.validator.check_row({'description': None, 'rating': 'N/A', 'director': 'N/A',
+                                  'genres': ['Drama'], 'actors': ['N/A', 'Mark Hamill'], 'writers': ['N/A']})
+
+        self.assertEqual(dict(self.validator.counts), {
+            'no_description': 1, 'no_rating': 1, 'no_director': 1,
+            'not_available_genres': 0, 'not_available_actors': 1, 'not_available_writers': 1,
+        })
+
+    def test_examples_are_limited(self):
+        for number in range(5):
+            self.validator.add('too_long', number)
+
+        self.assertEqual(self.validator.counts['too_long'], 5)
+        self.assertEqual(self.validator.examples['too_long'], ['0', '1', '2'])
+
+
+class TimeOrderedUuidTest(SimpleTestCase):
+    def test_version_and_variant(self):
+        value = time_ordered_uuid()
+
+        self.assertEqual(value.version, 7)
+        self.assertEqual(value.variant, uuid.RFC_4122)
+
+    def test_timestamp_prefix(self):
+        with mock.patch('movies.models.time.time_ns', return_value=1600000000123456789):
+            value = time_ordered_uuid()
+
+        self.assertEqual(value.int >> 80, 1600000000123)
+
+    def test_ordered_by_creation_time(self):
+        with mock.patch('movies.models.time.time_ns') as time_ns:
+            values = []
+            for millisecond in range(1600000000000, 1600000000050):
+                time_ns.return_value = millisecond * 1000000
+                values.append(time_ordered_uuid())
+
+        self.assertEqual(sorted(values), values)
+        self.assertEqual(sorted(map(str, values)), [str(value) for value in values])